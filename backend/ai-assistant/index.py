@@ -1,8 +1,382 @@
 import json
+import math
 import os
+import contextvars
+import functools
+import random
+from contextlib import contextmanager
+import re
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 import requests
+import psycopg2
 from datetime import datetime
 
+FUNCTION_NAME = 'ai-assistant'
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 0.1))
+
+# >>> shared: metrics (benchmarks/sync_shared.py)
+_cold_start = True
+
+class ContextLocal:
+    '''Как threading.local, но на contextvars: своё состояние у каждого потока и у каждой задачи asyncio (index_async.py)'''
+    def __init__(self):
+        object.__setattr__(self, '_state', contextvars.ContextVar(f'context_local_{id(self)}', default={}))
+    
+    def __getattr__(self, name: str):
+        try:
+            return self._state.get()[name]
+        except KeyError:
+            raise AttributeError(name) from None
+    
+    def __setattr__(self, name: str, value):
+        self._state.set({**self._state.get(), name: value})
+
+_metrics = ContextLocal()
+
+def record_span(kind: str, seconds: float):
+    '''Учёт длительности операции (db_connect, db_query, http, ...) в метриках текущего запроса'''
+    spans = getattr(_metrics, 'spans', None)
+    if spans is None:
+        return
+    ms = seconds * 1000
+    spans[f'{kind}_ms'] = spans.get(f'{kind}_ms', 0) + ms
+    spans[f'{kind}_count'] = spans.get(f'{kind}_count', 0) + 1
+    spans[f'{kind}_max_ms'] = max(spans.get(f'{kind}_max_ms', 0), ms)
+
+@contextmanager
+def timed(kind: str):
+    '''Замер блока кода как операции kind'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(kind, time.perf_counter() - start)
+
+class TimedCursor(psycopg2.extensions.cursor):
+    '''Курсор, замеряющий время каждого запроса'''
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            return super().execute(query, vars)
+# <<< shared: metrics
+
+def db_connect():
+    '''Подключение к БД с замером времени соединения'''
+    with timed('db_connect'):
+        return psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=TimedCursor)
+
+# >>> shared: schema (benchmarks/sync_shared.py)
+def get_schema() -> str:
+    '''Префикс схемы БД для имён таблиц: запросы не зависят от search_path и работают через transaction pooler'''
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+    return f"{schema}." if schema else ""
+
+SCHEMA = get_schema()
+# <<< shared: schema
+
+http = requests.Session()
+http.hooks['response'].append(lambda r, *args, **kwargs: record_span('http', r.elapsed.total_seconds()))
+
+# >>> shared: circuit-breaker (benchmarks/sync_shared.py)
+# Размыкатели цепи для внешних зависимостей: после BREAKER_FAILURE_THRESHOLD ошибок подряд вызовы
+# BREAKER_RESET_SECONDS сразу уходят в запасной вариант вместо ожидания таймаута. Состояние — в пределах тёплого инстанса
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', 30))
+
+class CircuitOpenError(Exception):
+    '''Вызов отклонён без обращения к зависимости: цепь разомкнута'''
+
+class CircuitBreaker:
+    '''Размыкатель цепи: closed -> open после серии ошибок -> half_open (одна пробная попытка) -> closed или снова open'''
+    def __init__(self, name: str):
+        self.name = name
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        self._lock = threading.Lock()
+    
+    def _transition(self, state: str):
+        self.state = state
+        print(json.dumps({'metric': 'circuit_breaker', 'function': FUNCTION_NAME, 'dependency': self.name, 'state': state, 'failures': self.failures}))
+    
+    def acquire(self):
+        '''Разрешение на вызов; в разомкнутом состоянии — CircuitOpenError'''
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= BREAKER_RESET_SECONDS:
+                self._transition('half_open')
+            if self.state == 'open' or (self.state == 'half_open' and self.probing):
+                self.stats['rejected'] += 1
+                raise CircuitOpenError(f'{self.name} circuit is open')
+            self.probing = self.state == 'half_open'
+            self.stats['calls'] += 1
+    
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.probing = False
+            if self.state != 'closed':
+                self._transition('closed')
+    
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            self.stats['failures'] += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= BREAKER_FAILURE_THRESHOLD):
+                self.opened_at = time.monotonic()
+                self.stats['opened'] += 1
+                self._transition('open')
+    
+    @contextmanager
+    def guard(self):
+        '''Вызов зависимости внутри блока: исключение считается ошибкой, нормальный выход — успехом'''
+        self.acquire()
+        try:
+            yield
+        except Exception:
+            self.failure()
+            raise
+        except BaseException:
+            with self._lock:
+                self.probing = False
+            raise
+        self.success()
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.failures, **self.stats}
+# <<< shared: circuit-breaker
+
+OPENAI_BREAKER = CircuitBreaker('openai')
+
+# >>> shared: instrumented (benchmarks/sync_shared.py)
+def start_request() -> tuple:
+    '''Начало учёта запроса: (cold start, момент начала); спаны копятся до log_request'''
+    global _cold_start
+    cold_start, _cold_start = _cold_start, False
+    _metrics.spans = {}
+    return cold_start, time.perf_counter()
+
+def log_request(event: dict, result, error, cold_start: bool, start: float):
+    '''Структурированный JSON-лог запроса: cold start, ошибки, ответы 5xx и выборка METRICS_SAMPLE_RATE'''
+    total_ms = (time.perf_counter() - start) * 1000
+    status = (result or {}).get('statusCode', 500)
+    # Потоковое тело (генератор событий) уходит клиенту по частям, и его размер заранее неизвестен
+    body = (result or {}).get('body') or ''
+    if cold_start or error or status >= 500 or random.random() < METRICS_SAMPLE_RATE:
+        print(json.dumps({
+            'metric': 'request',
+            'function': FUNCTION_NAME,
+            'cold_start': cold_start,
+            'method': event.get('httpMethod'),
+            'endpoint': (event.get('queryStringParameters') or {}).get('endpoint'),
+            'status': status,
+            'total_ms': round(total_ms, 2),
+            'response_bytes': len(body.encode()) if isinstance(body, str) else None,
+            **{k: round(v, 2) for k, v in _metrics.spans.items()},
+            'error': error
+        }))
+    _metrics.spans = None
+
+def instrumented(func):
+    '''Метрика времени обработки запроса (log_request) вокруг обработчика'''
+    @functools.wraps(func)
+    def wrapper(event: dict, context) -> dict:
+        cold_start, start = start_request()
+        result = None
+        error = None
+        try:
+            result = func(event, context)
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            log_request(event, result, error, cold_start, start)
+    return wrapper
+# <<< shared: instrumented
+
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 600))
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 512))
+
+_search_cache = OrderedDict()
+_search_inflight = {}
+_search_lock = threading.Lock()
+
+WEATHER_PROVIDER = os.environ.get('WEATHER_PROVIDER', 'open-meteo')
+WEATHER_API_URL = os.environ.get('WEATHER_API_URL', 'https://api.open-meteo.com/v1/forecast')
+WEATHER_CACHE_TTL = int(os.environ.get('WEATHER_CACHE_TTL', 900))
+WEATHER_FETCH_TIMEOUT = float(os.environ.get('WEATHER_FETCH_TIMEOUT', 2))
+WEATHER_REFRESH_TIMEOUT = WEATHER_FETCH_TIMEOUT * 3
+
+_weather_cache = {}
+_weather_inflight = {}
+_weather_stats = {'hit': 0, 'miss': 0, 'stale': 0, 'unavailable': 0}
+_weather_lock = threading.Lock()
+
+PREMIUM_CACHE_TTL = int(os.environ.get('PREMIUM_CACHE_TTL', 60))
+
+_premium_cache = {}
+
+MATH_MAX_EXPONENT = 1000
+MATH_MAX_DIGITS = 1000
+# Разбор рекурсивный: глубина вложенности скобок и унарных минусов не больше числа токенов
+MATH_MAX_TOKENS = 200
+
+MATH_PHRASES = {
+    'умножить на': '*',
+    'умноженное на': '*',
+    'умножить': '*',
+    'разделить на': '/',
+    'поделить на': '/',
+    'делить на': '/',
+    'плюс': '+',
+    'минус': '-',
+    'в степени': '^',
+    'в квадрате': '^ 2',
+    'в кубе': '^ 3',
+    'процентов от': '% *',
+    'процента от': '% *',
+    'процент от': '% *',
+    '% от': '% *',
+    'процентов': '%',
+    'процента': '%',
+    'процент': '%',
+}
+
+MATH_PHRASES_RE = re.compile('|'.join(re.escape(p) for p in sorted(MATH_PHRASES, key=len, reverse=True)))
+MATH_TOKEN_RE = re.compile(r'(\d+(?:[.,]\d+)?)|(\*\*|[-+*/^()%×÷:])|([а-яёa-z]+)')
+
+MATH_OPERATOR_ALIASES = {'**': '^', '×': '*', '÷': '/', ':': '/', 'х': '*', 'x': '*'}
+
+MATH_BINARY_OPS = {
+    '+': (1, False, lambda a, b: a + b),
+    '-': (1, False, lambda a, b: a - b),
+    '*': (2, False, lambda a, b: a * b),
+    '/': (2, False, lambda a, b: a / b),
+    '^': (3, True, lambda a, b: _power(a, b)),
+}
+
+NUMBER_WORDS = {
+    'ноль': 0, 'один': 1, 'одна': 1, 'одно': 1, 'два': 2, 'две': 2, 'три': 3, 'четыре': 4,
+    'пять': 5, 'шесть': 6, 'семь': 7, 'восемь': 8, 'девять': 9, 'десять': 10,
+    'одиннадцать': 11, 'двенадцать': 12, 'тринадцать': 13, 'четырнадцать': 14, 'пятнадцать': 15,
+    'шестнадцать': 16, 'семнадцать': 17, 'восемнадцать': 18, 'девятнадцать': 19,
+    'двадцать': 20, 'тридцать': 30, 'сорок': 40, 'пятьдесят': 50, 'шестьдесят': 60,
+    'семьдесят': 70, 'восемьдесят': 80, 'девяносто': 90,
+    'сто': 100, 'двести': 200, 'триста': 300, 'четыреста': 400, 'пятьсот': 500,
+    'шестьсот': 600, 'семьсот': 700, 'восемьсот': 800, 'девятьсот': 900,
+    'тысяча': 1000, 'тысячи': 1000, 'тысяч': 1000,
+    'миллион': 1000000, 'миллиона': 1000000, 'миллионов': 1000000,
+}
+
+INTENT_KEYWORDS = {
+    'weather': ['погод'],
+    'math': ['+', '-', '*', '/', '^', '×', '÷', 'умножить', 'разделить', 'плюс', 'минус'],
+}
+
+INTENT_PRIORITY = ('weather', 'math')
+
+CITY_ALIASES = {
+    'санкт-петербург': 'spb',
+    'петербург': 'spb',
+    'питер': 'spb',
+    'спб': 'spb',
+    'москв': 'moscow',
+    'шушар': 'shushary',
+}
+
+CITIES = {
+    'spb': {'lat': 59.94, 'lon': 30.31},
+    'moscow': {'lat': 55.76, 'lon': 37.62},
+    'shushary': {'lat': 59.81, 'lon': 30.38},
+}
+
+CITIES_WEATHER = {
+    'spb': {'temp': 5, 'condition': 'Облачно с прояснениями'},
+    'moscow': {'temp': 3, 'condition': 'Переменная облачность'},
+    'shushary': {'temp': 4, 'condition': 'Облачно'},
+}
+
+WEATHER_CODES = {
+    0: 'Ясно',
+    1: 'Преимущественно ясно',
+    2: 'Переменная облачность',
+    3: 'Пасмурно',
+    45: 'Туман',
+    48: 'Туман с изморозью',
+    51: 'Морось',
+    53: 'Морось',
+    55: 'Сильная морось',
+    61: 'Небольшой дождь',
+    63: 'Дождь',
+    65: 'Сильный дождь',
+    66: 'Ледяной дождь',
+    67: 'Ледяной дождь',
+    71: 'Небольшой снег',
+    73: 'Снег',
+    75: 'Сильный снег',
+    77: 'Снежная крупа',
+    80: 'Ливень',
+    81: 'Ливень',
+    82: 'Сильный ливень',
+    85: 'Снегопад',
+    86: 'Сильный снегопад',
+    95: 'Гроза',
+    96: 'Гроза с градом',
+    99: 'Гроза с градом',
+}
+
+def build_keyword_automaton(keywords: dict) -> tuple:
+    '''Автомат Ахо-Корасик: keywords {строка: значение} -> (goto, fail, output)'''
+    goto = [{}]
+    output = [[]]
+    
+    for keyword, value in keywords.items():
+        node = 0
+        for char in keyword:
+            if char not in goto[node]:
+                goto.append({})
+                output.append([])
+                goto[node][char] = len(goto) - 1
+            node = goto[node][char]
+        output[node].append((len(keyword), value))
+    
+    fail = [0] * len(goto)
+    queue = list(goto[0].values())
+    for node in queue:
+        for char, child in goto[node].items():
+            queue.append(child)
+            state = fail[node]
+            while state and char not in goto[state]:
+                state = fail[state]
+            fail[child] = goto[state].get(char, 0)
+            output[child] = output[child] + output[fail[child]]
+    
+    return goto, fail, output
+
+def match_keywords(automaton: tuple, text: str):
+    '''Все вхождения ключевых слов за один проход: (позиция начала, значение)'''
+    goto, fail, output = automaton
+    node = 0
+    for i, char in enumerate(text):
+        while node and char not in goto[node]:
+            node = fail[node]
+        node = goto[node].get(char, 0)
+        for length, value in output[node]:
+            yield i - length + 1, value
+
+INTENT_ROUTER = build_keyword_automaton({
+    **{kw: ('intent', intent) for intent, kws in INTENT_KEYWORDS.items() for kw in kws},
+    **{alias: ('city', city) for alias, city in CITY_ALIASES.items()},
+})
+
+@instrumented
 def handler(event: dict, context) -> dict:
     '''ИИ голосовой помощник с поиском, погодой и математикой'''
     method = event.get('httpMethod', 'GET')
@@ -12,53 +386,142 @@ def handler(event: dict, context) -> dict:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization, X-Last-Write'
             },
             'body': ''
         }
     
+    if method == 'GET' and (event.get('queryStringParameters') or {}).get('endpoint') == 'stats':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'weather_cache': weather_cache_stats(), 'circuit_breakers': {'openai': OPENAI_BREAKER.snapshot()}})
+        }
+    
     if method == 'POST':
         data = json.loads(event.get('body', '{}'))
         query = data.get('query', '').lower()
-        is_premium = data.get('is_premium', False)
         
-        return process_query(query, is_premium)
+        auth_header = (event.get('headers') or {}).get('X-Authorization', '')
+        token_payload = decode_token(auth_header)
+        stream = data.get('stream', False)
+        
+        return process_query(query, token_payload, stream, stream and getattr(context, 'streaming', False))
     
     return {'statusCode': 404, 'body': json.dumps({'error': 'Not found'})}
 
-def process_query(query: str, is_premium: bool) -> dict:
+def decode_token(auth_header: str) -> dict:
+    '''Проверка JWT токена, возвращает payload или пустой dict'''
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return {}
+    
+    token = auth_header.replace('Bearer ', '')
+    
+    try:
+        import base64
+        import hmac
+        import hashlib
+        
+        parts = token.split('.')
+        if len(parts) != 3:
+            return {}
+        
+        header, payload_b64, signature = parts
+        
+        secret = os.environ.get('JWT_SECRET', 'default-secret-key')
+        expected_sig = base64.urlsafe_b64encode(
+            hmac.new(secret.encode(), f"{header}.{payload_b64}".encode(), hashlib.sha256).digest()
+        ).decode().rstrip('=')
+        
+        if not hmac.compare_digest(signature, expected_sig):
+            return {}
+        
+        payload = json.loads(base64.urlsafe_b64decode(payload_b64 + '=='))
+        if payload.get('exp', 0) < time.time():
+            return {}
+        return payload
+    except:
+        return {}
+
+def resolve_premium(payload: dict) -> bool:
+    '''Премиум-тариф пользователя: из claim токена или из кэша на PREMIUM_CACHE_TTL секунд'''
+    user_id = payload.get('user_id')
+    if not user_id:
+        return False
+    
+    if 'premium_until' in payload:
+        today = datetime.utcnow().strftime('%m-%d')
+        return bool(payload['premium_until'] and payload['premium_until'] > time.time()) or payload.get('birthday') == today
+    
+    cached = _premium_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
+    try:
+        conn = db_connect()
+        cur = conn.cursor()
+        cur.execute(f"SELECT premium_until, birthday FROM {SCHEMA}users WHERE id = %s", (user_id,))
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f'Premium lookup error: {e}')
+        return False
+    
+    is_premium = False
+    if row:
+        premium_until, birthday = row
+        today = datetime.utcnow().date()
+        is_premium = bool(premium_until and premium_until > datetime.utcnow()) or bool(
+            birthday and (birthday.month, birthday.day) == (today.month, today.day)
+        )
+    
+    _premium_cache[user_id] = (time.monotonic() + PREMIUM_CACHE_TTL, is_premium)
+    return is_premium
+
+def process_query(query: str, token_payload: dict, stream: bool = False, chunked: bool = False) -> dict:
     '''Обработка запроса пользователя'''
+    intent, city = classify_query(query)
     
-    if 'погода' in query:
-        return handle_weather(query)
+    if intent == 'weather':
+        return handle_weather(city)
     
-    if any(op in query for op in ['+', '-', '*', '/', 'умножить', 'разделить', 'плюс', 'минус']):
+    if intent == 'math':
         return handle_math(query)
     
+    is_premium = resolve_premium(token_payload)
+    
+    if stream:
+        return handle_search_stream(query, is_premium, chunked)
+    
     return handle_search(query, is_premium)
 
-def handle_weather(query: str) -> dict:
-    '''Предсказание погоды для Санкт-Петербург, Москва, Шушары'''
-    cities_weather = {
-        'санкт-петербург': {'temp': 5, 'condition': 'Облачно с прояснениями'},
-        'петербург': {'temp': 5, 'condition': 'Облачно с прояснениями'},
-        'спб': {'temp': 5, 'condition': 'Облачно с прояснениями'},
-        'москва': {'temp': 3, 'condition': 'Переменная облачность'},
-        'шушары': {'temp': 4, 'condition': 'Облачно'}
-    }
+def classify_query(query: str) -> tuple:
+    '''Намерение и первый упомянутый город за один проход по запросу'''
+    intents = set()
+    city = None
+    city_pos = len(query)
     
-    detected_city = None
-    for city in cities_weather:
-        if city in query:
-            detected_city = city
-            break
+    for pos, (kind, value) in match_keywords(INTENT_ROUTER, query):
+        if kind == 'intent':
+            intents.add(value)
+        elif pos < city_pos:
+            city, city_pos = value, pos
     
-    if not detected_city:
+    intent = next((i for i in INTENT_PRIORITY if i in intents), 'search')
+    return intent, city
+
+def handle_weather(city: str) -> dict:
+    '''Погода для Санкт-Петербурга, Москвы и Шушар из кэша провайдера'''
+    if not city:
         response = 'Погода доступна для городов: Санкт-Петербург, Москва и Шушары. Уточните город.'
     else:
-        weather = cities_weather[detected_city]
-        response = f"Температура {weather['temp']}°C. {weather['condition']}."
+        weather = get_weather(city)
+        if weather:
+            response = f"Температура {weather['temp']}°C. {weather['condition']}."
+        else:
+            response = 'Не удалось получить погоду: сервис погоды сейчас недоступен. Попробуйте позже.'
     
     return {
         'statusCode': 200,
@@ -66,56 +529,352 @@ def handle_weather(query: str) -> dict:
         'body': json.dumps({'response': response, 'type': 'weather'})
     }
 
+# Stale-while-revalidate: устаревшая запись отдаётся сразу, а обновление идёт в фоновом потоке, по одному на город.
+# Ждать провайдера приходится только при холодном промахе, и одновременные промахи ждут один запрос. Поток, замороженный
+# вместе с инстансом, может не завершиться: через WEATHER_REFRESH_TIMEOUT следующий запрос начинает обновление заново
+def get_weather(city: str):
+    '''Погода из кэша; устаревшая — сразу с обновлением в фоне, при промахе — запрос к провайдеру или None при его ошибке'''
+    with _weather_lock:
+        now = time.monotonic()
+        entry = _weather_cache.get(city)
+        if entry and entry[0] + WEATHER_CACHE_TTL > now:
+            _weather_stats['hit'] += 1
+            return entry[1]
+        
+        refresh = _weather_inflight.get(city)
+        is_leader = refresh is None or refresh[0] + WEATHER_REFRESH_TIMEOUT < now
+        if is_leader:
+            refresh = (now, Future())
+            _weather_inflight[city] = refresh
+        if entry:
+            _weather_stats['stale'] += 1
+    
+    if entry:
+        if is_leader:
+            threading.Thread(target=refresh_weather, args=(city, refresh), daemon=True).start()
+        return entry[1]
+    
+    weather = refresh_weather(city, refresh) if is_leader else refresh[1].result()
+    with _weather_lock:
+        _weather_stats['miss' if weather else 'unavailable'] += 1
+    return weather
+
+def refresh_weather(city: str, refresh: tuple):
+    '''Запрос к провайдеру: результат попадает в кэш и ко всем, кто ждёт этот город; при ошибке — None'''
+    try:
+        weather = WEATHER_PROVIDERS[WEATHER_PROVIDER](city)
+    except Exception as e:
+        print(f'Weather refresh error for {city}: {e}')
+        weather = None
+    
+    with _weather_lock:
+        if weather is not None:
+            _weather_cache[city] = (time.monotonic(), weather)
+        if _weather_inflight.get(city) is refresh:
+            del _weather_inflight[city]
+    
+    refresh[1].set_result(weather)
+    return weather
+
+def fetch_open_meteo(city: str) -> dict:
+    '''Текущая погода из Open-Meteo-совместимого API (WEATHER_API_URL)'''
+    coords = CITIES[city]
+    response = http.get(
+        WEATHER_API_URL,
+        params={'latitude': coords['lat'], 'longitude': coords['lon'], 'current_weather': 'true'},
+        timeout=WEATHER_FETCH_TIMEOUT
+    )
+    response.raise_for_status()
+    current = response.json()['current_weather']
+    return {
+        'temp': round(current['temperature']),
+        'condition': WEATHER_CODES.get(current.get('weathercode'), 'Без осадков')
+    }
+
+def fetch_static(city: str) -> dict:
+    '''Фиксированные значения без обращения к сети'''
+    return CITIES_WEATHER[city]
+
+WEATHER_PROVIDERS = {
+    'open-meteo': fetch_open_meteo,
+    'static': fetch_static,
+}
+
+def weather_cache_stats() -> dict:
+    '''Счётчики кэша погоды и доля попаданий'''
+    with _weather_lock:
+        stats = dict(_weather_stats)
+    total = sum(stats.values())
+    stats['hit_ratio'] = round(stats['hit'] / total, 4) if total else 0.0
+    return stats
+
 def handle_math(query: str) -> dict:
     '''Решение математических примеров'''
     try:
-        query = query.replace('умножить на', '*').replace('разделить на', '/')
-        query = query.replace('плюс', '+').replace('минус', '-')
-        query = query.replace('х', '*').replace('÷', '/')
+        result = evaluate_expression(query)
+        response = f'Ответ: {format_number(result)}'
+    except ValueError:
+        response = 'Не смог распознать пример. Попробуйте: "сколько будет 15 плюс 25"'
+    except ArithmeticError as e:
+        response = f'Ошибка вычисления: {str(e)}'
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'response': response, 'type': 'math'})
+    }
+
+def tokenize_expression(query: str) -> list:
+    '''Разбор запроса на числа и операторы; слова-числа сворачиваются в одно число'''
+    text = MATH_PHRASES_RE.sub(lambda m: f' {MATH_PHRASES[m.group(0)]} ', query.lower())
+    
+    tokens = []
+    words_value = None
+    words_current = 0
+    
+    for number, op, word in MATH_TOKEN_RE.findall(text):
+        if word in NUMBER_WORDS:
+            value = NUMBER_WORDS[word]
+            words_value = words_value or 0
+            if value >= 1000:
+                words_value += (words_current or 1) * value
+                words_current = 0
+            else:
+                words_current += value
+            continue
         
-        import re
-        numbers = re.findall(r'\d+\.?\d*', query)
-        operators = re.findall(r'[\+\-\*/]', query)
+        if words_value is not None or words_current:
+            tokens.append((words_value or 0) + words_current)
+            words_value = None
+            words_current = 0
         
-        if len(numbers) >= 2 and len(operators) >= 1:
-            expression = numbers[0]
-            for i, op in enumerate(operators):
-                if i + 1 < len(numbers):
-                    expression += op + numbers[i + 1]
-            
-            result = eval(expression)
-            response = f'Ответ: {result}'
-        else:
-            response = 'Не смог распознать пример. Попробуйте: "сколько будет 15 плюс 25"'
+        if number:
+            tokens.append(float(number.replace(',', '.')) if ('.' in number or ',' in number) else int(number))
+        elif op:
+            tokens.append(MATH_OPERATOR_ALIASES.get(op, op))
+        elif word in MATH_OPERATOR_ALIASES:
+            tokens.append(MATH_OPERATOR_ALIASES[word])
+    
+    if words_value is not None or words_current:
+        tokens.append((words_value or 0) + words_current)
+    
+    return tokens
+
+def evaluate_expression(query: str):
+    '''Вычисление выражения разбором с приоритетами операций (без eval)'''
+    tokens = tokenize_expression(query)
+    
+    if not any(isinstance(t, str) for t in tokens):
+        raise ValueError('no operators')
+    if len(tokens) > MATH_MAX_TOKENS:
+        raise ValueError('expression too long')
+    
+    value, pos = _parse_binary(tokens, 0, 1)
+    if pos != len(tokens):
+        raise ValueError(f'unexpected token {tokens[pos]!r}')
+    
+    return value
+
+def _parse_binary(tokens: list, pos: int, min_prec: int) -> tuple:
+    '''Precedence climbing: бинарные операторы с приоритетом не ниже min_prec'''
+    lhs, pos = _parse_unary(tokens, pos)
+    
+    while pos < len(tokens) and tokens[pos] in MATH_BINARY_OPS:
+        prec, right_assoc, apply = MATH_BINARY_OPS[tokens[pos]]
+        if prec < min_prec:
+            break
+        rhs, pos = _parse_binary(tokens, pos + 1, prec if right_assoc else prec + 1)
+        lhs = apply(lhs, rhs)
+        if isinstance(lhs, int) and lhs.bit_length() > MATH_MAX_DIGITS * 3.33 or isinstance(lhs, float) and math.isinf(lhs):
+            raise OverflowError('число слишком большое')
+    
+    return lhs, pos
+
+def _parse_unary(tokens: list, pos: int) -> tuple:
+    '''Унарные +/-, число или выражение в скобках, постфиксный %'''
+    if pos >= len(tokens):
+        raise ValueError('unexpected end of expression')
+    
+    token = tokens[pos]
+    
+    if token == '-' or token == '+':
+        value, pos = _parse_binary(tokens, pos + 1, MATH_BINARY_OPS['^'][0])
+        return (-value if token == '-' else value), pos
+    
+    if token == '(':
+        value, pos = _parse_binary(tokens, pos + 1, 1)
+        if pos >= len(tokens) or tokens[pos] != ')':
+            raise ValueError('unbalanced parentheses')
+        pos += 1
+    elif isinstance(token, str):
+        raise ValueError(f'unexpected token {token!r}')
+    else:
+        value = token
+        pos += 1
+    
+    while pos < len(tokens) and tokens[pos] == '%':
+        value = value / 100
+        pos += 1
+    
+    return value, pos
+
+def _power(base, exponent):
+    '''Возведение в степень с ограничением показателя и оценкой числа цифр результата до вычисления'''
+    if abs(exponent) > MATH_MAX_EXPONENT:
+        raise OverflowError('слишком большая степень')
+    if base and exponent * math.log10(abs(base)) > MATH_MAX_DIGITS:
+        raise OverflowError('число слишком большое')
+    try:
+        return base ** exponent
+    except OverflowError:
+        raise OverflowError('число слишком большое')
+
+def format_number(value) -> str:
+    '''Вывод результата без лишних .0 и хвостов округления'''
+    if isinstance(value, complex):
+        raise ArithmeticError('комплексный результат')
+    if isinstance(value, float):
+        value = round(value, 10)
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+def handle_search(query: str, is_premium: bool) -> dict:
+    '''Поиск информации через OpenAI GPT'''
+    api_key = os.environ.get('OPENAI_API_KEY')
+    
+    if not api_key:
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'response': f'Поиск по запросу: {query}', 'type': 'search'})
+        }
+    
+    model = 'gpt-4' if is_premium else 'gpt-3.5-turbo'
+    
+    try:
+        answer = cached_completion(api_key, query, model, 500 if is_premium else 150)
         
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'response': response, 'type': 'math'})
+            'body': json.dumps({'response': answer, 'type': 'ai', 'model': model})
         }
     except Exception as e:
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'response': f'Ошибка вычисления: {str(e)}', 'type': 'math'})
+            'body': json.dumps({'response': f'Ищу информацию по запросу: {query}', 'type': 'search'})
         }
 
-def handle_search(query: str, is_premium: bool) -> dict:
-    '''Поиск информации через OpenAI GPT'''
+# Среда функций отдаёт тело ответа целиком, поэтому обычно события собираются в один ответ: это совместимость
+# формата с клиентом, а не потоковая передача. Хост, который умеет отдавать тело по частям (context.streaming,
+# например benchmarks/dev_server.py), получает генератор событий, и фрагменты уходят клиенту по мере прихода от модели
+def handle_search_stream(query: str, is_premium: bool, chunked: bool = False) -> dict:
+    '''Поиск через OpenAI в формате server-sent events (text/event-stream)'''
     api_key = os.environ.get('OPENAI_API_KEY')
     
     if not api_key:
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'response': f'Поиск по запросу: {query}', 'type': 'search'})
-        }
+        return handle_search(query, is_premium)
+    
+    events = search_events(api_key, query, is_premium)
     
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'text/event-stream; charset=utf-8', 'Cache-Control': 'no-cache', 'Access-Control-Allow-Origin': '*'},
+        'body': events if chunked else ''.join(events)
+    }
+
+def search_events(api_key: str, query: str, is_premium: bool):
+    '''События ответа: фрагменты модели по мере прихода и завершающее событие с полным ответом'''
     model = 'gpt-4' if is_premium else 'gpt-3.5-turbo'
+    key = (normalize_query(query), model)
+    
+    answer = get_cached_answer(key)
+    if answer is not None:
+        yield sse_event({'delta': answer})
+        yield sse_event({'done': True, 'response': answer, 'type': 'ai', 'model': model})
+        return
+    
+    parts = []
+    try:
+        for delta in stream_completion(api_key, query, model, 500 if is_premium else 150):
+            parts.append(delta)
+            yield sse_event({'delta': delta})
+        store_answer(key, ''.join(parts))
+    except Exception:
+        if not parts:
+            # Тот же ответ, что handle_search отдаёт при ошибке: повторный запрос к OpenAI удвоил бы задержку
+            fallback = f'Ищу информацию по запросу: {query}'
+            yield sse_event({'delta': fallback})
+            yield sse_event({'done': True, 'response': fallback, 'type': 'search'})
+            return
+    
+    yield sse_event({'done': True, 'response': ''.join(parts), 'type': 'ai', 'model': model})
+
+def sse_event(data: dict) -> str:
+    '''Одно событие server-sent events'''
+    return f'data: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+def normalize_query(query: str) -> str:
+    '''Нормализация запроса для ключа кэша: регистр, пробелы, пунктуация'''
+    return ' '.join(re.findall(r'[\w+\-*/%.,]+', query.lower())).strip(' .,')
+
+def get_cached_answer(key: tuple):
+    '''Ответ из кэша или None, если записи нет или она устарела'''
+    with _search_lock:
+        entry = _search_cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            _search_cache.move_to_end(key)
+            return entry[1]
+    return None
+
+def store_answer(key: tuple, answer: str):
+    '''Сохранение ответа в кэш с вытеснением самых старых записей'''
+    with _search_lock:
+        _search_cache[key] = (time.monotonic() + SEARCH_CACHE_TTL, answer)
+        _search_cache.move_to_end(key)
+        while len(_search_cache) > SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
+
+def cached_completion(api_key: str, query: str, model: str, max_tokens: int) -> str:
+    '''Ответ модели с TTL/LRU-кэшем и объединением одинаковых одновременных запросов'''
+    key = (normalize_query(query), model)
+    
+    answer = get_cached_answer(key)
+    if answer is not None:
+        return answer
+    
+    with _search_lock:
+        future = _search_inflight.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _search_inflight[key] = future
+    
+    if not is_leader:
+        return future.result()
     
     try:
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
+        answer = request_completion(api_key, query, model, max_tokens)
+    except Exception as e:
+        with _search_lock:
+            _search_inflight.pop(key, None)
+        future.set_exception(e)
+        raise
+    
+    store_answer(key, answer)
+    with _search_lock:
+        _search_inflight.pop(key, None)
+    
+    future.set_result(answer)
+    return answer
+
+def request_completion(api_key: str, query: str, model: str, max_tokens: int) -> str:
+    '''Запрос к OpenAI-совместимому /chat/completions (OPENAI_BASE_URL)'''
+    with OPENAI_BREAKER.guard():
+        response = http.post(
+            f'{OPENAI_BASE_URL}/chat/completions',
             headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
             json={
                 'model': model,
@@ -123,23 +882,38 @@ def handle_search(query: str, is_premium: bool) -> dict:
                     {'role': 'system', 'content': 'Ты умный голосовой помощник. Отвечай кратко и по делу на русском языке.'},
                     {'role': 'user', 'content': query}
                 ],
-                'max_tokens': 500 if is_premium else 150,
+                'max_tokens': max_tokens,
                 'temperature': 0.7
             },
             timeout=15
         )
-        
-        result = response.json()
-        answer = result['choices'][0]['message']['content']
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'response': answer, 'type': 'ai', 'model': model})
-        }
-    except Exception as e:
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'response': f'Ищу информацию по запросу: {query}', 'type': 'search'})
-        }
+        return response.json()['choices'][0]['message']['content']
+
+def stream_completion(api_key: str, query: str, model: str, max_tokens: int):
+    '''Потоковый запрос к /chat/completions, отдаёт фрагменты ответа по мере прихода'''
+    with OPENAI_BREAKER.guard(), http.post(
+        f'{OPENAI_BASE_URL}/chat/completions',
+        headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
+        json={
+            'model': model,
+            'messages': [
+                {'role': 'system', 'content': 'Ты умный голосовой помощник. Отвечай кратко и по делу на русском языке.'},
+                {'role': 'user', 'content': query}
+            ],
+            'max_tokens': max_tokens,
+            'temperature': 0.7,
+            'stream': True
+        },
+        timeout=15,
+        stream=True
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line.startswith(b'data: '):
+                continue
+            data = line[6:].decode('utf-8')
+            if data == '[DONE]':
+                break
+            delta = json.loads(data)['choices'][0].get('delta', {}).get('content')
+            if delta:
+                yield delta
@@ -1,16 +1,495 @@
 import json
 import os
+import contextvars
+import functools
+import threading
+from contextlib import contextmanager
 import hashlib
 import secrets
 import time
-import smtplib
-from email.mime.text import MIMEText
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from urllib.parse import urlencode
-import requests
 import psycopg2
 import random
+import base64
 
+FUNCTION_NAME = 'api'
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 0.1))
+
+# >>> shared: metrics (benchmarks/sync_shared.py)
+_cold_start = True
+
+class ContextLocal:
+    '''Как threading.local, но на contextvars: своё состояние у каждого потока и у каждой задачи asyncio (index_async.py)'''
+    def __init__(self):
+        object.__setattr__(self, '_state', contextvars.ContextVar(f'context_local_{id(self)}', default={}))
+    
+    def __getattr__(self, name: str):
+        try:
+            return self._state.get()[name]
+        except KeyError:
+            raise AttributeError(name) from None
+    
+    def __setattr__(self, name: str, value):
+        self._state.set({**self._state.get(), name: value})
+
+_metrics = ContextLocal()
+
+def record_span(kind: str, seconds: float):
+    '''Учёт длительности операции (db_connect, db_query, http, ...) в метриках текущего запроса'''
+    spans = getattr(_metrics, 'spans', None)
+    if spans is None:
+        return
+    ms = seconds * 1000
+    spans[f'{kind}_ms'] = spans.get(f'{kind}_ms', 0) + ms
+    spans[f'{kind}_count'] = spans.get(f'{kind}_count', 0) + 1
+    spans[f'{kind}_max_ms'] = max(spans.get(f'{kind}_max_ms', 0), ms)
+
+@contextmanager
+def timed(kind: str):
+    '''Замер блока кода как операции kind'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(kind, time.perf_counter() - start)
+
+class TimedCursor(psycopg2.extensions.cursor):
+    '''Курсор, замеряющий время каждого запроса'''
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            return super().execute(query, vars)
+# <<< shared: metrics
+
+# >>> shared: replica (benchmarks/sync_shared.py)
+def db_connect():
+    '''Подключение к БД с замером времени соединения; внутри read_only-чтения — к реплике, если она видит запись клиента'''
+    if getattr(_routing, 'replica', False):
+        with timed('db_connect_replica'):
+            conn = psycopg2.connect(DATABASE_READ_URL, cursor_factory=TimedCursor, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        if replica_caught_up(conn):
+            return conn
+        conn.close()
+    with timed('db_connect'):
+        return psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=TimedCursor)
+
+# Реплика для чтения (необязательна). Отметку последней записи хранит клиент: ответ на запись несёт
+# LAST_WRITE_HEADER, клиент присылает его обратно, и REPLICA_READ_YOUR_WRITES_SECONDS после записи чтение
+# идёт на реплику, только если она уже воспроизвела транзакции с этого момента (на любом инстансе)
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL', '')
+LAST_WRITE_HEADER = 'X-Last-Write'
+REPLICA_READ_YOUR_WRITES_SECONDS = float(os.environ.get('REPLICA_READ_YOUR_WRITES_SECONDS', 5))
+REPLICA_RETRY_AFTER_SECONDS = float(os.environ.get('REPLICA_RETRY_AFTER_SECONDS', 30))
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 2))
+
+_routing = ContextLocal()
+_replica_down_until = 0.0
+
+REPLICA_CAUGHT_UP_SQL = "SELECT NOT pg_is_in_recovery() OR COALESCE(pg_last_xact_replay_timestamp() >= to_timestamp(%s), FALSE)"
+
+def note_write():
+    '''Отметка записи: время её начала уходит клиенту в LAST_WRITE_HEADER'''
+    _routing.wrote_at = time.time()
+
+def recent_write():
+    '''Отметка последней записи клиента, если она в окне REPLICA_READ_YOUR_WRITES_SECONDS, иначе None'''
+    last_write = getattr(_routing, 'last_write', 0.0)
+    if -REPLICA_READ_YOUR_WRITES_SECONDS <= time.time() - last_write <= REPLICA_READ_YOUR_WRITES_SECONDS:
+        return last_write
+    return None
+
+def replica_caught_up(conn) -> bool:
+    '''Видит ли реплика последнюю запись клиента: отметки нет, она вне окна или воспроизведение дошло до неё'''
+    last_write = recent_write()
+    if last_write is None:
+        return True
+    cur = conn.cursor()
+    cur.execute(REPLICA_CAUGHT_UP_SQL, (last_write,))
+    caught_up = cur.fetchone()[0]
+    cur.close()
+    return caught_up
+
+def use_replica() -> bool:
+    '''Можно ли читать с реплики: она настроена и не отмечена недоступной'''
+    return bool(DATABASE_READ_URL) and time.monotonic() >= _replica_down_until
+
+def start_routing(event: dict):
+    '''Отметка последней записи клиента из LAST_WRITE_HEADER запроса'''
+    try:
+        _routing.last_write = float((event.get('headers') or {}).get(LAST_WRITE_HEADER) or 0)
+    except ValueError:
+        _routing.last_write = 0.0
+    _routing.wrote_at = None
+
+def finish_routing(result):
+    '''Ответ на запись получает новую отметку в LAST_WRITE_HEADER'''
+    if _routing.wrote_at and isinstance(result, dict):
+        result['headers'] = {
+            **result.get('headers', {}),
+            LAST_WRITE_HEADER: f'{_routing.wrote_at:.3f}',
+            'Access-Control-Expose-Headers': LAST_WRITE_HEADER
+        }
+    return result
+
+def read_your_writes(func):
+    '''Отметка последней записи клиента берётся из LAST_WRITE_HEADER запроса; ответ на запись получает новую'''
+    @functools.wraps(func)
+    def wrapper(event: dict, context) -> dict:
+        start_routing(event)
+        return finish_routing(func(event, context))
+    return wrapper
+
+def mark_replica_down(operation: str, error: Exception):
+    '''Реплика недоступна: REPLICA_RETRY_AFTER_SECONDS чтения идут на основную БД'''
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER_SECONDS
+    print(json.dumps({'metric': 'replica_fallback', 'function': FUNCTION_NAME, 'operation': operation, 'error': repr(error)}))
+
+def read_only(func):
+    '''Чтение, которое выполняется на реплике, а при её ошибке повторяется на основной БД'''
+    @functools.wraps(func)
+    def wrapper(user_id: int, *args, **kwargs):
+        if not use_replica():
+            return func(user_id, *args, **kwargs)
+        _routing.replica = True
+        try:
+            return func(user_id, *args, **kwargs)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            mark_replica_down(func.__name__, e)
+        finally:
+            _routing.replica = False
+        return func(user_id, *args, **kwargs)
+    return wrapper
+# <<< shared: replica
+
+# >>> shared: schema (benchmarks/sync_shared.py)
+def get_schema() -> str:
+    '''Префикс схемы БД для имён таблиц: запросы не зависят от search_path и работают через transaction pooler'''
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+    return f"{schema}." if schema else ""
+
+SCHEMA = get_schema()
+# <<< shared: schema
+
+_http = None
+
+def get_http():
+    '''HTTP-сессия, создаётся при первом внешнем запросе (requests не грузится на холодном старте)'''
+    global _http
+    if _http is None:
+        import requests
+        _http = requests.Session()
+        _http.hooks['response'].append(lambda r, *args, **kwargs: record_span('http', r.elapsed.total_seconds()))
+    return _http
+
+# >>> shared: circuit-breaker (benchmarks/sync_shared.py)
+# Размыкатели цепи для внешних зависимостей: после BREAKER_FAILURE_THRESHOLD ошибок подряд вызовы
+# BREAKER_RESET_SECONDS сразу уходят в запасной вариант вместо ожидания таймаута. Состояние — в пределах тёплого инстанса
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', 30))
+
+class CircuitOpenError(Exception):
+    '''Вызов отклонён без обращения к зависимости: цепь разомкнута'''
+
+class CircuitBreaker:
+    '''Размыкатель цепи: closed -> open после серии ошибок -> half_open (одна пробная попытка) -> closed или снова open'''
+    def __init__(self, name: str):
+        self.name = name
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        self._lock = threading.Lock()
+    
+    def _transition(self, state: str):
+        self.state = state
+        print(json.dumps({'metric': 'circuit_breaker', 'function': FUNCTION_NAME, 'dependency': self.name, 'state': state, 'failures': self.failures}))
+    
+    def acquire(self):
+        '''Разрешение на вызов; в разомкнутом состоянии — CircuitOpenError'''
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= BREAKER_RESET_SECONDS:
+                self._transition('half_open')
+            if self.state == 'open' or (self.state == 'half_open' and self.probing):
+                self.stats['rejected'] += 1
+                raise CircuitOpenError(f'{self.name} circuit is open')
+            self.probing = self.state == 'half_open'
+            self.stats['calls'] += 1
+    
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.probing = False
+            if self.state != 'closed':
+                self._transition('closed')
+    
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            self.stats['failures'] += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= BREAKER_FAILURE_THRESHOLD):
+                self.opened_at = time.monotonic()
+                self.stats['opened'] += 1
+                self._transition('open')
+    
+    @contextmanager
+    def guard(self):
+        '''Вызов зависимости внутри блока: исключение считается ошибкой, нормальный выход — успехом'''
+        self.acquire()
+        try:
+            yield
+        except Exception:
+            self.failure()
+            raise
+        except BaseException:
+            with self._lock:
+                self.probing = False
+            raise
+        self.success()
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.failures, **self.stats}
+# <<< shared: circuit-breaker
+
+SMTP_BREAKER = CircuitBreaker('smtp')
+VK_BREAKER = CircuitBreaker('vk')
+
+# >>> shared: instrumented (benchmarks/sync_shared.py)
+def start_request() -> tuple:
+    '''Начало учёта запроса: (cold start, момент начала); спаны копятся до log_request'''
+    global _cold_start
+    cold_start, _cold_start = _cold_start, False
+    _metrics.spans = {}
+    return cold_start, time.perf_counter()
+
+def log_request(event: dict, result, error, cold_start: bool, start: float):
+    '''Структурированный JSON-лог запроса: cold start, ошибки, ответы 5xx и выборка METRICS_SAMPLE_RATE'''
+    total_ms = (time.perf_counter() - start) * 1000
+    status = (result or {}).get('statusCode', 500)
+    # Потоковое тело (генератор событий) уходит клиенту по частям, и его размер заранее неизвестен
+    body = (result or {}).get('body') or ''
+    if cold_start or error or status >= 500 or random.random() < METRICS_SAMPLE_RATE:
+        print(json.dumps({
+            'metric': 'request',
+            'function': FUNCTION_NAME,
+            'cold_start': cold_start,
+            'method': event.get('httpMethod'),
+            'endpoint': (event.get('queryStringParameters') or {}).get('endpoint'),
+            'status': status,
+            'total_ms': round(total_ms, 2),
+            'response_bytes': len(body.encode()) if isinstance(body, str) else None,
+            **{k: round(v, 2) for k, v in _metrics.spans.items()},
+            'error': error
+        }))
+    _metrics.spans = None
+
+def instrumented(func):
+    '''Метрика времени обработки запроса (log_request) вокруг обработчика'''
+    @functools.wraps(func)
+    def wrapper(event: dict, context) -> dict:
+        cold_start, start = start_request()
+        result = None
+        error = None
+        try:
+            result = func(event, context)
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            log_request(event, result, error, cold_start, start)
+    return wrapper
+# <<< shared: instrumented
+
+VK_PROFILE_CACHE_TTL = int(os.environ.get('VK_PROFILE_CACHE_TTL', 3600))
+
+_vk_profile_cache = {}
+
+PREMIUM_STATUS_SQL = f"SELECT premium_until, premium_type, birthday FROM {SCHEMA}users WHERE id = %s"
+
+GET_PROFILE_SQL = f"SELECT id, email, name, avatar_url, birthday, premium_until, premium_type FROM {SCHEMA}users WHERE id = %s"
+
+STATISTICS_BY_TYPE_SQL = f"SELECT action_type, COUNT(*) as count FROM {SCHEMA}statistics WHERE user_id = %s GROUP BY action_type ORDER BY count DESC"
+
+STATISTICS_WEEK_SQL = f"SELECT COUNT(*) FROM {SCHEMA}statistics WHERE user_id = %s AND created_at > NOW() - INTERVAL '7 days'"
+
+# >>> shared: compression (benchmarks/sync_shared.py)
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+
+@functools.lru_cache(maxsize=None)
+def load_orjson():
+    '''Модуль orjson или None: импортируется при первой сериализации, а не на холодном старте'''
+    try:
+        import orjson
+        return orjson
+    except ImportError:
+        return None
+
+def dumps(obj) -> str:
+    '''JSON-сериализация больших ответов: orjson, если установлен, иначе стандартный json'''
+    orjson = load_orjson()
+    with timed('serialize'):
+        if orjson is not None:
+            return orjson.dumps(obj).decode()
+        return json.dumps(obj)
+
+@functools.lru_cache(maxsize=None)
+def load_brotli():
+    '''Модуль brotli или None, если он не установлен'''
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+def accepted_encodings(event: dict) -> set:
+    '''Кодировки из Accept-Encoding, кроме отключённых через q=0'''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'accept-encoding'), '') or ''
+    accepted = set()
+    for part in value.split(','):
+        name, _, params = part.partition(';')
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+def compress_response(event: dict, result: dict) -> dict:
+    '''Сжатие тела ответа brotli/gzip по Accept-Encoding, если оно не меньше COMPRESSION_MIN_BYTES'''
+    body = result.get('body') or ''
+    if result.get('statusCode') != 200 or result.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_BYTES:
+        return result
+    
+    accepted = accepted_encodings(event)
+    brotli = load_brotli() if 'br' in accepted else None
+    
+    with timed('compress'):
+        if brotli is not None:
+            encoding, compressed = 'br', brotli.compress(body.encode('utf-8'), quality=5)
+        elif 'gzip' in accepted:
+            import gzip
+            encoding, compressed = 'gzip', gzip.compress(body.encode('utf-8'), compresslevel=6)
+        else:
+            return result
+    
+    return {
+        **result,
+        'headers': {**result.get('headers', {}), 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'},
+        'body': base64.b64encode(compressed).decode(),
+        'isBase64Encoded': True
+    }
+# <<< shared: compression
+
+# >>> shared: idempotency (benchmarks/sync_shared.py)
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))
+IDEMPOTENCY_CLEANUP_RATE = float(os.environ.get('IDEMPOTENCY_CLEANUP_RATE', 0.01))
+# Незавершённый захват ключа (инстанс убит по таймауту посреди func) освобождается через несколько таймаутов функции
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 90))
+
+def idempotent(endpoint: str, user_id: int, key: str, data: dict, func, reissue: dict = None) -> dict:
+    '''Выполнение func() один раз на Idempotency-Key: повтор получает сохранённый ответ, а поля reissue (токены) — заново из него'''
+    if not key:
+        return func()
+    
+    if len(key) > 255:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Idempotency-Key is too long'})
+        }
+    
+    request_hash = hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    key_params = (user_id, endpoint, key)
+    
+    conn = db_connect()
+    conn.autocommit = True
+    cur = conn.cursor()
+    
+    # Удаление просроченных ключей — изредка, заодно с обычными запросами
+    if random.random() < IDEMPOTENCY_CLEANUP_RATE:
+        cur.execute(f"DELETE FROM {SCHEMA}idempotency_keys WHERE created_at < NOW() - make_interval(hours => %s)", (IDEMPOTENCY_TTL_HOURS,))
+    
+    # Занимаем ключ; просроченная запись или брошенный захват без ответа занимаются заново
+    cur.execute(
+        f"INSERT INTO {SCHEMA}idempotency_keys (user_id, endpoint, idempotency_key, request_hash) VALUES (%s, %s, %s, %s) "
+        "ON CONFLICT (user_id, endpoint, idempotency_key) DO UPDATE "
+        "SET request_hash = EXCLUDED.request_hash, status_code = NULL, response_body = NULL, "
+        "created_at = CURRENT_TIMESTAMP, claimed_at = CURRENT_TIMESTAMP "
+        "WHERE idempotency_keys.created_at < NOW() - make_interval(hours => %s) "
+        "OR idempotency_keys.status_code IS NULL AND idempotency_keys.request_hash = EXCLUDED.request_hash "
+        "AND idempotency_keys.claimed_at < NOW() - make_interval(secs => %s) RETURNING claimed_at",
+        (*key_params, request_hash, IDEMPOTENCY_TTL_HOURS, IDEMPOTENCY_LEASE_SECONDS)
+    )
+    claim = cur.fetchone()
+    
+    if claim is None:
+        cur.execute(
+            f"SELECT request_hash, status_code, response_body FROM {SCHEMA}idempotency_keys WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s",
+            key_params
+        )
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+        
+        if row and row[0] != request_hash:
+            return {
+                'statusCode': 422,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Idempotency-Key was already used with a different request'})
+            }
+        if not row or row[1] is None:
+            return {
+                'statusCode': 409,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'A request with this Idempotency-Key is in progress'})
+            }
+        body = row[2]
+        if reissue and row[1] == 200:
+            stored = json.loads(body)
+            body = json.dumps({**stored, **{field: make(stored) for field, make in reissue.items()}})
+        return {
+            'statusCode': row[1],
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Idempotent-Replayed': 'true'},
+            'body': body
+        }
+    
+    # Запись и удаление — только пока захват наш: по истечении аренды ключ мог занять повтор
+    owned_params = (*key_params, claim[0])
+    try:
+        result = func()
+    except Exception:
+        cur.execute(f"DELETE FROM {SCHEMA}idempotency_keys WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s AND claimed_at = %s", owned_params)
+        cur.close()
+        conn.close()
+        raise
+    
+    # Ошибки сервера не запоминаем: повтор должен выполниться заново
+    if result.get('statusCode', 500) < 500:
+        body = result.get('body', '')
+        if reissue and result['statusCode'] == 200:
+            body = json.dumps({field: value for field, value in json.loads(body).items() if field not in reissue})
+        cur.execute(
+            f"UPDATE {SCHEMA}idempotency_keys SET status_code = %s, response_body = %s WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s AND claimed_at = %s",
+            (result['statusCode'], body, *owned_params)
+        )
+    else:
+        cur.execute(f"DELETE FROM {SCHEMA}idempotency_keys WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s AND claimed_at = %s", owned_params)
+    cur.close()
+    conn.close()
+    
+    return result
+# <<< shared: idempotency
+
+@instrumented
+@read_your_writes
 def handler(event: dict, context) -> dict:
     '''Объединённый API: авторизация VK/Email, профиль, премиум, статистика'''
     method = event.get('httpMethod', 'GET')
@@ -21,7 +500,7 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization, Idempotency-Key, X-Last-Write'
             },
             'body': ''
         }
@@ -45,24 +524,40 @@ def handler(event: dict, context) -> dict:
         body = event.get('body', '{}')
         data = json.loads(body) if isinstance(body, str) else body
         return register_user(data)
+    elif endpoint == 'refresh':
+        body = event.get('body', '{}')
+        data = json.loads(body) if isinstance(body, str) else body
+        return refresh_access_token(data)
+    elif endpoint == 'stats' and method == 'GET':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'circuit_breakers': {'smtp': SMTP_BREAKER.snapshot(), 'vk': VK_BREAKER.snapshot()}})
+        }
     
     auth_header = event.get('headers', {}).get('X-Authorization', '')
-    user_id = verify_token(auth_header)
+    token_payload = decode_token(auth_header)
+    user_id = token_payload.get('user_id', 0)
     
-    if not user_id and endpoint not in ['vk-login', 'vk-callback', 'email-send-code', 'email-verify-code', 'email-register']:
+    if not user_id and endpoint not in ['vk-login', 'vk-callback', 'email-send-code', 'email-verify-code', 'email-register', 'refresh']:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': 'Unauthorized'})
         }
     
+    if method in ('POST', 'PUT'):
+        note_write()
+    
     if endpoint == 'premium':
         if method == 'GET':
-            return get_premium_status(user_id)
+            return get_premium_status(user_id, token_payload)
         elif method == 'POST':
             body = event.get('body', '{}')
             data = json.loads(body) if isinstance(body, str) else body
-            return activate_premium(user_id, data)
+            idempotency_key = event.get('headers', {}).get('Idempotency-Key', '')
+            return idempotent('activate_premium', user_id, idempotency_key, data, lambda: activate_premium(user_id, data),
+                              reissue={'access_token': lambda stored: create_jwt(user_id, premium_claims(stored))})
     elif endpoint == 'profile':
         if method == 'GET':
             return get_profile(user_id)
@@ -71,7 +566,7 @@ def handler(event: dict, context) -> dict:
             data = json.loads(body) if isinstance(body, str) else body
             return update_profile(user_id, data)
     elif endpoint == 'statistics':
-        return get_statistics(user_id)
+        return compress_response(event, get_statistics(user_id))
     
     return {'statusCode': 404, 'body': json.dumps({'error': 'Not found'})}
 
@@ -96,6 +591,29 @@ def handle_vk_login(event: dict) -> dict:
         'body': json.dumps({'redirect_url': auth_url})
     }
 
+# Вход через VK: новый пользователь создаётся, у существующего имя и аватар перезаписываются только
+# при изменении, иначе обновляется лишь last_login_at. Refresh token сохраняется тем же запросом
+VK_LOGIN_SQL = f"""
+    WITH ins AS (
+        INSERT INTO {SCHEMA}users (vk_id, email, name, avatar_url, email_verified, created_at, last_login_at)
+        VALUES (%s, %s, %s, %s, TRUE, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ON CONFLICT (vk_id) DO UPDATE
+        SET last_login_at = EXCLUDED.last_login_at, name = EXCLUDED.name, avatar_url = EXCLUDED.avatar_url
+        WHERE users.name IS DISTINCT FROM EXCLUDED.name OR users.avatar_url IS DISTINCT FROM EXCLUDED.avatar_url
+        RETURNING id, premium_until, premium_type, birthday
+    ), seen AS (
+        UPDATE {SCHEMA}users SET last_login_at = CURRENT_TIMESTAMP
+        WHERE vk_id = %s AND NOT EXISTS (SELECT 1 FROM ins)
+        RETURNING id, premium_until, premium_type, birthday
+    ), u AS (
+        SELECT * FROM ins UNION ALL SELECT * FROM seen
+    ), t AS (
+        INSERT INTO {SCHEMA}refresh_tokens (user_id, token_hash, expires_at)
+        SELECT id, %s, %s FROM u
+    )
+    SELECT id, premium_until, premium_type, birthday FROM u
+"""
+
 def handle_vk_callback(event: dict) -> dict:
     '''Обработка callback от VK и создание сессии'''
     params = event.get('queryStringParameters', {})
@@ -120,8 +638,12 @@ def handle_vk_callback(event: dict) -> dict:
         'code': code
     }
     
-    token_response = requests.get(token_url, params=token_params)
-    token_data = token_response.json()
+    try:
+        token_data = vk_get(token_url, token_params)
+    except CircuitOpenError:
+        return vk_unavailable()
+    except VkError:
+        return vk_failed()
     
     if 'error' in token_data:
         return {
@@ -131,50 +653,46 @@ def handle_vk_callback(event: dict) -> dict:
         }
     
     vk_user_id = str(token_data.get('user_id'))
-    email = token_data.get('email')
-    
-    api_url = 'https://api.vk.com/method/users.get'
-    api_params = {
-        'user_ids': vk_user_id,
-        'fields': 'photo_200',
-        'access_token': token_data['access_token'],
-        'v': '5.131'
-    }
+    email = (token_data.get('email') or '').lower().strip() or None
     
-    user_response = requests.get(api_url, params=api_params)
-    user_data = user_response.json().get('response', [{}])[0]
-    
-    name = f"{user_data.get('first_name', '')} {user_data.get('last_name', '')}"
-    avatar_url = user_data.get('photo_200')
+    try:
+        name, avatar_url = get_vk_profile(vk_user_id, token_data['access_token'])
+    except CircuitOpenError:
+        return vk_unavailable()
+    except VkError:
+        return vk_failed()
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
-    cur.execute("SELECT id FROM users WHERE vk_id = %s", (vk_user_id,))
-    user_row = cur.fetchone()
+    cur.execute(
+        f"""SELECT id, vk_id FROM {SCHEMA}users WHERE vk_id = %s OR LOWER(email) = %s
+            ORDER BY vk_id IS NOT DISTINCT FROM %s DESC LIMIT 1""",
+        (vk_user_id, email, vk_user_id)
+    )
+    account = cur.fetchone()
     
-    if user_row:
-        user_id = user_row[0]
-        cur.execute(
-            "UPDATE users SET last_login_at = CURRENT_TIMESTAMP, name = %s, avatar_url = %s WHERE id = %s",
-            (name, avatar_url, user_id)
-        )
-    else:
-        cur.execute(
-            "INSERT INTO users (vk_id, email, name, avatar_url, email_verified, created_at) VALUES (%s, %s, %s, %s, TRUE, CURRENT_TIMESTAMP) RETURNING id",
-            (vk_user_id, email, name, avatar_url)
-        )
-        user_id = cur.fetchone()[0]
+    if account and account[1] is None:
+        # Аккаунт с этим email ещё не привязан к VK — привязываем его, а не заводим второй
+        cur.execute(f"UPDATE {SCHEMA}users SET vk_id = %s WHERE id = %s", (vk_user_id, account[0]))
+    elif account and account[1] != vk_user_id:
+        cur.close()
+        conn.close()
+        return vk_email_conflict()
     
-    access_token = create_jwt(user_id)
     refresh_token = secrets.token_urlsafe(32)
     refresh_token_hash = hashlib.sha256(refresh_token.encode()).hexdigest()
     
-    cur.execute(
-        "INSERT INTO refresh_tokens (user_id, token_hash, expires_at) VALUES (%s, %s, %s)",
-        (user_id, refresh_token_hash, datetime.utcnow() + timedelta(days=30))
-    )
+    try:
+        cur.execute(VK_LOGIN_SQL, (vk_user_id, email, name, avatar_url, vk_user_id, refresh_token_hash, datetime.utcnow() + timedelta(days=30)))
+    except psycopg2.errors.UniqueViolation:
+        conn.rollback()
+        cur.close()
+        conn.close()
+        return vk_email_conflict()
+    user_id, premium_until, premium_type, birthday = cur.fetchone()
+    note_write()
+    access_token = create_jwt(user_id, (premium_until, premium_type, birthday))
     
     conn.commit()
     cur.close()
@@ -190,6 +708,69 @@ def handle_vk_callback(event: dict) -> dict:
         })
     }
 
+def vk_email_conflict() -> dict:
+    '''Email из VK уже принадлежит аккаунту, привязанному к другому VK'''
+    return {
+        'statusCode': 409,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Email is already linked to another VK account'})
+    }
+
+def vk_unavailable() -> dict:
+    '''Быстрый отказ, пока цепь VK разомкнута: клиент повторит вход позже'''
+    return {
+        'statusCode': 503,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Retry-After': str(int(BREAKER_RESET_SECONDS))},
+        'body': json.dumps({'error': 'VK is temporarily unavailable'})
+    }
+
+def vk_failed() -> dict:
+    '''VK ответил ошибкой сервера, не ответил вовремя или вернул не JSON'''
+    return {
+        'statusCode': 502,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'VK request failed'})
+    }
+
+class VkError(Exception):
+    '''Сбой запроса к VK: сеть, таймаут, 5xx или нечитаемый ответ'''
+
+def vk_get(url: str, params: dict) -> dict:
+    '''GET к VK под VK_BREAKER: сбои считаются ошибками размыкателя и поднимаются как VkError, 4xx с JSON — нет'''
+    import requests
+    try:
+        with VK_BREAKER.guard():
+            response = get_http().get(url, params=params, timeout=10)
+            if response.status_code >= 500:
+                response.raise_for_status()
+            return response.json()
+    except (requests.RequestException, ValueError) as e:
+        raise VkError(repr(e)) from e
+
+def get_vk_profile(vk_user_id: str, access_token: str) -> tuple:
+    '''Имя и аватар пользователя VK с кэшем на VK_PROFILE_CACHE_TTL секунд'''
+    cached = _vk_profile_cache.get(vk_user_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1], cached[2]
+    
+    api_url = 'https://api.vk.com/method/users.get'
+    api_params = {
+        'user_ids': vk_user_id,
+        'fields': 'photo_200',
+        'access_token': access_token,
+        'v': '5.131'
+    }
+    
+    user_data = vk_get(api_url, api_params).get('response', [{}])[0]
+    
+    name = f"{user_data.get('first_name', '')} {user_data.get('last_name', '')}"
+    avatar_url = user_data.get('photo_200')
+    
+    if user_data:
+        _vk_profile_cache[vk_user_id] = (time.monotonic() + VK_PROFILE_CACHE_TTL, name, avatar_url)
+    
+    return name, avatar_url
+
 def send_verification_code(data: dict) -> dict:
     '''Отправка кода подтверждения на email'''
     email = data.get('email', '').lower().strip()
@@ -203,15 +784,14 @@ def send_verification_code(data: dict) -> dict:
     
     code = ''.join([str(random.randint(0, 9)) for _ in range(6)])
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
-    cur.execute("UPDATE email_verification_codes SET expires_at = CURRENT_TIMESTAMP WHERE email = %s", (email,))
+    cur.execute(f"UPDATE {SCHEMA}email_verification_codes SET expires_at = CURRENT_TIMESTAMP WHERE email = %s", (email,))
     
     expires_at = datetime.utcnow() + timedelta(minutes=10)
     cur.execute(
-        "INSERT INTO email_verification_codes (email, code, expires_at) VALUES (%s, %s, %s)",
+        f"INSERT INTO {SCHEMA}email_verification_codes (email, code, expires_at) VALUES (%s, %s, %s)",
         (email, code, expires_at)
     )
     
@@ -229,6 +809,9 @@ def send_verification_code(data: dict) -> dict:
 
 def send_email(to_email: str, code: str):
     '''Отправка email через SMTP'''
+    import smtplib
+    from email.mime.text import MIMEText
+    
     smtp_host = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
     smtp_port = int(os.environ.get('SMTP_PORT', 587))
     smtp_user = os.environ.get('SMTP_USER')
@@ -240,7 +823,7 @@ def send_email(to_email: str, code: str):
     msg['To'] = to_email
     
     try:
-        with smtplib.SMTP(smtp_host, smtp_port, timeout=10) as server:
+        with SMTP_BREAKER.guard(), timed('smtp'), smtplib.SMTP(smtp_host, smtp_port, timeout=10) as server:
             server.starttls()
             server.login(smtp_user, smtp_pass)
             server.send_message(msg)
@@ -252,12 +835,11 @@ def verify_code(data: dict) -> dict:
     email = data.get('email', '').lower().strip()
     code = data.get('code', '').strip()
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
     cur.execute(
-        "SELECT code, expires_at FROM email_verification_codes WHERE email = %s ORDER BY created_at DESC LIMIT 1",
+        f"SELECT code, expires_at FROM {SCHEMA}email_verification_codes WHERE email = %s ORDER BY created_at DESC LIMIT 1",
         (email,)
     )
     row = cur.fetchone()
@@ -291,7 +873,7 @@ def verify_code(data: dict) -> dict:
             'body': json.dumps({'error': 'Invalid code'})
         }
     
-    cur.execute("UPDATE email_verification_codes SET expires_at = CURRENT_TIMESTAMP WHERE email = %s", (email,))
+    cur.execute(f"UPDATE {SCHEMA}email_verification_codes SET expires_at = CURRENT_TIMESTAMP WHERE email = %s", (email,))
     conn.commit()
     cur.close()
     conn.close()
@@ -315,30 +897,28 @@ def register_user(data: dict) -> dict:
             'body': json.dumps({'error': 'Email and password required'})
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
-    
-    cur.execute("SELECT id FROM users WHERE email = %s", (email,))
-    existing = cur.fetchone()
-    
-    if existing:
-        user_id = existing[0]
-    else:
-        cur.execute(
-            "INSERT INTO users (email, name, email_verified, created_at) VALUES (%s, %s, TRUE, CURRENT_TIMESTAMP) RETURNING id",
-            (email, name)
-        )
-        user_id = cur.fetchone()[0]
     
-    access_token = create_jwt(user_id)
     refresh_token = secrets.token_urlsafe(32)
     refresh_token_hash = hashlib.sha256(refresh_token.encode()).hexdigest()
     
     cur.execute(
-        "INSERT INTO refresh_tokens (user_id, token_hash, expires_at) VALUES (%s, %s, %s)",
-        (user_id, refresh_token_hash, datetime.utcnow() + timedelta(days=30))
+        f"""WITH u AS (
+            INSERT INTO {SCHEMA}users (email, name, email_verified, created_at, last_login_at)
+            VALUES (%s, %s, TRUE, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            ON CONFLICT ((LOWER(email))) DO UPDATE SET last_login_at = EXCLUDED.last_login_at
+            RETURNING id, premium_until, premium_type, birthday
+        ), t AS (
+            INSERT INTO {SCHEMA}refresh_tokens (user_id, token_hash, expires_at)
+            SELECT id, %s, %s FROM u
+        )
+        SELECT id, premium_until, premium_type, birthday FROM u""",
+        (email, name, refresh_token_hash, datetime.utcnow() + timedelta(days=30))
     )
+    user_id, premium_until, premium_type, birthday = cur.fetchone()
+    note_write()
+    access_token = create_jwt(user_id, (premium_until, premium_type, birthday))
     
     conn.commit()
     cur.close()
@@ -354,35 +934,85 @@ def register_user(data: dict) -> dict:
         })
     }
 
-def get_premium_status(user_id: int) -> dict:
-    '''Получение статуса премиум подписки'''
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
+REFRESH_TOKEN_SQL = f"""
+    SELECT u.id, u.premium_until, u.premium_type, u.birthday
+    FROM {SCHEMA}refresh_tokens rt
+    JOIN {SCHEMA}users u ON u.id = rt.user_id
+    WHERE rt.token_hash = %s AND rt.expires_at > %s
+"""
+
+def refresh_access_token(data: dict) -> dict:
+    '''Новый access token по refresh token, выданному при входе'''
+    refresh_token = data.get('refresh_token', '')
     
-    cur.execute(
-        "SELECT premium_until, premium_type, birthday FROM users WHERE id = %s",
-        (user_id,)
-    )
+    if not refresh_token:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'refresh_token is required'})
+        }
     
+    conn = db_connect()
+    cur = conn.cursor()
+    
+    cur.execute(REFRESH_TOKEN_SQL, (hashlib.sha256(refresh_token.encode()).hexdigest(), datetime.utcnow()))
     row = cur.fetchone()
+    
     cur.close()
     conn.close()
     
     if not row:
         return {
-            'statusCode': 404,
+            'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'User not found'})
+            'body': json.dumps({'error': 'Invalid or expired refresh token'})
         }
     
-    premium_until, premium_type, birthday = row
-    is_premium = premium_until and premium_until > datetime.utcnow()
+    user_id, premium_until, premium_type, birthday = row
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'access_token': create_jwt(user_id, (premium_until, premium_type, birthday)),
+            'expires_in': ACCESS_TOKEN_LIFETIME
+        })
+    }
+
+@read_only
+def get_premium_status(user_id: int, token_payload: dict) -> dict:
+    '''Получение статуса премиум подписки'''
+    if 'premium_until' in token_payload:
+        premium_until = datetime.utcfromtimestamp(token_payload['premium_until']) if token_payload['premium_until'] else None
+        premium_type = token_payload.get('premium_type')
+        birthday = token_payload.get('birthday')
+        birthday = tuple(int(part) for part in birthday.split('-')) if birthday else None
+    else:
+        conn = db_connect()
+        cur = conn.cursor()
+        
+        cur.execute(PREMIUM_STATUS_SQL, (user_id,))
+        
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+        
+        if not row:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'User not found'})
+            }
+        
+        premium_until, premium_type, birthday = row
+        birthday = (birthday.month, birthday.day) if birthday else None
+    
+    is_premium = bool(premium_until and premium_until > datetime.utcnow())
     is_birthday = False
     
     if birthday:
         today = datetime.utcnow().date()
-        is_birthday = (today.month == birthday.month and today.day == birthday.day)
+        is_birthday = (today.month, today.day) == birthday
     
     return {
         'statusCode': 200,
@@ -412,14 +1042,15 @@ def activate_premium(user_id: int, data: dict) -> dict:
             'body': json.dumps({'error': 'Invalid plan'})
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
     cur.execute(
-        "UPDATE users SET premium_until = %s, premium_type = %s WHERE id = %s",
+        f"UPDATE {SCHEMA}users SET premium_until = %s, premium_type = %s WHERE id = %s RETURNING birthday",
         (premium_until, premium_type, user_id)
     )
+    row = cur.fetchone()
+    birthday = row[0] if row else None
     
     conn.commit()
     cur.close()
@@ -431,20 +1062,24 @@ def activate_premium(user_id: int, data: dict) -> dict:
         'body': json.dumps({
             'message': 'Premium activated',
             'premium_until': premium_until.isoformat(),
-            'premium_type': premium_type
+            'premium_type': premium_type,
+            'birthday': birthday.isoformat() if birthday else None,
+            'access_token': create_jwt(user_id, (premium_until, premium_type, birthday))
         })
     }
 
+def premium_claims(body: dict) -> tuple:
+    '''Claims тарифа из сохранённого ответа activate_premium: токен при повторе запроса тот же, что и в первом ответе'''
+    birthday = date.fromisoformat(body['birthday']) if body.get('birthday') else None
+    return datetime.fromisoformat(body['premium_until']), body['premium_type'], birthday
+
+@read_only
 def get_profile(user_id: int) -> dict:
     '''Получение профиля пользователя'''
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
-    cur.execute(
-        "SELECT id, email, name, avatar_url, birthday, premium_until, premium_type FROM users WHERE id = %s",
-        (user_id,)
-    )
+    cur.execute(GET_PROFILE_SQL, (user_id,))
     
     row = cur.fetchone()
     cur.close()
@@ -473,15 +1108,22 @@ def get_profile(user_id: int) -> dict:
 
 def update_profile(user_id: int, data: dict) -> dict:
     '''Обновление профиля пользователя'''
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
     if 'name' in data:
-        cur.execute("UPDATE users SET name = %s WHERE id = %s", (data['name'], user_id))
+        cur.execute(f"UPDATE {SCHEMA}users SET name = %s WHERE id = %s", (data['name'], user_id))
+    
+    result = {'message': 'Profile updated'}
     
     if 'birthday' in data and data['birthday']:
-        cur.execute("UPDATE users SET birthday = %s WHERE id = %s", (data['birthday'], user_id))
+        cur.execute(
+            f"UPDATE {SCHEMA}users SET birthday = %s WHERE id = %s RETURNING premium_until, premium_type, birthday",
+            (data['birthday'], user_id)
+        )
+        row = cur.fetchone()
+        if row:
+            result['access_token'] = create_jwt(user_id, row)
     
     conn.commit()
     cur.close()
@@ -490,28 +1132,22 @@ def update_profile(user_id: int, data: dict) -> dict:
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'message': 'Profile updated'})
+        'body': json.dumps(result)
     }
 
+@read_only
 def get_statistics(user_id: int) -> dict:
     '''Получение статистики пользователя'''
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
-    cur.execute(
-        "SELECT action_type, COUNT(*) as count FROM statistics WHERE user_id = %s GROUP BY action_type ORDER BY count DESC",
-        (user_id,)
-    )
+    cur.execute(STATISTICS_BY_TYPE_SQL, (user_id,))
     
     stats = {}
     for row in cur.fetchall():
         stats[row[0]] = row[1]
     
-    cur.execute(
-        "SELECT COUNT(*) FROM statistics WHERE user_id = %s AND created_at > NOW() - INTERVAL '7 days'",
-        (user_id,)
-    )
+    cur.execute(STATISTICS_WEEK_SQL, (user_id,))
     
     week_count = cur.fetchone()[0]
     
@@ -521,15 +1157,18 @@ def get_statistics(user_id: int) -> dict:
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
+        'body': dumps({
             'total_actions': sum(stats.values()),
             'week_actions': week_count,
             'by_type': stats
         })
     }
 
-def create_jwt(user_id: int) -> str:
-    '''Создание JWT токена'''
+# Access token живёт час; клиент продлевает его через endpoint=refresh по refresh token со сроком 30 дней
+ACCESS_TOKEN_LIFETIME = 3600
+
+def create_jwt(user_id: int, premium: tuple = None) -> str:
+    '''Создание JWT токена; claims тарифа пишутся, только если передан premium = (premium_until, premium_type, birthday)'''
     import base64
     import hmac
     
@@ -537,8 +1176,13 @@ def create_jwt(user_id: int) -> str:
     
     payload = {
         'user_id': user_id,
-        'exp': int(time.time()) + 3600
+        'exp': int(time.time()) + ACCESS_TOKEN_LIFETIME
     }
+    if premium is not None:
+        premium_until, premium_type, birthday = premium
+        payload['premium_until'] = int(premium_until.replace(tzinfo=timezone.utc).timestamp()) if premium_until else None
+        payload['premium_type'] = premium_type
+        payload['birthday'] = birthday.strftime('%m-%d') if birthday else None
     payload_b64 = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
     
     secret = os.environ.get('JWT_SECRET', 'default-secret-key')
@@ -550,8 +1194,12 @@ def create_jwt(user_id: int) -> str:
 
 def verify_token(auth_header: str) -> int:
     '''Проверка JWT токена'''
+    return decode_token(auth_header).get('user_id', 0)
+
+def decode_token(auth_header: str) -> dict:
+    '''Проверка JWT токена, возвращает payload или пустой dict'''
     if not auth_header or not auth_header.startswith('Bearer '):
-        return 0
+        return {}
     
     token = auth_header.replace('Bearer ', '')
     
@@ -561,7 +1209,7 @@ def verify_token(auth_header: str) -> int:
         
         parts = token.split('.')
         if len(parts) != 3:
-            return 0
+            return {}
         
         header, payload_b64, signature = parts
         
@@ -570,10 +1218,12 @@ def verify_token(auth_header: str) -> int:
             hmac.new(secret.encode(), f"{header}.{payload_b64}".encode(), hashlib.sha256).digest()
         ).decode().rstrip('=')
         
-        if signature != expected_sig:
-            return 0
+        if not hmac.compare_digest(signature, expected_sig):
+            return {}
         
         payload = json.loads(base64.urlsafe_b64decode(payload_b64 + '=='))
-        return payload.get('user_id', 0)
+        if payload.get('exp', 0) < time.time():
+            return {}
+        return payload
     except:
-        return 0
\ No newline at end of file
+        return {}
\ No newline at end of file
@@ -0,0 +1,223 @@
+import asyncio
+import functools
+import json
+import os
+import weakref
+from contextlib import asynccontextmanager
+from datetime import datetime
+import psycopg
+from psycopg_pool import AsyncConnectionPool, PoolTimeout  # requirements-async.txt
+
+import index
+from index import decode_token, get_premium_status, dumps, compress_response, GET_PROFILE_SQL, STATISTICS_BY_TYPE_SQL, STATISTICS_WEEK_SQL
+
+# >>> shared: async-pool (benchmarks/sync_shared.py)
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+
+# Серверные prepared statements для горячих запросов. Через PgBouncer в режиме transaction
+# они работают с версии 1.21 (max_prepared_statements); для более старых пулеров DB_PREPARED_STATEMENTS=0
+PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') != '0'
+
+_pools = {}
+_pool_loop = None
+_pool_conns = weakref.WeakSet()
+
+class TimedAsyncCursor(psycopg.AsyncCursor):
+    '''Асинхронный курсор, замеряющий время каждого запроса'''
+    async def execute(self, query, params=None, **kwargs):
+        with index.timed('db_query'):
+            return await super().execute(query, params, **kwargs)
+
+async def remember_connection(conn) -> None:
+    '''Запоминает соединения пулов, чтобы закрыть их вместе с их event loop'''
+    _pool_conns.add(conn)
+
+def discard_pools() -> None:
+    '''Закрывает пулы прошлого event loop: на завершённом loop await pool.close() уже не выполнить'''
+    if _pool_loop.is_closed():
+        for conn in list(_pool_conns):
+            conn.pgconn.finish()
+    else:
+        for pool in _pools.values():
+            asyncio.run_coroutine_threadsafe(pool.close(), _pool_loop)
+    _pool_conns.clear()
+    _pools.clear()
+
+async def get_pool(url: str = None, connect_timeout: int = None) -> AsyncConnectionPool:
+    '''Пул соединений к url (по умолчанию DATABASE_URL), привязанный к текущему event loop; пулы прежнего loop закрываются'''
+    global _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool_loop is not loop:
+        if _pools:
+            discard_pools()
+        _pool_loop = loop
+    
+    url = url or os.environ['DATABASE_URL']
+    pool = _pools.get(url)
+    if pool is None:
+        pool = _pools[url] = AsyncConnectionPool(
+            url,
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            kwargs={
+                'prepare_threshold': 5 if PREPARED_STATEMENTS else None,
+                'cursor_factory': TimedAsyncCursor,
+                'connect_timeout': connect_timeout
+            },
+            configure=remember_connection,
+            open=False
+        )
+    if pool.closed:
+        await pool.open()
+    return pool
+# <<< shared: async-pool
+
+# >>> shared: async-routing (benchmarks/sync_shared.py)
+# Асинхронные варианты instrumented, read_your_writes и read_only из index.py. Состояние запроса (спаны метрик,
+# отметка записи, выбор реплики) там хранится в ContextLocal, поэтому у каждой задачи asyncio оно своё
+def instrumented_async(func):
+    '''instrumented для корутин: тот же JSON-лог запроса'''
+    @functools.wraps(func)
+    async def wrapper(event: dict, context) -> dict:
+        cold_start, start = index.start_request()
+        result = None
+        error = None
+        try:
+            result = await func(event, context)
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            index.log_request(event, result, error, cold_start, start)
+    return wrapper
+
+def read_your_writes_async(func):
+    '''read_your_writes для корутин'''
+    @functools.wraps(func)
+    async def wrapper(event: dict, context) -> dict:
+        index.start_routing(event)
+        return index.finish_routing(await func(event, context))
+    return wrapper
+
+def read_only_async(func):
+    '''read_only для корутин: чтение через пул реплики, при её ошибке — повтор на основном пуле'''
+    @functools.wraps(func)
+    async def wrapper(user_id: int, *args, **kwargs):
+        if not index.use_replica():
+            return await func(user_id, *args, **kwargs)
+        index._routing.replica = True
+        try:
+            return await func(user_id, *args, **kwargs)
+        except (psycopg.OperationalError, psycopg.InterfaceError, PoolTimeout) as e:
+            index.mark_replica_down(func.__name__, e)
+        finally:
+            index._routing.replica = False
+        return await func(user_id, *args, **kwargs)
+    return wrapper
+
+@asynccontextmanager
+async def connection():
+    '''Соединение из пула; внутри read_only_async — из пула реплики, если она видит запись клиента'''
+    if getattr(index._routing, 'replica', False):
+        pool = await get_pool(index.DATABASE_READ_URL, index.REPLICA_CONNECT_TIMEOUT)
+        async with pool.connection(timeout=index.REPLICA_CONNECT_TIMEOUT) as conn:
+            if await replica_caught_up(conn):
+                yield conn
+                return
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+async def replica_caught_up(conn) -> bool:
+    '''index.replica_caught_up для соединения psycopg 3'''
+    last_write = index.recent_write()
+    if last_write is None:
+        return True
+    cur = await conn.execute(index.REPLICA_CAUGHT_UP_SQL, (last_write,))
+    return (await cur.fetchone())[0]
+# <<< shared: async-routing
+
+async def handler(event: dict, context) -> dict:
+    '''Асинхронный API: горячие GET-эндпоинты на пуле, остальное — через синхронный обработчик'''
+    method = event.get('httpMethod', 'GET')
+    query_params = event.get('queryStringParameters') or {}
+    endpoint = query_params.get('endpoint', '')
+    
+    if method != 'GET' or endpoint not in ('profile', 'premium', 'statistics'):
+        return await asyncio.to_thread(index.handler, event, context)
+    return await pooled_handler(event, context)
+
+@instrumented_async
+@read_your_writes_async
+async def pooled_handler(event: dict, context) -> dict:
+    '''GET profile, premium и statistics на пуле соединений'''
+    endpoint = (event.get('queryStringParameters') or {}).get('endpoint', '')
+    
+    auth_header = event.get('headers', {}).get('X-Authorization', '')
+    token_payload = decode_token(auth_header)
+    user_id = token_payload.get('user_id', 0)
+    
+    if not user_id:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'})
+        }
+    
+    if endpoint == 'premium':
+        if 'premium_until' in token_payload:
+            return get_premium_status(user_id, token_payload)
+        return await asyncio.to_thread(get_premium_status, user_id, token_payload)
+    elif endpoint == 'profile':
+        return await get_profile(user_id)
+    return compress_response(event, await get_statistics(user_id))
+
+@read_only_async
+async def get_profile(user_id: int) -> dict:
+    '''Получение профиля пользователя'''
+    async with connection() as conn:
+        cur = await conn.execute(GET_PROFILE_SQL, (user_id,), prepare=PREPARED_STATEMENTS)
+        row = await cur.fetchone()
+    
+    if not row:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'User not found'})
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'id': row[0],
+            'email': row[1],
+            'name': row[2],
+            'avatar_url': row[3],
+            'birthday': row[4].isoformat() if row[4] else None,
+            'is_premium': row[5] and row[5] > datetime.utcnow(),
+            'premium_type': row[6]
+        })
+    }
+
+@read_only_async
+async def get_statistics(user_id: int) -> dict:
+    '''Получение статистики пользователя'''
+    async with connection() as conn:
+        cur = await conn.execute(STATISTICS_BY_TYPE_SQL, (user_id,), prepare=PREPARED_STATEMENTS)
+        stats = {row[0]: row[1] for row in await cur.fetchall()}
+    
+        cur = await conn.execute(STATISTICS_WEEK_SQL, (user_id,), prepare=PREPARED_STATEMENTS)
+        week_count = (await cur.fetchone())[0]
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({
+            'total_actions': sum(stats.values()),
+            'week_actions': week_count,
+            'by_type': stats
+        })
+    }
@@ -1,12 +1,398 @@
 import json
 import os
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
 import psycopg2
-import qrcode
-import io
 import base64
+import hashlib
 import random
 from datetime import datetime
 
+FUNCTION_NAME = 'documents'
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 0.1))
+
+# >>> shared: metrics (benchmarks/sync_shared.py)
+_cold_start = True
+
+class ContextLocal:
+    '''Как threading.local, но на contextvars: своё состояние у каждого потока и у каждой задачи asyncio (index_async.py)'''
+    def __init__(self):
+        object.__setattr__(self, '_state', contextvars.ContextVar(f'context_local_{id(self)}', default={}))
+    
+    def __getattr__(self, name: str):
+        try:
+            return self._state.get()[name]
+        except KeyError:
+            raise AttributeError(name) from None
+    
+    def __setattr__(self, name: str, value):
+        self._state.set({**self._state.get(), name: value})
+
+_metrics = ContextLocal()
+
+def record_span(kind: str, seconds: float):
+    '''Учёт длительности операции (db_connect, db_query, http, ...) в метриках текущего запроса'''
+    spans = getattr(_metrics, 'spans', None)
+    if spans is None:
+        return
+    ms = seconds * 1000
+    spans[f'{kind}_ms'] = spans.get(f'{kind}_ms', 0) + ms
+    spans[f'{kind}_count'] = spans.get(f'{kind}_count', 0) + 1
+    spans[f'{kind}_max_ms'] = max(spans.get(f'{kind}_max_ms', 0), ms)
+
+@contextmanager
+def timed(kind: str):
+    '''Замер блока кода как операции kind'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(kind, time.perf_counter() - start)
+
+class TimedCursor(psycopg2.extensions.cursor):
+    '''Курсор, замеряющий время каждого запроса'''
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            return super().execute(query, vars)
+# <<< shared: metrics
+
+# >>> shared: replica (benchmarks/sync_shared.py)
+def db_connect():
+    '''Подключение к БД с замером времени соединения; внутри read_only-чтения — к реплике, если она видит запись клиента'''
+    if getattr(_routing, 'replica', False):
+        with timed('db_connect_replica'):
+            conn = psycopg2.connect(DATABASE_READ_URL, cursor_factory=TimedCursor, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        if replica_caught_up(conn):
+            return conn
+        conn.close()
+    with timed('db_connect'):
+        return psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=TimedCursor)
+
+# Реплика для чтения (необязательна). Отметку последней записи хранит клиент: ответ на запись несёт
+# LAST_WRITE_HEADER, клиент присылает его обратно, и REPLICA_READ_YOUR_WRITES_SECONDS после записи чтение
+# идёт на реплику, только если она уже воспроизвела транзакции с этого момента (на любом инстансе)
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL', '')
+LAST_WRITE_HEADER = 'X-Last-Write'
+REPLICA_READ_YOUR_WRITES_SECONDS = float(os.environ.get('REPLICA_READ_YOUR_WRITES_SECONDS', 5))
+REPLICA_RETRY_AFTER_SECONDS = float(os.environ.get('REPLICA_RETRY_AFTER_SECONDS', 30))
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 2))
+
+_routing = ContextLocal()
+_replica_down_until = 0.0
+
+REPLICA_CAUGHT_UP_SQL = "SELECT NOT pg_is_in_recovery() OR COALESCE(pg_last_xact_replay_timestamp() >= to_timestamp(%s), FALSE)"
+
+def note_write():
+    '''Отметка записи: время её начала уходит клиенту в LAST_WRITE_HEADER'''
+    _routing.wrote_at = time.time()
+
+def recent_write():
+    '''Отметка последней записи клиента, если она в окне REPLICA_READ_YOUR_WRITES_SECONDS, иначе None'''
+    last_write = getattr(_routing, 'last_write', 0.0)
+    if -REPLICA_READ_YOUR_WRITES_SECONDS <= time.time() - last_write <= REPLICA_READ_YOUR_WRITES_SECONDS:
+        return last_write
+    return None
+
+def replica_caught_up(conn) -> bool:
+    '''Видит ли реплика последнюю запись клиента: отметки нет, она вне окна или воспроизведение дошло до неё'''
+    last_write = recent_write()
+    if last_write is None:
+        return True
+    cur = conn.cursor()
+    cur.execute(REPLICA_CAUGHT_UP_SQL, (last_write,))
+    caught_up = cur.fetchone()[0]
+    cur.close()
+    return caught_up
+
+def use_replica() -> bool:
+    '''Можно ли читать с реплики: она настроена и не отмечена недоступной'''
+    return bool(DATABASE_READ_URL) and time.monotonic() >= _replica_down_until
+
+def start_routing(event: dict):
+    '''Отметка последней записи клиента из LAST_WRITE_HEADER запроса'''
+    try:
+        _routing.last_write = float((event.get('headers') or {}).get(LAST_WRITE_HEADER) or 0)
+    except ValueError:
+        _routing.last_write = 0.0
+    _routing.wrote_at = None
+
+def finish_routing(result):
+    '''Ответ на запись получает новую отметку в LAST_WRITE_HEADER'''
+    if _routing.wrote_at and isinstance(result, dict):
+        result['headers'] = {
+            **result.get('headers', {}),
+            LAST_WRITE_HEADER: f'{_routing.wrote_at:.3f}',
+            'Access-Control-Expose-Headers': LAST_WRITE_HEADER
+        }
+    return result
+
+def read_your_writes(func):
+    '''Отметка последней записи клиента берётся из LAST_WRITE_HEADER запроса; ответ на запись получает новую'''
+    @functools.wraps(func)
+    def wrapper(event: dict, context) -> dict:
+        start_routing(event)
+        return finish_routing(func(event, context))
+    return wrapper
+
+def mark_replica_down(operation: str, error: Exception):
+    '''Реплика недоступна: REPLICA_RETRY_AFTER_SECONDS чтения идут на основную БД'''
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER_SECONDS
+    print(json.dumps({'metric': 'replica_fallback', 'function': FUNCTION_NAME, 'operation': operation, 'error': repr(error)}))
+
+def read_only(func):
+    '''Чтение, которое выполняется на реплике, а при её ошибке повторяется на основной БД'''
+    @functools.wraps(func)
+    def wrapper(user_id: int, *args, **kwargs):
+        if not use_replica():
+            return func(user_id, *args, **kwargs)
+        _routing.replica = True
+        try:
+            return func(user_id, *args, **kwargs)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            mark_replica_down(func.__name__, e)
+        finally:
+            _routing.replica = False
+        return func(user_id, *args, **kwargs)
+    return wrapper
+# <<< shared: replica
+
+# >>> shared: schema (benchmarks/sync_shared.py)
+def get_schema() -> str:
+    '''Префикс схемы БД для имён таблиц: запросы не зависят от search_path и работают через transaction pooler'''
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+    return f"{schema}." if schema else ""
+
+SCHEMA = get_schema()
+# <<< shared: schema
+
+# >>> shared: instrumented (benchmarks/sync_shared.py)
+def start_request() -> tuple:
+    '''Начало учёта запроса: (cold start, момент начала); спаны копятся до log_request'''
+    global _cold_start
+    cold_start, _cold_start = _cold_start, False
+    _metrics.spans = {}
+    return cold_start, time.perf_counter()
+
+def log_request(event: dict, result, error, cold_start: bool, start: float):
+    '''Структурированный JSON-лог запроса: cold start, ошибки, ответы 5xx и выборка METRICS_SAMPLE_RATE'''
+    total_ms = (time.perf_counter() - start) * 1000
+    status = (result or {}).get('statusCode', 500)
+    # Потоковое тело (генератор событий) уходит клиенту по частям, и его размер заранее неизвестен
+    body = (result or {}).get('body') or ''
+    if cold_start or error or status >= 500 or random.random() < METRICS_SAMPLE_RATE:
+        print(json.dumps({
+            'metric': 'request',
+            'function': FUNCTION_NAME,
+            'cold_start': cold_start,
+            'method': event.get('httpMethod'),
+            'endpoint': (event.get('queryStringParameters') or {}).get('endpoint'),
+            'status': status,
+            'total_ms': round(total_ms, 2),
+            'response_bytes': len(body.encode()) if isinstance(body, str) else None,
+            **{k: round(v, 2) for k, v in _metrics.spans.items()},
+            'error': error
+        }))
+    _metrics.spans = None
+
+def instrumented(func):
+    '''Метрика времени обработки запроса (log_request) вокруг обработчика'''
+    @functools.wraps(func)
+    def wrapper(event: dict, context) -> dict:
+        cold_start, start = start_request()
+        result = None
+        error = None
+        try:
+            result = func(event, context)
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            log_request(event, result, error, cold_start, start)
+    return wrapper
+# <<< shared: instrumented
+
+# >>> shared: compression (benchmarks/sync_shared.py)
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+
+@functools.lru_cache(maxsize=None)
+def load_orjson():
+    '''Модуль orjson или None: импортируется при первой сериализации, а не на холодном старте'''
+    try:
+        import orjson
+        return orjson
+    except ImportError:
+        return None
+
+def dumps(obj) -> str:
+    '''JSON-сериализация больших ответов: orjson, если установлен, иначе стандартный json'''
+    orjson = load_orjson()
+    with timed('serialize'):
+        if orjson is not None:
+            return orjson.dumps(obj).decode()
+        return json.dumps(obj)
+
+@functools.lru_cache(maxsize=None)
+def load_brotli():
+    '''Модуль brotli или None, если он не установлен'''
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+def accepted_encodings(event: dict) -> set:
+    '''Кодировки из Accept-Encoding, кроме отключённых через q=0'''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'accept-encoding'), '') or ''
+    accepted = set()
+    for part in value.split(','):
+        name, _, params = part.partition(';')
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+def compress_response(event: dict, result: dict) -> dict:
+    '''Сжатие тела ответа brotli/gzip по Accept-Encoding, если оно не меньше COMPRESSION_MIN_BYTES'''
+    body = result.get('body') or ''
+    if result.get('statusCode') != 200 or result.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_BYTES:
+        return result
+    
+    accepted = accepted_encodings(event)
+    brotli = load_brotli() if 'br' in accepted else None
+    
+    with timed('compress'):
+        if brotli is not None:
+            encoding, compressed = 'br', brotli.compress(body.encode('utf-8'), quality=5)
+        elif 'gzip' in accepted:
+            import gzip
+            encoding, compressed = 'gzip', gzip.compress(body.encode('utf-8'), compresslevel=6)
+        else:
+            return result
+    
+    return {
+        **result,
+        'headers': {**result.get('headers', {}), 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'},
+        'body': base64.b64encode(compressed).decode(),
+        'isBase64Encoded': True
+    }
+# <<< shared: compression
+
+GET_DOCUMENTS_SQL = f"SELECT id, document_type, first_name, last_name, middle_name, birth_date, passport_number, qr_code, created_at FROM {SCHEMA}documents WHERE user_id = %s ORDER BY created_at DESC"
+
+CREATE_DOCUMENT_SQL = f"INSERT INTO {SCHEMA}documents (user_id, document_type, first_name, last_name, middle_name, birth_date, passport_number, email, phone, country, apartment, qr_code, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP) RETURNING id"
+
+# >>> shared: idempotency (benchmarks/sync_shared.py)
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))
+IDEMPOTENCY_CLEANUP_RATE = float(os.environ.get('IDEMPOTENCY_CLEANUP_RATE', 0.01))
+# Незавершённый захват ключа (инстанс убит по таймауту посреди func) освобождается через несколько таймаутов функции
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 90))
+
+def idempotent(endpoint: str, user_id: int, key: str, data: dict, func, reissue: dict = None) -> dict:
+    '''Выполнение func() один раз на Idempotency-Key: повтор получает сохранённый ответ, а поля reissue (токены) — заново из него'''
+    if not key:
+        return func()
+    
+    if len(key) > 255:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Idempotency-Key is too long'})
+        }
+    
+    request_hash = hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    key_params = (user_id, endpoint, key)
+    
+    conn = db_connect()
+    conn.autocommit = True
+    cur = conn.cursor()
+    
+    # Удаление просроченных ключей — изредка, заодно с обычными запросами
+    if random.random() < IDEMPOTENCY_CLEANUP_RATE:
+        cur.execute(f"DELETE FROM {SCHEMA}idempotency_keys WHERE created_at < NOW() - make_interval(hours => %s)", (IDEMPOTENCY_TTL_HOURS,))
+    
+    # Занимаем ключ; просроченная запись или брошенный захват без ответа занимаются заново
+    cur.execute(
+        f"INSERT INTO {SCHEMA}idempotency_keys (user_id, endpoint, idempotency_key, request_hash) VALUES (%s, %s, %s, %s) "
+        "ON CONFLICT (user_id, endpoint, idempotency_key) DO UPDATE "
+        "SET request_hash = EXCLUDED.request_hash, status_code = NULL, response_body = NULL, "
+        "created_at = CURRENT_TIMESTAMP, claimed_at = CURRENT_TIMESTAMP "
+        "WHERE idempotency_keys.created_at < NOW() - make_interval(hours => %s) "
+        "OR idempotency_keys.status_code IS NULL AND idempotency_keys.request_hash = EXCLUDED.request_hash "
+        "AND idempotency_keys.claimed_at < NOW() - make_interval(secs => %s) RETURNING claimed_at",
+        (*key_params, request_hash, IDEMPOTENCY_TTL_HOURS, IDEMPOTENCY_LEASE_SECONDS)
+    )
+    claim = cur.fetchone()
+    
+    if claim is None:
+        cur.execute(
+            f"SELECT request_hash, status_code, response_body FROM {SCHEMA}idempotency_keys WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s",
+            key_params
+        )
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+        
+        if row and row[0] != request_hash:
+            return {
+                'statusCode': 422,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Idempotency-Key was already used with a different request'})
+            }
+        if not row or row[1] is None:
+            return {
+                'statusCode': 409,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'A request with this Idempotency-Key is in progress'})
+            }
+        body = row[2]
+        if reissue and row[1] == 200:
+            stored = json.loads(body)
+            body = json.dumps({**stored, **{field: make(stored) for field, make in reissue.items()}})
+        return {
+            'statusCode': row[1],
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Idempotent-Replayed': 'true'},
+            'body': body
+        }
+    
+    # Запись и удаление — только пока захват наш: по истечении аренды ключ мог занять повтор
+    owned_params = (*key_params, claim[0])
+    try:
+        result = func()
+    except Exception:
+        cur.execute(f"DELETE FROM {SCHEMA}idempotency_keys WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s AND claimed_at = %s", owned_params)
+        cur.close()
+        conn.close()
+        raise
+    
+    # Ошибки сервера не запоминаем: повтор должен выполниться заново
+    if result.get('statusCode', 500) < 500:
+        body = result.get('body', '')
+        if reissue and result['statusCode'] == 200:
+            body = json.dumps({field: value for field, value in json.loads(body).items() if field not in reissue})
+        cur.execute(
+            f"UPDATE {SCHEMA}idempotency_keys SET status_code = %s, response_body = %s WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s AND claimed_at = %s",
+            (result['statusCode'], body, *owned_params)
+        )
+    else:
+        cur.execute(f"DELETE FROM {SCHEMA}idempotency_keys WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s AND claimed_at = %s", owned_params)
+    cur.close()
+    conn.close()
+    
+    return result
+# <<< shared: idempotency
+
+@instrumented
+@read_your_writes
 def handler(event: dict, context) -> dict:
     '''API для создания и хранения документов с QR-кодами'''
     method = event.get('httpMethod', 'GET')
@@ -17,7 +403,7 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization, Idempotency-Key, X-Last-Write'
             },
             'body': ''
         }
@@ -33,10 +419,12 @@ def handler(event: dict, context) -> dict:
         }
     
     if method == 'GET':
-        return get_documents(user_id)
+        return compress_response(event, get_documents(user_id))
     elif method == 'POST':
+        note_write()
         data = json.loads(event.get('body', '{}'))
-        return create_document(user_id, data)
+        idempotency_key = event.get('headers', {}).get('Idempotency-Key', '')
+        return idempotent('create_document', user_id, idempotency_key, data, lambda: create_document(user_id, data))
     
     return {'statusCode': 404, 'body': json.dumps({'error': 'Not found'})}
 
@@ -63,24 +451,23 @@ def verify_token(auth_header: str) -> int:
             hmac.new(secret.encode(), f"{header}.{payload_b64}".encode(), hashlib.sha256).digest()
         ).decode().rstrip('=')
         
-        if signature != expected_sig:
+        if not hmac.compare_digest(signature, expected_sig):
             return 0
         
         payload = json.loads(base64.urlsafe_b64decode(payload_b64 + '=='))
+        if payload.get('exp', 0) < time.time():
+            return 0
         return payload.get('user_id', 0)
     except:
         return 0
 
+@read_only
 def get_documents(user_id: int) -> dict:
     '''Получение всех документов пользователя'''
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
-    cur.execute(
-        "SELECT id, document_type, first_name, last_name, middle_name, birth_date, passport_number, qr_code, created_at FROM documents WHERE user_id = %s ORDER BY created_at DESC",
-        (user_id,)
-    )
+    cur.execute(GET_DOCUMENTS_SQL, (user_id,))
     
     docs = []
     for row in cur.fetchall():
@@ -102,7 +489,7 @@ def get_documents(user_id: int) -> dict:
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'documents': docs})
+        'body': dumps({'documents': docs})
     }
 
 def create_document(user_id: int, data: dict) -> dict:
@@ -129,14 +516,14 @@ def create_document(user_id: int, data: dict) -> dict:
         'issued': datetime.utcnow().isoformat()
     }
     
-    qr_code_base64 = generate_qr_code(json.dumps(qr_data))
+    with timed('qr_render'):
+        qr_code_base64 = generate_qr_code(json.dumps(qr_data))
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
     cur.execute(
-        "INSERT INTO documents (user_id, document_type, first_name, last_name, middle_name, birth_date, passport_number, email, phone, country, apartment, qr_code, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP) RETURNING id",
+        CREATE_DOCUMENT_SQL,
         (user_id, doc_type, first_name, last_name, middle_name, birth_date, passport_number, email, phone, country, apartment, qr_code_base64)
     )
     
@@ -157,6 +544,9 @@ def create_document(user_id: int, data: dict) -> dict:
 
 def generate_qr_code(data: str) -> str:
     '''Генерация QR-кода в base64'''
+    import io
+    import qrcode
+    
     qr = qrcode.QRCode(version=1, box_size=10, border=4)
     qr.add_data(data)
     qr.make(fit=True)
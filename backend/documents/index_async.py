@@ -0,0 +1,245 @@
+import asyncio
+import functools
+import json
+import os
+import weakref
+from contextlib import asynccontextmanager
+import random
+from datetime import datetime
+import psycopg
+from psycopg_pool import AsyncConnectionPool, PoolTimeout  # requirements-async.txt
+
+import index
+from index import verify_token, dumps, compress_response, generate_qr_code, GET_DOCUMENTS_SQL, CREATE_DOCUMENT_SQL
+
+# >>> shared: async-pool (benchmarks/sync_shared.py)
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+
+# Серверные prepared statements для горячих запросов. Через PgBouncer в режиме transaction
+# они работают с версии 1.21 (max_prepared_statements); для более старых пулеров DB_PREPARED_STATEMENTS=0
+PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') != '0'
+
+_pools = {}
+_pool_loop = None
+_pool_conns = weakref.WeakSet()
+
+class TimedAsyncCursor(psycopg.AsyncCursor):
+    '''Асинхронный курсор, замеряющий время каждого запроса'''
+    async def execute(self, query, params=None, **kwargs):
+        with index.timed('db_query'):
+            return await super().execute(query, params, **kwargs)
+
+async def remember_connection(conn) -> None:
+    '''Запоминает соединения пулов, чтобы закрыть их вместе с их event loop'''
+    _pool_conns.add(conn)
+
+def discard_pools() -> None:
+    '''Закрывает пулы прошлого event loop: на завершённом loop await pool.close() уже не выполнить'''
+    if _pool_loop.is_closed():
+        for conn in list(_pool_conns):
+            conn.pgconn.finish()
+    else:
+        for pool in _pools.values():
+            asyncio.run_coroutine_threadsafe(pool.close(), _pool_loop)
+    _pool_conns.clear()
+    _pools.clear()
+
+async def get_pool(url: str = None, connect_timeout: int = None) -> AsyncConnectionPool:
+    '''Пул соединений к url (по умолчанию DATABASE_URL), привязанный к текущему event loop; пулы прежнего loop закрываются'''
+    global _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool_loop is not loop:
+        if _pools:
+            discard_pools()
+        _pool_loop = loop
+    
+    url = url or os.environ['DATABASE_URL']
+    pool = _pools.get(url)
+    if pool is None:
+        pool = _pools[url] = AsyncConnectionPool(
+            url,
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            kwargs={
+                'prepare_threshold': 5 if PREPARED_STATEMENTS else None,
+                'cursor_factory': TimedAsyncCursor,
+                'connect_timeout': connect_timeout
+            },
+            configure=remember_connection,
+            open=False
+        )
+    if pool.closed:
+        await pool.open()
+    return pool
+# <<< shared: async-pool
+
+# >>> shared: async-routing (benchmarks/sync_shared.py)
+# Асинхронные варианты instrumented, read_your_writes и read_only из index.py. Состояние запроса (спаны метрик,
+# отметка записи, выбор реплики) там хранится в ContextLocal, поэтому у каждой задачи asyncio оно своё
+def instrumented_async(func):
+    '''instrumented для корутин: тот же JSON-лог запроса'''
+    @functools.wraps(func)
+    async def wrapper(event: dict, context) -> dict:
+        cold_start, start = index.start_request()
+        result = None
+        error = None
+        try:
+            result = await func(event, context)
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            index.log_request(event, result, error, cold_start, start)
+    return wrapper
+
+def read_your_writes_async(func):
+    '''read_your_writes для корутин'''
+    @functools.wraps(func)
+    async def wrapper(event: dict, context) -> dict:
+        index.start_routing(event)
+        return index.finish_routing(await func(event, context))
+    return wrapper
+
+def read_only_async(func):
+    '''read_only для корутин: чтение через пул реплики, при её ошибке — повтор на основном пуле'''
+    @functools.wraps(func)
+    async def wrapper(user_id: int, *args, **kwargs):
+        if not index.use_replica():
+            return await func(user_id, *args, **kwargs)
+        index._routing.replica = True
+        try:
+            return await func(user_id, *args, **kwargs)
+        except (psycopg.OperationalError, psycopg.InterfaceError, PoolTimeout) as e:
+            index.mark_replica_down(func.__name__, e)
+        finally:
+            index._routing.replica = False
+        return await func(user_id, *args, **kwargs)
+    return wrapper
+
+@asynccontextmanager
+async def connection():
+    '''Соединение из пула; внутри read_only_async — из пула реплики, если она видит запись клиента'''
+    if getattr(index._routing, 'replica', False):
+        pool = await get_pool(index.DATABASE_READ_URL, index.REPLICA_CONNECT_TIMEOUT)
+        async with pool.connection(timeout=index.REPLICA_CONNECT_TIMEOUT) as conn:
+            if await replica_caught_up(conn):
+                yield conn
+                return
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+async def replica_caught_up(conn) -> bool:
+    '''index.replica_caught_up для соединения psycopg 3'''
+    last_write = index.recent_write()
+    if last_write is None:
+        return True
+    cur = await conn.execute(index.REPLICA_CAUGHT_UP_SQL, (last_write,))
+    return (await cur.fetchone())[0]
+# <<< shared: async-routing
+
+async def handler(event: dict, context) -> dict:
+    '''Асинхронный API документов: несколько запросов на один тёплый инстанс'''
+    method = event.get('httpMethod', 'GET')
+    query_params = event.get('queryStringParameters') or {}
+    
+    if query_params or method not in ('GET', 'POST') or (method == 'POST' and event.get('headers', {}).get('Idempotency-Key')):
+        return await asyncio.to_thread(index.handler, event, context)
+    return await pooled_handler(event, context)
+
+@instrumented_async
+@read_your_writes_async
+async def pooled_handler(event: dict, context) -> dict:
+    '''Список документов и создание без Idempotency-Key на пуле соединений'''
+    method = event.get('httpMethod', 'GET')
+    
+    auth_header = event.get('headers', {}).get('X-Authorization', '')
+    user_id = verify_token(auth_header)
+    
+    if not user_id:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'})
+        }
+    
+    if method == 'GET':
+        return compress_response(event, await get_documents(user_id))
+    
+    index.note_write()
+    data = json.loads(event.get('body', '{}'))
+    return await create_document(user_id, data)
+
+@read_only_async
+async def get_documents(user_id: int) -> dict:
+    '''Получение всех документов пользователя'''
+    async with connection() as conn:
+        cur = await conn.execute(GET_DOCUMENTS_SQL, (user_id,), prepare=PREPARED_STATEMENTS)
+        rows = await cur.fetchall()
+    
+    docs = []
+    for row in rows:
+        docs.append({
+            'id': row[0],
+            'type': row[1],
+            'first_name': row[2],
+            'last_name': row[3],
+            'middle_name': row[4],
+            'birth_date': row[5].isoformat() if row[5] else None,
+            'passport_number': row[6],
+            'qr_code': row[7],
+            'created_at': row[8].isoformat()
+        })
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({'documents': docs})
+    }
+
+async def create_document(user_id: int, data: dict) -> dict:
+    '''Создание нового документа; QR-код рендерится в пуле потоков, чтобы не блокировать event loop'''
+    doc_type = data.get('type', 'passport')
+    first_name = data.get('first_name', '')
+    last_name = data.get('last_name', '')
+    middle_name = data.get('middle_name', '')
+    birth_date = data.get('birth_date')
+    passport_number = data.get('passport_number', '')
+    email = data.get('email', '')
+    phone = data.get('phone', '')
+    country = data.get('country', '')
+    apartment = data.get('apartment', '')
+    
+    if not passport_number:
+        passport_number = f"{random.randint(1000, 9999)} {random.randint(100000, 999999)}"
+    
+    qr_data = {
+        'type': doc_type,
+        'name': f"{last_name} {first_name} {middle_name}".strip(),
+        'birth_date': birth_date,
+        'passport': passport_number,
+        'issued': datetime.utcnow().isoformat()
+    }
+    
+    qr_code_base64 = await asyncio.to_thread(generate_qr_code, json.dumps(qr_data))
+    
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        cur = await conn.execute(
+            CREATE_DOCUMENT_SQL,
+            (user_id, doc_type, first_name, last_name, middle_name, birth_date, passport_number, email, phone, country, apartment, qr_code_base64),
+            prepare=PREPARED_STATEMENTS
+        )
+        doc_id = (await cur.fetchone())[0]
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'id': doc_id,
+            'passport_number': passport_number,
+            'qr_code': qr_code_base64
+        })
+    }
@@ -1,13 +1,18 @@
 """VK OAuth authentication handler with PKCE."""
 import json
 import os
+import random
 import secrets
+import threading
+import time
+import functools
+from contextlib import contextmanager
 import base64
 import hashlib
 from datetime import datetime, timedelta, timezone
 from urllib.request import Request, urlopen
 from urllib.parse import urlencode
-from urllib.error import HTTPError
+from urllib.error import HTTPError, URLError
 
 import jwt
 import psycopg2
@@ -29,6 +34,82 @@ HEADERS = {
     'Content-Type': 'application/json'
 }
 
+FUNCTION_NAME = 'vk-auth'
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 0.1))
+
+
+# =============================================================================
+# INSTRUMENTATION
+# =============================================================================
+
+_cold_start = True
+_metrics = threading.local()
+
+
+def record_span(kind: str, seconds: float) -> None:
+    """Add an operation duration (db_connect, db_query, http) to the current request metrics."""
+    spans = getattr(_metrics, 'spans', None)
+    if spans is None:
+        return
+    ms = seconds * 1000
+    spans[f'{kind}_ms'] = spans.get(f'{kind}_ms', 0) + ms
+    spans[f'{kind}_count'] = spans.get(f'{kind}_count', 0) + 1
+    spans[f'{kind}_max_ms'] = max(spans.get(f'{kind}_max_ms', 0), ms)
+
+
+@contextmanager
+def timed(kind: str):
+    """Time a block of code as operation `kind`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(kind, time.perf_counter() - start)
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that times every executed query."""
+
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            return super().execute(query, vars)
+
+
+def instrumented(func):
+    """Emit a structured JSON timing line per request (cold starts, errors and a METRICS_SAMPLE_RATE sample)."""
+    @functools.wraps(func)
+    def wrapper(event: dict, context) -> dict:
+        global _cold_start
+        cold_start, _cold_start = _cold_start, False
+        _metrics.spans = {}
+        start = time.perf_counter()
+        result = None
+        error = None
+        try:
+            result = func(event, context)
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            total_ms = (time.perf_counter() - start) * 1000
+            status = (result or {}).get('statusCode', 500)
+            if cold_start or error or status >= 500 or random.random() < METRICS_SAMPLE_RATE:
+                print(json.dumps({
+                    'metric': 'request',
+                    'function': FUNCTION_NAME,
+                    'cold_start': cold_start,
+                    'method': event.get('httpMethod'),
+                    'endpoint': (event.get('queryStringParameters') or {}).get('action'),
+                    'status': status,
+                    'total_ms': round(total_ms, 2),
+                    'response_bytes': len(((result or {}).get('body') or '').encode()),
+                    **{k: round(v, 2) for k, v in _metrics.spans.items()},
+                    'error': error
+                }))
+            _metrics.spans = None
+    return wrapper
+
 
 # =============================================================================
 # DATABASE
@@ -36,7 +117,8 @@ HEADERS = {
 
 def get_connection():
     """Get database connection."""
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    with timed('db_connect'):
+        return psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=TimedCursor)
 
 
 def get_schema() -> str:
@@ -97,6 +179,92 @@ def create_refresh_token() -> str:
     return secrets.token_urlsafe(32)
 
 
+# =============================================================================
+# CIRCUIT BREAKER
+# =============================================================================
+
+# After BREAKER_FAILURE_THRESHOLD consecutive VK failures, calls fail fast for
+# BREAKER_RESET_SECONDS instead of waiting out the timeout; state is per warm instance
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', 30))
+
+
+class CircuitOpenError(Exception):
+    """Call rejected without contacting the dependency because the circuit is open."""
+
+
+class CircuitBreaker:
+    """closed -> open after consecutive failures -> half_open (single probe) -> closed or open again."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        print(json.dumps({
+            'metric': 'circuit_breaker', 'function': FUNCTION_NAME, 'dependency': self.name,
+            'state': state, 'failures': self.failures
+        }))
+
+    def acquire(self) -> None:
+        """Admit a call, or raise CircuitOpenError while the circuit is open."""
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= BREAKER_RESET_SECONDS:
+                self._transition('half_open')
+            if self.state == 'open' or (self.state == 'half_open' and self.probing):
+                self.stats['rejected'] += 1
+                raise CircuitOpenError(f'{self.name} circuit is open')
+            self.probing = self.state == 'half_open'
+            self.stats['calls'] += 1
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.probing = False
+            if self.state != 'closed':
+                self._transition('closed')
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            self.stats['failures'] += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= BREAKER_FAILURE_THRESHOLD):
+                self.opened_at = time.monotonic()
+                self.stats['opened'] += 1
+                self._transition('open')
+
+    @contextmanager
+    def guard(self):
+        """Run a dependency call; exceptions and 5xx responses count as failures, 4xx as answers."""
+        self.acquire()
+        try:
+            yield
+        except HTTPError as e:
+            if e.code >= 500:
+                self.failure()
+            else:
+                self.success()
+            raise
+        except Exception:
+            self.failure()
+            raise
+        except BaseException:
+            with self._lock:
+                self.probing = False
+            raise
+        self.success()
+
+
+VK_BREAKER = CircuitBreaker('vk')
+
+
 # =============================================================================
 # VK API
 # =============================================================================
@@ -144,9 +312,12 @@ def exchange_code_for_token(
     )
 
     try:
-        with urlopen(request, timeout=10) as response:
+        with VK_BREAKER.guard(), timed('http'), urlopen(request, timeout=10) as response:
             return json.loads(response.read().decode())
     except HTTPError as e:
+        # 4xx carries VK's OAuth error for the user; 5xx is an outage and is reported as such
+        if e.code >= 500:
+            raise
         error_body = e.read().decode()
         try:
             return json.loads(error_body)
@@ -168,7 +339,7 @@ def get_vk_user_info(access_token: str, client_id: str) -> dict:
         method='POST'
     )
 
-    with urlopen(request, timeout=10) as response:
+    with VK_BREAKER.guard(), timed('http'), urlopen(request, timeout=10) as response:
         result = json.loads(response.read().decode())
         return result.get('user', {})
 
@@ -311,7 +482,7 @@ def handle_callback(event: dict, origin: str) -> dict:
         vk_user_id = user_info.get('user_id', user_info.get('id', ''))
         first_name = user_info.get('first_name', '')
         last_name = user_info.get('last_name', '')
-        vk_email = user_info.get('email')
+        vk_email = (user_info.get('email') or '').lower().strip() or None
         photo_url = user_info.get('avatar', '')
         full_name = f"{first_name} {last_name}".strip()
 
@@ -326,70 +497,68 @@ def handle_callback(event: dict, origin: str) -> dict:
             # Cleanup expired tokens periodically
             cleanup_expired_tokens(cur, S)
 
-            # 1. Check if user exists by vk_id
+            # Create tokens
+            refresh_token = create_refresh_token()
+            refresh_token_hash = hash_token(refresh_token)
+            refresh_expires = (datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)).isoformat()
+
+            # 1. Login by vk_id, or link VK to the account with this email.
+            #    The refresh token is stored in the same statement.
             cur.execute(
-                f"SELECT id, email, name, avatar_url FROM {S}users WHERE vk_id = %s",
-                (str(vk_user_id),)
+                f"""WITH u AS (
+                        UPDATE {S}users
+                        SET vk_id = %s, avatar_url = COALESCE(avatar_url, %s),
+                            last_login_at = %s, updated_at = %s
+                        WHERE id = (
+                            SELECT id FROM {S}users
+                            WHERE vk_id = %s OR (vk_id IS NULL AND LOWER(email) = %s)
+                            ORDER BY vk_id IS NULL
+                            LIMIT 1
+                        )
+                        RETURNING id, email, name, avatar_url
+                    ), t AS (
+                        INSERT INTO {S}refresh_tokens (user_id, token_hash, expires_at, created_at)
+                        SELECT id, %s, %s, %s FROM u
+                    )
+                    SELECT id, email, name, avatar_url FROM u""",
+                (str(vk_user_id), photo_url, now, now, str(vk_user_id), vk_email,
+                 refresh_token_hash, refresh_expires, now)
             )
             row = cur.fetchone()
 
-            if row:
-                # User found by vk_id - just login
-                user_id, email, name, db_avatar = row
+            if not row and vk_email:
+                # The email belongs to an account already linked to a different VK ID
+                cur.execute(f"SELECT 1 FROM {S}users WHERE LOWER(email) = %s", (vk_email,))
+                if cur.fetchone():
+                    conn.rollback()
+                    return error(409, 'Email is already linked to another VK account', origin)
+
+            if not row:
+                # 2. Create new user; a concurrent login with the same vk_id wins the race
                 cur.execute(
-                    f"UPDATE {S}users SET last_login_at = %s, updated_at = %s WHERE id = %s",
-                    (now, now, user_id)
-                )
-                email = email or vk_email
-                name = name or full_name
-                photo_url = db_avatar or photo_url
-            else:
-                # 2. Check if user exists by email - link VK account
-                if vk_email:
-                    cur.execute(
-                        f"SELECT id, name, avatar_url FROM {S}users WHERE email = %s",
-                        (vk_email,)
-                    )
-                    row = cur.fetchone()
-
-                if vk_email and row:
-                    # User found by email - link VK account
-                    user_id, db_name, db_avatar = row
-                    cur.execute(
-                        f"""UPDATE {S}users
-                            SET vk_id = %s, avatar_url = COALESCE(avatar_url, %s),
-                                last_login_at = %s, updated_at = %s
-                            WHERE id = %s""",
-                        (str(vk_user_id), photo_url, now, now, user_id)
-                    )
-                    email = vk_email
-                    name = db_name or full_name
-                    photo_url = db_avatar or photo_url
-                else:
-                    # 3. Create new user
-                    cur.execute(
-                        f"""INSERT INTO {S}users
+                    f"""WITH u AS (
+                            INSERT INTO {S}users
                             (vk_id, email, name, avatar_url, email_verified, created_at, updated_at, last_login_at)
                             VALUES (%s, %s, %s, %s, TRUE, %s, %s, %s)
-                            RETURNING id""",
-                        (str(vk_user_id), vk_email, full_name, photo_url, now, now, now)
-                    )
-                    user_id = cur.fetchone()[0]
-                    email = vk_email
-                    name = full_name
+                            ON CONFLICT (vk_id) DO UPDATE
+                            SET last_login_at = EXCLUDED.last_login_at, updated_at = EXCLUDED.updated_at
+                            RETURNING id, email, name, avatar_url
+                        ), t AS (
+                            INSERT INTO {S}refresh_tokens (user_id, token_hash, expires_at, created_at)
+                            SELECT id, %s, %s, %s FROM u
+                        )
+                        SELECT id, email, name, avatar_url FROM u""",
+                    (str(vk_user_id), vk_email, full_name, photo_url, now, now, now,
+                     refresh_token_hash, refresh_expires, now)
+                )
+                row = cur.fetchone()
 
-            # Create tokens
-            access_token, expires_in = create_access_token(user_id, email)
-            refresh_token = create_refresh_token()
-            refresh_token_hash = hash_token(refresh_token)
-            refresh_expires = (datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)).isoformat()
+            user_id, email, name, db_avatar = row
+            email = email or vk_email
+            name = name or full_name
+            photo_url = db_avatar or photo_url
 
-            # Store hashed refresh token
-            cur.execute(
-                f"""INSERT INTO {S}refresh_tokens (user_id, token_hash, expires_at, created_at)
-                    VALUES (%s, %s, %s, %s)""",
-                (user_id, refresh_token_hash, refresh_expires, now)
-            )
+            access_token, expires_in = create_access_token(user_id, email)
 
             conn.commit()
 
@@ -400,20 +569,27 @@ def handle_callback(event: dict, origin: str) -> dict:
                 'user': {
                     'id': user_id,
                     'email': email,
-                    'name': name or full_name,
+                    'name': name,
                     'avatar_url': photo_url,
                     'vk_id': str(vk_user_id)
                 }
             }, origin)
 
+        except psycopg2.errors.UniqueViolation:
+            # A concurrent sign-up took the same email
+            conn.rollback()
+            return error(409, 'Email is already linked to another VK account', origin)
         except Exception:
             conn.rollback()
             return error(500, 'Database error', origin)
         finally:
             conn.close()
 
-    except HTTPError:
-        return error(500, 'VK API error', origin)
+    except CircuitOpenError:
+        return error(503, 'VK is temporarily unavailable', origin)
+    except (URLError, TimeoutError, json.JSONDecodeError):
+        # HTTPError is a URLError: VK 5xx, refused requests, timeouts and unreadable answers
+        return error(502, 'VK API error', origin)
     except Exception:
         return error(500, 'Internal server error', origin)
 
@@ -525,6 +701,7 @@ def handle_logout(event: dict, origin: str) -> dict:
 # MAIN HANDLER
 # =============================================================================
 
+@instrumented
 def handler(event: dict, context) -> dict:
     """Main handler - routes to specific handlers based on action."""
     origin = get_origin(event)
@@ -1,9 +1,486 @@
 import json
 import os
+import contextvars
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
 import psycopg2
 import hashlib
 import base64
+import hmac
+import math
+import struct
 
+FUNCTION_NAME = 'passwords'
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 0.1))
+
+# >>> shared: metrics (benchmarks/sync_shared.py)
+_cold_start = True
+
+class ContextLocal:
+    '''Как threading.local, но на contextvars: своё состояние у каждого потока и у каждой задачи asyncio (index_async.py)'''
+    def __init__(self):
+        object.__setattr__(self, '_state', contextvars.ContextVar(f'context_local_{id(self)}', default={}))
+    
+    def __getattr__(self, name: str):
+        try:
+            return self._state.get()[name]
+        except KeyError:
+            raise AttributeError(name) from None
+    
+    def __setattr__(self, name: str, value):
+        self._state.set({**self._state.get(), name: value})
+
+_metrics = ContextLocal()
+
+def record_span(kind: str, seconds: float):
+    '''Учёт длительности операции (db_connect, db_query, http, ...) в метриках текущего запроса'''
+    spans = getattr(_metrics, 'spans', None)
+    if spans is None:
+        return
+    ms = seconds * 1000
+    spans[f'{kind}_ms'] = spans.get(f'{kind}_ms', 0) + ms
+    spans[f'{kind}_count'] = spans.get(f'{kind}_count', 0) + 1
+    spans[f'{kind}_max_ms'] = max(spans.get(f'{kind}_max_ms', 0), ms)
+
+@contextmanager
+def timed(kind: str):
+    '''Замер блока кода как операции kind'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(kind, time.perf_counter() - start)
+
+class TimedCursor(psycopg2.extensions.cursor):
+    '''Курсор, замеряющий время каждого запроса'''
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            return super().execute(query, vars)
+# <<< shared: metrics
+
+# >>> shared: replica (benchmarks/sync_shared.py)
+def db_connect():
+    '''Подключение к БД с замером времени соединения; внутри read_only-чтения — к реплике, если она видит запись клиента'''
+    if getattr(_routing, 'replica', False):
+        with timed('db_connect_replica'):
+            conn = psycopg2.connect(DATABASE_READ_URL, cursor_factory=TimedCursor, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        if replica_caught_up(conn):
+            return conn
+        conn.close()
+    with timed('db_connect'):
+        return psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=TimedCursor)
+
+# Реплика для чтения (необязательна). Отметку последней записи хранит клиент: ответ на запись несёт
+# LAST_WRITE_HEADER, клиент присылает его обратно, и REPLICA_READ_YOUR_WRITES_SECONDS после записи чтение
+# идёт на реплику, только если она уже воспроизвела транзакции с этого момента (на любом инстансе)
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL', '')
+LAST_WRITE_HEADER = 'X-Last-Write'
+REPLICA_READ_YOUR_WRITES_SECONDS = float(os.environ.get('REPLICA_READ_YOUR_WRITES_SECONDS', 5))
+REPLICA_RETRY_AFTER_SECONDS = float(os.environ.get('REPLICA_RETRY_AFTER_SECONDS', 30))
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 2))
+
+_routing = ContextLocal()
+_replica_down_until = 0.0
+
+REPLICA_CAUGHT_UP_SQL = "SELECT NOT pg_is_in_recovery() OR COALESCE(pg_last_xact_replay_timestamp() >= to_timestamp(%s), FALSE)"
+
+def note_write():
+    '''Отметка записи: время её начала уходит клиенту в LAST_WRITE_HEADER'''
+    _routing.wrote_at = time.time()
+
+def recent_write():
+    '''Отметка последней записи клиента, если она в окне REPLICA_READ_YOUR_WRITES_SECONDS, иначе None'''
+    last_write = getattr(_routing, 'last_write', 0.0)
+    if -REPLICA_READ_YOUR_WRITES_SECONDS <= time.time() - last_write <= REPLICA_READ_YOUR_WRITES_SECONDS:
+        return last_write
+    return None
+
+def replica_caught_up(conn) -> bool:
+    '''Видит ли реплика последнюю запись клиента: отметки нет, она вне окна или воспроизведение дошло до неё'''
+    last_write = recent_write()
+    if last_write is None:
+        return True
+    cur = conn.cursor()
+    cur.execute(REPLICA_CAUGHT_UP_SQL, (last_write,))
+    caught_up = cur.fetchone()[0]
+    cur.close()
+    return caught_up
+
+def use_replica() -> bool:
+    '''Можно ли читать с реплики: она настроена и не отмечена недоступной'''
+    return bool(DATABASE_READ_URL) and time.monotonic() >= _replica_down_until
+
+def start_routing(event: dict):
+    '''Отметка последней записи клиента из LAST_WRITE_HEADER запроса'''
+    try:
+        _routing.last_write = float((event.get('headers') or {}).get(LAST_WRITE_HEADER) or 0)
+    except ValueError:
+        _routing.last_write = 0.0
+    _routing.wrote_at = None
+
+def finish_routing(result):
+    '''Ответ на запись получает новую отметку в LAST_WRITE_HEADER'''
+    if _routing.wrote_at and isinstance(result, dict):
+        result['headers'] = {
+            **result.get('headers', {}),
+            LAST_WRITE_HEADER: f'{_routing.wrote_at:.3f}',
+            'Access-Control-Expose-Headers': LAST_WRITE_HEADER
+        }
+    return result
+
+def read_your_writes(func):
+    '''Отметка последней записи клиента берётся из LAST_WRITE_HEADER запроса; ответ на запись получает новую'''
+    @functools.wraps(func)
+    def wrapper(event: dict, context) -> dict:
+        start_routing(event)
+        return finish_routing(func(event, context))
+    return wrapper
+
+def mark_replica_down(operation: str, error: Exception):
+    '''Реплика недоступна: REPLICA_RETRY_AFTER_SECONDS чтения идут на основную БД'''
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER_SECONDS
+    print(json.dumps({'metric': 'replica_fallback', 'function': FUNCTION_NAME, 'operation': operation, 'error': repr(error)}))
+
+def read_only(func):
+    '''Чтение, которое выполняется на реплике, а при её ошибке повторяется на основной БД'''
+    @functools.wraps(func)
+    def wrapper(user_id: int, *args, **kwargs):
+        if not use_replica():
+            return func(user_id, *args, **kwargs)
+        _routing.replica = True
+        try:
+            return func(user_id, *args, **kwargs)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            mark_replica_down(func.__name__, e)
+        finally:
+            _routing.replica = False
+        return func(user_id, *args, **kwargs)
+    return wrapper
+# <<< shared: replica
+
+# >>> shared: schema (benchmarks/sync_shared.py)
+def get_schema() -> str:
+    '''Префикс схемы БД для имён таблиц: запросы не зависят от search_path и работают через transaction pooler'''
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+    return f"{schema}." if schema else ""
+
+SCHEMA = get_schema()
+# <<< shared: schema
+
+# >>> shared: instrumented (benchmarks/sync_shared.py)
+def start_request() -> tuple:
+    '''Начало учёта запроса: (cold start, момент начала); спаны копятся до log_request'''
+    global _cold_start
+    cold_start, _cold_start = _cold_start, False
+    _metrics.spans = {}
+    return cold_start, time.perf_counter()
+
+def log_request(event: dict, result, error, cold_start: bool, start: float):
+    '''Структурированный JSON-лог запроса: cold start, ошибки, ответы 5xx и выборка METRICS_SAMPLE_RATE'''
+    total_ms = (time.perf_counter() - start) * 1000
+    status = (result or {}).get('statusCode', 500)
+    # Потоковое тело (генератор событий) уходит клиенту по частям, и его размер заранее неизвестен
+    body = (result or {}).get('body') or ''
+    if cold_start or error or status >= 500 or random.random() < METRICS_SAMPLE_RATE:
+        print(json.dumps({
+            'metric': 'request',
+            'function': FUNCTION_NAME,
+            'cold_start': cold_start,
+            'method': event.get('httpMethod'),
+            'endpoint': (event.get('queryStringParameters') or {}).get('endpoint'),
+            'status': status,
+            'total_ms': round(total_ms, 2),
+            'response_bytes': len(body.encode()) if isinstance(body, str) else None,
+            **{k: round(v, 2) for k, v in _metrics.spans.items()},
+            'error': error
+        }))
+    _metrics.spans = None
+
+def instrumented(func):
+    '''Метрика времени обработки запроса (log_request) вокруг обработчика'''
+    @functools.wraps(func)
+    def wrapper(event: dict, context) -> dict:
+        cold_start, start = start_request()
+        result = None
+        error = None
+        try:
+            result = func(event, context)
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            log_request(event, result, error, cold_start, start)
+    return wrapper
+# <<< shared: instrumented
+
+PUBLIC_SUFFIX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public_suffix_list.dat')
+
+def to_ascii(name: str) -> str:
+    '''Punycode-форма домена (рф → xn--p1ai); при ошибке IDNA возвращается как есть'''
+    try:
+        return name.encode('idna').decode('ascii').lower()
+    except UnicodeError:
+        return name.lower()
+
+def load_public_suffixes(path: str) -> tuple:
+    '''Правила Public Suffix List: (суффиксы, wildcard-суффиксы "*.x", исключения "!x")'''
+    suffixes, wildcards, exceptions = set(), set(), set()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            rule = line.split()[0] if line.strip() else ''
+            if not rule or rule.startswith('//'):
+                continue
+            if rule.startswith('!'):
+                exceptions.add(to_ascii(rule[1:]))
+            elif rule.startswith('*.'):
+                wildcards.add(to_ascii(rule[2:]))
+            else:
+                suffixes.add(to_ascii(rule))
+    return suffixes, wildcards, exceptions
+
+# Загружается один раз при холодном старте и живёт между тёплыми вызовами
+PUBLIC_SUFFIXES, PUBLIC_SUFFIX_WILDCARDS, PUBLIC_SUFFIX_EXCEPTIONS = load_public_suffixes(PUBLIC_SUFFIX_FILE)
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Выражение должно совпадать с idx_passwords_search_trgm, иначе индекс не используется
+SEARCH_DOCUMENT_SQL = "(COALESCE(site_name, '') || ' ' || site_url || ' ' || COALESCE(username, ''))"
+
+# Без search_path функции и операторы pg_trgm квалифицируются явно. Расширение может стоять в схеме
+# миграции или уже быть установлено в public, поэтому {trgm} подставляется схемой из pg_extension
+SEARCH_MATCH_SQL = f"({SEARCH_DOCUMENT_SQL} ILIKE %s OR %s OPERATOR({{trgm}}.<%%) {SEARCH_DOCUMENT_SQL})"
+
+SEARCH_PASSWORDS_SQL = f"""
+    SELECT id, site_url, site_name, username, encrypted_password, created_at,
+           {{trgm}}.word_similarity(%s, {SEARCH_DOCUMENT_SQL}) + CASE WHEN {SEARCH_DOCUMENT_SQL} ILIKE %s THEN 1 ELSE 0 END AS score,
+           COUNT(*) OVER () AS total
+    FROM {SCHEMA}passwords
+    WHERE user_id = %s AND deleted_at IS NULL AND {SEARCH_MATCH_SQL}
+    ORDER BY score DESC, id DESC
+    LIMIT %s OFFSET %s
+"""
+
+TRGM_SCHEMA_SQL = """
+    SELECT n.nspname FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace
+    WHERE e.extname = 'pg_trgm'
+"""
+
+_trgm_schema = os.environ.get('PG_TRGM_SCHEMA')
+
+def trgm_schema(cur) -> str:
+    '''Схема pg_trgm: PG_TRGM_SCHEMA или из pg_extension, один раз на тёплый инстанс'''
+    global _trgm_schema
+    if _trgm_schema is None:
+        cur.execute(TRGM_SCHEMA_SQL)
+        row = cur.fetchone()
+        _trgm_schema = row[0] if row else 'public'
+    return _trgm_schema
+
+# Фильтр Блума утёкших паролей: заголовок BREACH_FILTER_HEADER (magic, число бит, число хешей,
+# число записей), затем битовый массив. Собирается benchmarks/build_breach_filter.py
+BREACH_FILTER_PATH = os.environ.get(
+    'BREACH_FILTER_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'breached_passwords.bloom')
+)
+BREACH_FILTER_MAGIC = b'BLM1'
+BREACH_FILTER_HEADER = struct.Struct('<4sQIQ')
+
+_breach_filter = None
+_breach_filter_lock = threading.Lock()
+
+def hkdf_sha256(secret: bytes, label: bytes) -> bytes:
+    '''32-байтный ключ HKDF-SHA256 (RFC 5869, без соли) для отдельного назначения секрета'''
+    prk = hmac.new(bytes(32), secret, hashlib.sha256).digest()
+    return hmac.new(prk, label + b'\x01', hashlib.sha256).digest()
+
+# Отпечаток пароля — HMAC-SHA256 с отдельным ключом: одинаковые пароли пользователя совпадают,
+# но по отпечатку нельзя подобрать пароль без ключа. Без PASSWORD_FINGERPRINT_KEY ключ выводится
+# из JWT_SECRET через HKDF со своей меткой, а не берётся сам секрет подписи токенов
+FINGERPRINT_KEY = os.environ.get('PASSWORD_FINGERPRINT_KEY', '').encode() or hkdf_sha256(
+    os.environ.get('JWT_SECRET', 'default-secret-key').encode(), b'passwords/fingerprint/v1'
+)
+WEAK_STRENGTH = 1
+
+# >>> shared: compression (benchmarks/sync_shared.py)
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+
+@functools.lru_cache(maxsize=None)
+def load_orjson():
+    '''Модуль orjson или None: импортируется при первой сериализации, а не на холодном старте'''
+    try:
+        import orjson
+        return orjson
+    except ImportError:
+        return None
+
+def dumps(obj) -> str:
+    '''JSON-сериализация больших ответов: orjson, если установлен, иначе стандартный json'''
+    orjson = load_orjson()
+    with timed('serialize'):
+        if orjson is not None:
+            return orjson.dumps(obj).decode()
+        return json.dumps(obj)
+
+@functools.lru_cache(maxsize=None)
+def load_brotli():
+    '''Модуль brotli или None, если он не установлен'''
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+def accepted_encodings(event: dict) -> set:
+    '''Кодировки из Accept-Encoding, кроме отключённых через q=0'''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'accept-encoding'), '') or ''
+    accepted = set()
+    for part in value.split(','):
+        name, _, params = part.partition(';')
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+def compress_response(event: dict, result: dict) -> dict:
+    '''Сжатие тела ответа brotli/gzip по Accept-Encoding, если оно не меньше COMPRESSION_MIN_BYTES'''
+    body = result.get('body') or ''
+    if result.get('statusCode') != 200 or result.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_BYTES:
+        return result
+    
+    accepted = accepted_encodings(event)
+    brotli = load_brotli() if 'br' in accepted else None
+    
+    with timed('compress'):
+        if brotli is not None:
+            encoding, compressed = 'br', brotli.compress(body.encode('utf-8'), quality=5)
+        elif 'gzip' in accepted:
+            import gzip
+            encoding, compressed = 'gzip', gzip.compress(body.encode('utf-8'), compresslevel=6)
+        else:
+            return result
+    
+    return {
+        **result,
+        'headers': {**result.get('headers', {}), 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'},
+        'body': base64.b64encode(compressed).decode(),
+        'isBase64Encoded': True
+    }
+# <<< shared: compression
+
+# >>> shared: idempotency (benchmarks/sync_shared.py)
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))
+IDEMPOTENCY_CLEANUP_RATE = float(os.environ.get('IDEMPOTENCY_CLEANUP_RATE', 0.01))
+# Незавершённый захват ключа (инстанс убит по таймауту посреди func) освобождается через несколько таймаутов функции
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 90))
+
+def idempotent(endpoint: str, user_id: int, key: str, data: dict, func, reissue: dict = None) -> dict:
+    '''Выполнение func() один раз на Idempotency-Key: повтор получает сохранённый ответ, а поля reissue (токены) — заново из него'''
+    if not key:
+        return func()
+    
+    if len(key) > 255:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Idempotency-Key is too long'})
+        }
+    
+    request_hash = hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    key_params = (user_id, endpoint, key)
+    
+    conn = db_connect()
+    conn.autocommit = True
+    cur = conn.cursor()
+    
+    # Удаление просроченных ключей — изредка, заодно с обычными запросами
+    if random.random() < IDEMPOTENCY_CLEANUP_RATE:
+        cur.execute(f"DELETE FROM {SCHEMA}idempotency_keys WHERE created_at < NOW() - make_interval(hours => %s)", (IDEMPOTENCY_TTL_HOURS,))
+    
+    # Занимаем ключ; просроченная запись или брошенный захват без ответа занимаются заново
+    cur.execute(
+        f"INSERT INTO {SCHEMA}idempotency_keys (user_id, endpoint, idempotency_key, request_hash) VALUES (%s, %s, %s, %s) "
+        "ON CONFLICT (user_id, endpoint, idempotency_key) DO UPDATE "
+        "SET request_hash = EXCLUDED.request_hash, status_code = NULL, response_body = NULL, "
+        "created_at = CURRENT_TIMESTAMP, claimed_at = CURRENT_TIMESTAMP "
+        "WHERE idempotency_keys.created_at < NOW() - make_interval(hours => %s) "
+        "OR idempotency_keys.status_code IS NULL AND idempotency_keys.request_hash = EXCLUDED.request_hash "
+        "AND idempotency_keys.claimed_at < NOW() - make_interval(secs => %s) RETURNING claimed_at",
+        (*key_params, request_hash, IDEMPOTENCY_TTL_HOURS, IDEMPOTENCY_LEASE_SECONDS)
+    )
+    claim = cur.fetchone()
+    
+    if claim is None:
+        cur.execute(
+            f"SELECT request_hash, status_code, response_body FROM {SCHEMA}idempotency_keys WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s",
+            key_params
+        )
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+        
+        if row and row[0] != request_hash:
+            return {
+                'statusCode': 422,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Idempotency-Key was already used with a different request'})
+            }
+        if not row or row[1] is None:
+            return {
+                'statusCode': 409,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'A request with this Idempotency-Key is in progress'})
+            }
+        body = row[2]
+        if reissue and row[1] == 200:
+            stored = json.loads(body)
+            body = json.dumps({**stored, **{field: make(stored) for field, make in reissue.items()}})
+        return {
+            'statusCode': row[1],
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Idempotent-Replayed': 'true'},
+            'body': body
+        }
+    
+    # Запись и удаление — только пока захват наш: по истечении аренды ключ мог занять повтор
+    owned_params = (*key_params, claim[0])
+    try:
+        result = func()
+    except Exception:
+        cur.execute(f"DELETE FROM {SCHEMA}idempotency_keys WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s AND claimed_at = %s", owned_params)
+        cur.close()
+        conn.close()
+        raise
+    
+    # Ошибки сервера не запоминаем: повтор должен выполниться заново
+    if result.get('statusCode', 500) < 500:
+        body = result.get('body', '')
+        if reissue and result['statusCode'] == 200:
+            body = json.dumps({field: value for field, value in json.loads(body).items() if field not in reissue})
+        cur.execute(
+            f"UPDATE {SCHEMA}idempotency_keys SET status_code = %s, response_body = %s WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s AND claimed_at = %s",
+            (result['statusCode'], body, *owned_params)
+        )
+    else:
+        cur.execute(f"DELETE FROM {SCHEMA}idempotency_keys WHERE user_id = %s AND endpoint = %s AND idempotency_key = %s AND claimed_at = %s", owned_params)
+    cur.close()
+    conn.close()
+    
+    return result
+# <<< shared: idempotency
+
+@instrumented
+@read_your_writes
 def handler(event: dict, context) -> dict:
     '''Менеджер паролей с шифрованием'''
     method = event.get('httpMethod', 'GET')
@@ -14,7 +491,7 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization, Idempotency-Key, X-Last-Write'
             },
             'body': ''
         }
@@ -29,11 +506,27 @@ def handler(event: dict, context) -> dict:
             'body': json.dumps({'error': 'Unauthorized'})
         }
     
-    if method == 'GET':
-        return get_passwords(user_id)
+    query_params = event.get('queryStringParameters') or {}
+    
+    if method in ('POST', 'DELETE'):
+        note_write()
+    
+    if method == 'GET' and query_params.get('action') == 'changes':
+        return get_changes(user_id, query_params.get('since', '0'))
+    elif method == 'GET' and query_params.get('action') == 'autofill':
+        return get_autofill(user_id, query_params.get('url', ''))
+    elif method == 'GET' and query_params.get('action') == 'audit':
+        return audit_passwords(user_id)
+    elif method == 'GET' and query_params.get('action') == 'report':
+        return get_security_report(user_id)
+    elif method == 'GET' and query_params.get('action') == 'search':
+        return search_passwords(user_id, query_params.get('q', ''), query_params.get('limit'), query_params.get('offset'))
+    elif method == 'GET':
+        return compress_response(event, get_passwords(user_id))
     elif method == 'POST':
         data = json.loads(event.get('body', '{}'))
-        return save_password(user_id, data)
+        idempotency_key = event.get('headers', {}).get('Idempotency-Key', '')
+        return idempotent('save_password', user_id, idempotency_key, data, lambda: save_password(user_id, data))
     elif method == 'DELETE':
         data = json.loads(event.get('body', '{}'))
         return delete_password(user_id, data.get('id'))
@@ -63,35 +556,415 @@ def verify_token(auth_header: str) -> int:
             hmac.new(secret.encode(), f"{header}.{payload_b64}".encode(), hashlib.sha256).digest()
         ).decode().rstrip('=')
         
-        if signature != expected_sig:
+        if not hmac.compare_digest(signature, expected_sig):
             return 0
         
         payload = json.loads(base64.urlsafe_b64decode(payload_b64 + '=='))
+        if payload.get('exp', 0) < time.time():
+            return 0
         return payload.get('user_id', 0)
     except:
         return 0
 
+# Каждое изменение хранилища берёт следующее значение users.vault_version (блокировка строки
+# пользователя упорядочивает конкурентные записи) и пишет его в passwords.version.
+# Удаление оставляет tombstone: deleted_at + пустой encrypted_password.
+GET_PASSWORDS_SQL = f"SELECT id, site_url, site_name, username, encrypted_password, created_at FROM {SCHEMA}passwords WHERE user_id = %s AND deleted_at IS NULL ORDER BY created_at DESC"
+
+SAVE_PASSWORD_SQL = f"""
+    WITH v AS (UPDATE {SCHEMA}users SET vault_version = vault_version + 1 WHERE id = %s RETURNING vault_version)
+    INSERT INTO {SCHEMA}passwords (user_id, site_url, site_domain, site_name, username, encrypted_password, password_fingerprint, strength, version, created_at, updated_at)
+    SELECT %s, %s, %s, %s, %s, %s, %s, %s, v.vault_version, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP FROM v
+    RETURNING id, version
+"""
+
+DELETE_PASSWORD_SQL = f"""
+    WITH v AS (UPDATE {SCHEMA}users SET vault_version = vault_version + 1 WHERE id = %s RETURNING vault_version)
+    UPDATE {SCHEMA}passwords p
+    SET encrypted_password = '', deleted_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP, version = v.vault_version
+    FROM v
+    WHERE p.id = %s AND p.user_id = %s AND p.deleted_at IS NULL
+"""
+
+@read_only
 def get_passwords(user_id: int) -> dict:
     '''Получение всех паролей пользователя'''
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
+    cur = conn.cursor()
+    
+    cur.execute(GET_PASSWORDS_SQL, (user_id,))
+    
+    passwords = []
+    with timed('decrypt'):
+        for row in cur.fetchall():
+            passwords.append({
+                'id': row[0],
+                'site_url': row[1],
+                'site_name': row[2],
+                'username': row[3],
+                'password': decrypt_password(row[4]),
+                'created_at': row[5].isoformat()
+            })
+    
+    cur.close()
+    conn.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({'passwords': passwords})
+    }
+
+# Без read_only: sync_token выдан основной БД, и отстающая реплика вернула бы неполную дельту
+def get_changes(user_id: int, since: str) -> dict:
+    '''Дельта-синхронизация: записи, изменённые после sync_token клиента, и tombstones удалённых'''
+    try:
+        since = max(int(since), 0)
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid sync token'})
+        }
+    
+    conn = db_connect()
+    cur = conn.cursor()
+    
+    # since = 0 — первая синхронизация: полный снимок без tombstones
+    if since:
+        condition, params = "p.version > %s", (since, user_id)
+    else:
+        condition, params = "p.deleted_at IS NULL", (user_id,)
+    
+    cur.execute(
+        "SELECT u.vault_version, p.id, p.site_url, p.site_name, p.username, p.encrypted_password, p.created_at, p.updated_at, p.deleted_at "
+        f"FROM {SCHEMA}users u LEFT JOIN {SCHEMA}passwords p ON p.user_id = u.id AND {condition} WHERE u.id = %s ORDER BY p.version",
+        params
+    )
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    
+    if not rows:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'User not found'})
+        }
+    
+    sync_token = rows[0][0]
+    if since > sync_token:
+        return {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Sync token is ahead of the server, full resync required', 'sync_token': sync_token})
+        }
+    
+    changed = []
+    deleted = []
+    with timed('decrypt'):
+        for row in rows:
+            if row[1] is None:
+                continue
+            if row[8]:
+                deleted.append(row[1])
+                continue
+            changed.append({
+                'id': row[1],
+                'site_url': row[2],
+                'site_name': row[3],
+                'username': row[4],
+                'password': decrypt_password(row[5]),
+                'created_at': row[6].isoformat(),
+                'updated_at': row[7].isoformat() if row[7] else None
+            })
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'changed': changed,
+            'deleted': deleted,
+            'full': since == 0,
+            'sync_token': sync_token
+        })
+    }
+
+def site_host(site_url: str) -> str:
+    '''Имя хоста из адреса сайта в нижнем регистре и punycode; адрес без схемы допускается'''
+    url = site_url.strip()
+    if '://' not in url:
+        url = f"http://{url}"
+    try:
+        host = urlsplit(url).hostname or ''
+    except ValueError:
+        return ''
+    return to_ascii(host.rstrip('.'))
+
+@functools.lru_cache(maxsize=4096)
+def registrable_domain(host: str) -> str:
+    '''Регистрируемый домен (eTLD+1) по Public Suffix List: mail.google.co.uk → google.co.uk'''
+    if not host or ':' in host or host.replace('.', '').isdigit():
+        return host
+    
+    labels = host.split('.')
+    suffix_len = 1
+    for i in range(len(labels)):
+        candidate = '.'.join(labels[i:])
+        if candidate in PUBLIC_SUFFIX_EXCEPTIONS:
+            suffix_len = len(labels) - i - 1
+            break
+        if candidate in PUBLIC_SUFFIXES or '.'.join(labels[i + 1:]) in PUBLIC_SUFFIX_WILDCARDS:
+            suffix_len = len(labels) - i
+            break
+    
+    if len(labels) <= suffix_len:
+        return host
+    return '.'.join(labels[-suffix_len - 1:])
+
+# Записи до V0005 без site_domain заполняет scripts/backfill_site_domains.py
+@read_only
+def get_autofill(user_id: int, url: str) -> dict:
+    '''Учётные данные для страницы: поиск по регистрируемому домену одним проходом по индексу'''
+    host = site_host(url)
+    domain = registrable_domain(host)
+    
+    if not domain:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Valid page URL required'})
+        }
+    
+    conn = db_connect()
+    cur = conn.cursor()
+    
+    cur.execute(
+        f"SELECT id, site_url, site_name, username, encrypted_password FROM {SCHEMA}passwords "
+        "WHERE user_id = %s AND site_domain = %s AND deleted_at IS NULL ORDER BY updated_at DESC",
+        (user_id, domain)
+    )
+    
+    credentials = []
+    with timed('decrypt'):
+        for row in cur.fetchall():
+            credentials.append({
+                'id': row[0],
+                'site_url': row[1],
+                'site_name': row[2],
+                'username': row[3],
+                'password': decrypt_password(row[4]),
+                'exact_host': site_host(row[1]) == host
+            })
+    
+    cur.close()
+    conn.close()
+    
+    # Сначала записи для точно этого хоста, затем остальные поддомены
+    credentials.sort(key=lambda c: not c['exact_host'])
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'domain': domain, 'credentials': credentials})
+    }
+
+@read_only
+def search_passwords(user_id: int, query: str, limit=None, offset=None) -> dict:
+    '''Нечёткий поиск по названию, адресу и логину (pg_trgm): подстрока или похожие слова, по убыванию сходства'''
+    query = ' '.join(query.split()).lower()
+    try:
+        limit = min(max(int(limit or SEARCH_PAGE_SIZE), 1), SEARCH_MAX_PAGE_SIZE)
+        offset = max(int(offset or 0), 0)
+    except ValueError:
+        limit, offset = None, None
+    
+    if not query or limit is None:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Search query required'})
+        }
+    
+    pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    
+    conn = db_connect()
+    cur = conn.cursor()
+    
+    cur.execute(SEARCH_PASSWORDS_SQL.format(trgm=trgm_schema(cur)), (query, pattern, user_id, pattern, query, limit, offset))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    
+    results = []
+    with timed('decrypt'):
+        for row in rows:
+            results.append({
+                'id': row[0],
+                'site_url': row[1],
+                'site_name': row[2],
+                'username': row[3],
+                'password': decrypt_password(row[4]),
+                'created_at': row[5].isoformat(),
+                'score': round(row[6], 3)
+            })
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'results': results,
+            'total': rows[0][7] if rows else 0,
+            'limit': limit,
+            'offset': offset
+        })
+    }
+
+def bloom_positions(digest: bytes, num_bits: int, num_hashes: int) -> list:
+    '''Позиции бит для SHA-1 дайджеста: двойное хеширование двумя 64-битными половинами'''
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:16], 'little') | 1
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+def get_breach_filter():
+    '''Фильтр утёкших паролей, отображённый в память при первом обращении; None, если файла нет'''
+    global _breach_filter
+    if _breach_filter is None:
+        with _breach_filter_lock:
+            if _breach_filter is None:
+                import mmap
+                
+                if not os.path.exists(BREACH_FILTER_PATH):
+                    return None
+                with timed('breach_filter_load'), open(BREACH_FILTER_PATH, 'rb') as f:
+                    bits = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, num_bits, num_hashes, count = BREACH_FILTER_HEADER.unpack_from(bits)
+                if magic != BREACH_FILTER_MAGIC or len(bits) < BREACH_FILTER_HEADER.size + (num_bits + 7) // 8:
+                    raise ValueError(f'{BREACH_FILTER_PATH} is not a breach filter')
+                _breach_filter = (bits, num_bits, num_hashes, count)
+    return _breach_filter
+
+def is_breached(password: str, breach_filter: tuple) -> bool:
+    '''Есть ли SHA-1 пароля в фильтре (возможны ложные срабатывания, пропусков нет)'''
+    bits, num_bits, num_hashes, _ = breach_filter
+    digest = hashlib.sha1(password.encode('utf-8')).digest()
+    offset = BREACH_FILTER_HEADER.size
+    return all(
+        bits[offset + (pos >> 3)] & (1 << (pos & 7))
+        for pos in bloom_positions(digest, num_bits, num_hashes)
+    )
+
+@read_only
+def audit_passwords(user_id: int) -> dict:
+    '''Проверка всех паролей хранилища по локальной базе утечек, без сетевых запросов'''
+    breach_filter = get_breach_filter()
+    
+    if breach_filter is None:
+        return {
+            'statusCode': 503,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Breach database not available'})
+        }
+    
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
     cur.execute(
-        "SELECT id, site_url, site_name, username, encrypted_password, created_at FROM passwords WHERE user_id = %s ORDER BY created_at DESC",
+        f"SELECT id, site_name, encrypted_password FROM {SCHEMA}passwords WHERE user_id = %s AND deleted_at IS NULL",
         (user_id,)
     )
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
     
-    passwords = []
-    for row in cur.fetchall():
-        passwords.append({
-            'id': row[0],
-            'site_url': row[1],
-            'site_name': row[2],
-            'username': row[3],
-            'password': decrypt_password(row[4]),
-            'created_at': row[5].isoformat()
+    breached = []
+    with timed('breach_check'):
+        for password_id, site_name, encrypted in rows:
+            if is_breached(decrypt_password(encrypted), breach_filter):
+                breached.append({'id': password_id, 'site_name': site_name})
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'checked': len(rows),
+            'breached': breached,
+            'corpus_size': breach_filter[3]
         })
+    }
+
+def password_fingerprint(user_id: int, password: str) -> str:
+    '''Ключевой отпечаток пароля в пределах пользователя (HMAC-SHA256)'''
+    return hmac.new(FINGERPRINT_KEY, f"{user_id}:{password}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+def password_strength(password: str) -> int:
+    '''Оценка стойкости 0–4 по энтропии алфавита с поправкой на повторы и последовательности'''
+    pool = 0
+    if any(c.islower() for c in password):
+        pool += 26
+    if any(c.isupper() for c in password):
+        pool += 26
+    if any(c.isdigit() for c in password):
+        pool += 10
+    if any(not c.isalnum() for c in password):
+        pool += 33
+    
+    # Повтор предыдущего символа или шаг ±1 (aaa, 123, abc) почти не добавляет энтропии
+    effective = 0.0
+    for i, c in enumerate(password):
+        if i and abs(ord(c) - ord(password[i - 1])) <= 1:
+            effective += 0.25
+        else:
+            effective += 1
+    bits = effective * math.log2(pool or 1)
+    
+    breach_filter = get_breach_filter()
+    if breach_filter and is_breached(password, breach_filter):
+        return 0
+    if bits < 28:
+        return 0
+    if bits < 36:
+        return 1
+    if bits < 60:
+        return 2
+    if bits < 80:
+        return 3
+    return 4
+
+def password_row(user_id: int, site_url: str, site_name: str, username: str, password: str) -> tuple:
+    '''Значения для SAVE_PASSWORD_SQL: домен, шифртекст, отпечаток и стойкость считаются один раз при записи'''
+    return (
+        user_id, site_url, registrable_domain(site_host(site_url)), site_name, username,
+        encrypt_password(password), password_fingerprint(user_id, password), password_strength(password)
+    )
+
+@read_only
+def get_security_report(user_id: int) -> dict:
+    '''Отчёт о повторно используемых и слабых паролях без расшифровки хранилища'''
+    conn = db_connect()
+    cur = conn.cursor()
+    
+    # Записи, сохранённые до V0007, без отпечатка: их досчитывает scripts/backfill_fingerprints.py,
+    # а до тех пор они только подсчитываются как unscored
+    cur.execute(
+        f"SELECT array_agg(id ORDER BY id), array_agg(site_name ORDER BY id) FROM {SCHEMA}passwords "
+        "WHERE user_id = %s AND deleted_at IS NULL AND password_fingerprint IS NOT NULL "
+        "GROUP BY password_fingerprint HAVING COUNT(*) > 1",
+        (user_id,)
+    )
+    reused = [{'ids': ids, 'site_names': names} for ids, names in cur.fetchall()]
+    
+    cur.execute(
+        f"SELECT id, site_name, strength FROM {SCHEMA}passwords WHERE user_id = %s AND deleted_at IS NULL AND strength <= %s ORDER BY strength, id",
+        (user_id, WEAK_STRENGTH)
+    )
+    weak = [{'id': row[0], 'site_name': row[1], 'strength': row[2]} for row in cur.fetchall()]
+    
+    cur.execute(
+        f"SELECT COUNT(*) FROM {SCHEMA}passwords WHERE user_id = %s AND deleted_at IS NULL AND password_fingerprint IS NULL",
+        (user_id,)
+    )
+    unscored = cur.fetchone()[0]
     
     cur.close()
     conn.close()
@@ -99,7 +972,7 @@ def get_passwords(user_id: int) -> dict:
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'passwords': passwords})
+        'body': json.dumps({'reused': reused, 'weak': weak, 'unscored': unscored})
     }
 
 def save_password(user_id: int, data: dict) -> dict:
@@ -116,18 +989,15 @@ def save_password(user_id: int, data: dict) -> dict:
             'body': json.dumps({'error': 'Site URL and password required'})
         }
     
-    encrypted = encrypt_password(password)
+    with timed('encrypt'):
+        row = password_row(user_id, site_url, site_name, username, password)
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
-    cur.execute(
-        "INSERT INTO passwords (user_id, site_url, site_name, username, encrypted_password, created_at) VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP) RETURNING id",
-        (user_id, site_url, site_name, username, encrypted)
-    )
+    cur.execute(SAVE_PASSWORD_SQL, (user_id, *row))
     
-    password_id = cur.fetchone()[0]
+    password_id, version = cur.fetchone()
     conn.commit()
     cur.close()
     conn.close()
@@ -135,16 +1005,15 @@ def save_password(user_id: int, data: dict) -> dict:
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'id': password_id, 'message': 'Password saved'})
+        'body': json.dumps({'id': password_id, 'version': version, 'message': 'Password saved'})
     }
 
 def delete_password(user_id: int, password_id: int) -> dict:
     '''Удаление пароля'''
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db_connect()
     cur = conn.cursor()
-    cur.execute(f"SET search_path TO {os.environ['MAIN_DB_SCHEMA']}")
     
-    cur.execute("UPDATE passwords SET encrypted_password = '' WHERE id = %s AND user_id = %s", (password_id, user_id))
+    cur.execute(DELETE_PASSWORD_SQL, (user_id, password_id, user_id))
     
     conn.commit()
     cur.close()
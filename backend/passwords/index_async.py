@@ -0,0 +1,236 @@
+import asyncio
+import functools
+import json
+import os
+import weakref
+from contextlib import asynccontextmanager
+import psycopg
+from psycopg_pool import AsyncConnectionPool, PoolTimeout  # requirements-async.txt
+
+import index
+from index import verify_token, dumps, compress_response, decrypt_password, password_row, GET_PASSWORDS_SQL, SAVE_PASSWORD_SQL, DELETE_PASSWORD_SQL
+
+# >>> shared: async-pool (benchmarks/sync_shared.py)
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+
+# Серверные prepared statements для горячих запросов. Через PgBouncer в режиме transaction
+# они работают с версии 1.21 (max_prepared_statements); для более старых пулеров DB_PREPARED_STATEMENTS=0
+PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') != '0'
+
+_pools = {}
+_pool_loop = None
+_pool_conns = weakref.WeakSet()
+
+class TimedAsyncCursor(psycopg.AsyncCursor):
+    '''Асинхронный курсор, замеряющий время каждого запроса'''
+    async def execute(self, query, params=None, **kwargs):
+        with index.timed('db_query'):
+            return await super().execute(query, params, **kwargs)
+
+async def remember_connection(conn) -> None:
+    '''Запоминает соединения пулов, чтобы закрыть их вместе с их event loop'''
+    _pool_conns.add(conn)
+
+def discard_pools() -> None:
+    '''Закрывает пулы прошлого event loop: на завершённом loop await pool.close() уже не выполнить'''
+    if _pool_loop.is_closed():
+        for conn in list(_pool_conns):
+            conn.pgconn.finish()
+    else:
+        for pool in _pools.values():
+            asyncio.run_coroutine_threadsafe(pool.close(), _pool_loop)
+    _pool_conns.clear()
+    _pools.clear()
+
+async def get_pool(url: str = None, connect_timeout: int = None) -> AsyncConnectionPool:
+    '''Пул соединений к url (по умолчанию DATABASE_URL), привязанный к текущему event loop; пулы прежнего loop закрываются'''
+    global _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool_loop is not loop:
+        if _pools:
+            discard_pools()
+        _pool_loop = loop
+    
+    url = url or os.environ['DATABASE_URL']
+    pool = _pools.get(url)
+    if pool is None:
+        pool = _pools[url] = AsyncConnectionPool(
+            url,
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            kwargs={
+                'prepare_threshold': 5 if PREPARED_STATEMENTS else None,
+                'cursor_factory': TimedAsyncCursor,
+                'connect_timeout': connect_timeout
+            },
+            configure=remember_connection,
+            open=False
+        )
+    if pool.closed:
+        await pool.open()
+    return pool
+# <<< shared: async-pool
+
+# >>> shared: async-routing (benchmarks/sync_shared.py)
+# Асинхронные варианты instrumented, read_your_writes и read_only из index.py. Состояние запроса (спаны метрик,
+# отметка записи, выбор реплики) там хранится в ContextLocal, поэтому у каждой задачи asyncio оно своё
+def instrumented_async(func):
+    '''instrumented для корутин: тот же JSON-лог запроса'''
+    @functools.wraps(func)
+    async def wrapper(event: dict, context) -> dict:
+        cold_start, start = index.start_request()
+        result = None
+        error = None
+        try:
+            result = await func(event, context)
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            index.log_request(event, result, error, cold_start, start)
+    return wrapper
+
+def read_your_writes_async(func):
+    '''read_your_writes для корутин'''
+    @functools.wraps(func)
+    async def wrapper(event: dict, context) -> dict:
+        index.start_routing(event)
+        return index.finish_routing(await func(event, context))
+    return wrapper
+
+def read_only_async(func):
+    '''read_only для корутин: чтение через пул реплики, при её ошибке — повтор на основном пуле'''
+    @functools.wraps(func)
+    async def wrapper(user_id: int, *args, **kwargs):
+        if not index.use_replica():
+            return await func(user_id, *args, **kwargs)
+        index._routing.replica = True
+        try:
+            return await func(user_id, *args, **kwargs)
+        except (psycopg.OperationalError, psycopg.InterfaceError, PoolTimeout) as e:
+            index.mark_replica_down(func.__name__, e)
+        finally:
+            index._routing.replica = False
+        return await func(user_id, *args, **kwargs)
+    return wrapper
+
+@asynccontextmanager
+async def connection():
+    '''Соединение из пула; внутри read_only_async — из пула реплики, если она видит запись клиента'''
+    if getattr(index._routing, 'replica', False):
+        pool = await get_pool(index.DATABASE_READ_URL, index.REPLICA_CONNECT_TIMEOUT)
+        async with pool.connection(timeout=index.REPLICA_CONNECT_TIMEOUT) as conn:
+            if await replica_caught_up(conn):
+                yield conn
+                return
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+async def replica_caught_up(conn) -> bool:
+    '''index.replica_caught_up для соединения psycopg 3'''
+    last_write = index.recent_write()
+    if last_write is None:
+        return True
+    cur = await conn.execute(index.REPLICA_CAUGHT_UP_SQL, (last_write,))
+    return (await cur.fetchone())[0]
+# <<< shared: async-routing
+
+async def handler(event: dict, context) -> dict:
+    '''Асинхронный менеджер паролей: несколько запросов на один тёплый инстанс'''
+    method = event.get('httpMethod', 'GET')
+    query_params = event.get('queryStringParameters') or {}
+    
+    if query_params or method not in ('GET', 'POST', 'DELETE') or (method == 'POST' and event.get('headers', {}).get('Idempotency-Key')):
+        return await asyncio.to_thread(index.handler, event, context)
+    return await pooled_handler(event, context)
+
+@instrumented_async
+@read_your_writes_async
+async def pooled_handler(event: dict, context) -> dict:
+    '''Список, сохранение без Idempotency-Key и удаление паролей на пуле соединений'''
+    method = event.get('httpMethod', 'GET')
+    
+    auth_header = event.get('headers', {}).get('X-Authorization', '')
+    user_id = verify_token(auth_header)
+    
+    if not user_id:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'})
+        }
+    
+    if method == 'GET':
+        return compress_response(event, await get_passwords(user_id))
+    
+    index.note_write()
+    data = json.loads(event.get('body', '{}'))
+    if method == 'POST':
+        return await save_password(user_id, data)
+    return await delete_password(user_id, data.get('id'))
+
+@read_only_async
+async def get_passwords(user_id: int) -> dict:
+    '''Получение всех паролей пользователя'''
+    async with connection() as conn:
+        cur = await conn.execute(GET_PASSWORDS_SQL, (user_id,), prepare=PREPARED_STATEMENTS)
+        rows = await cur.fetchall()
+    
+    passwords = []
+    for row in rows:
+        passwords.append({
+            'id': row[0],
+            'site_url': row[1],
+            'site_name': row[2],
+            'username': row[3],
+            'password': decrypt_password(row[4]),
+            'created_at': row[5].isoformat()
+        })
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({'passwords': passwords})
+    }
+
+async def save_password(user_id: int, data: dict) -> dict:
+    '''Сохранение пароля'''
+    site_url = data.get('site_url', '')
+    site_name = data.get('site_name', '')
+    username = data.get('username', '')
+    password = data.get('password', '')
+    
+    if not site_url or not password:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Site URL and password required'})
+        }
+    
+    row = password_row(user_id, site_url, site_name, username, password)
+    
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        cur = await conn.execute(SAVE_PASSWORD_SQL, (user_id, *row), prepare=PREPARED_STATEMENTS)
+        password_id, version = await cur.fetchone()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'id': password_id, 'version': version, 'message': 'Password saved'})
+    }
+
+async def delete_password(user_id: int, password_id: int) -> dict:
+    '''Удаление пароля'''
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        await conn.execute(DELETE_PASSWORD_SQL, (user_id, password_id, user_id), prepare=PREPARED_STATEMENTS)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'message': 'Password deleted'})
+    }
@@ -0,0 +1,26 @@
+"""Helpers shared by the scripts in this directory (run them from any cwd: python benchmarks/<script>.py)."""
+import importlib.util
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+FUNCTIONS = {
+    'api': ROOT / 'backend' / 'api',
+    'passwords': ROOT / 'backend' / 'passwords',
+    'documents': ROOT / 'backend' / 'documents',
+    'ai-assistant': ROOT / 'backend' / 'ai-assistant',
+    'vk-auth': ROOT / 'backend' / 'extensions' / 'vk-auth' / 'vk-auth',
+}
+
+
+def import_module(path: Path, module_name: str):
+    """Execute a file as a new module; every function ships its own index.py, so names must be unique."""
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_function(name: str, module_name: str = ''):
+    """A fresh copy of a function's index.py with its own module state."""
+    return import_module(FUNCTIONS[name] / 'index.py', module_name or f'bench_{name.replace("-", "_")}')
@@ -0,0 +1,78 @@
+"""Per-query latency of the assistant's math path: current evaluator vs the old eval-based one.
+
+    python benchmarks/bench_assistant_math.py [--number 20000]
+"""
+import argparse
+import json
+import re
+import sys
+import timeit
+
+from _util import load_function
+
+QUERIES = [
+    'сколько будет 15 плюс 25',
+    '2+3*4',
+    '120 умножить на 35',
+    '1000 разделить на 8',
+    'сколько будет 7 минус 12',
+    '(2 + 3) * 4 - 1',
+    '20 процентов от 150',
+    'пятнадцать плюс двадцать пять',
+]
+
+
+def legacy_handle_math(query: str) -> dict:
+    '''handle_math before the tokenizer/evaluator rewrite, kept for comparison'''
+    try:
+        query = query.replace('умножить на', '*').replace('разделить на', '/')
+        query = query.replace('плюс', '+').replace('минус', '-')
+        query = query.replace('х', '*').replace('÷', '/')
+
+        numbers = re.findall(r'\d+\.?\d*', query)
+        operators = re.findall(r'[\+\-\*/]', query)
+
+        if len(numbers) >= 2 and len(operators) >= 1:
+            expression = numbers[0]
+            for i, op in enumerate(operators):
+                if i + 1 < len(numbers):
+                    expression += op + numbers[i + 1]
+
+            result = eval(expression)
+            response = f'Ответ: {result}'
+        else:
+            response = 'Не смог распознать пример. Попробуйте: "сколько будет 15 плюс 25"'
+
+        return {'statusCode': 200, 'body': json.dumps({'response': response, 'type': 'math'})}
+    except Exception as e:
+        return {'statusCode': 200, 'body': json.dumps({'response': f'Ошибка вычисления: {str(e)}', 'type': 'math'})}
+
+
+def per_query_us(fn, number: int) -> float:
+    total = timeit.timeit(lambda: [fn(q) for q in QUERIES], number=number)
+    return total / (number * len(QUERIES)) * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    assistant = load_function('ai-assistant')
+
+    print(f'{"query":45} {"legacy":>28} {"current":>28}')
+    for q in QUERIES:
+        old = json.loads(legacy_handle_math(q)['body'])['response']
+        new = json.loads(assistant.handle_math(q)['body'])['response']
+        print(f'{q:45} {old[:28]:>28} {new[:28]:>28}')
+
+    legacy = per_query_us(legacy_handle_math, args.number)
+    current = per_query_us(assistant.handle_math, args.number)
+    print()
+    print(f'legacy  handle_math: {legacy:8.2f} us/query')
+    print(f'current handle_math: {current:8.2f} us/query ({legacy / current:.2f}x)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""False-positive rate and lookup throughput of the breached-password Bloom filter.
+
+Builds filters from a synthetic corpus of --entries random passwords at each
+--fpr target with benchmarks/build_breach_filter.py, maps them the way the
+passwords function does (get_breach_filter) and reports:
+
+  * file size and build time;
+  * recall on corpus members (must be 100%) and the observed false-positive
+    rate on --probes passwords that are not in the corpus;
+  * is_breached() lookups per second and the time to audit a --vault-size vault.
+
+    python benchmarks/bench_breach_filter.py --entries 1000000 --fpr 0.01 0.001 0.0001
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import build_breach_filter  # noqa: E402
+
+
+def random_passwords(count: int, rng: random.Random, prefix: str) -> list:
+    alphabet = string.ascii_letters + string.digits + '!@#$%'
+    return [prefix + ''.join(rng.choice(alphabet) for _ in range(rng.randint(6, 14))) for _ in range(count)]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=200000)
+    parser.add_argument('--fpr', type=float, nargs='+', default=[0.01, 0.001])
+    parser.add_argument('--probes', type=int, default=200000, help='non-member passwords used to measure the FPR')
+    parser.add_argument('--vault-size', type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    members = random_passwords(args.entries, rng, 'm:')
+    probes = random_passwords(args.probes, rng, 'p:')
+
+    with tempfile.TemporaryDirectory(prefix='breach-bench-') as tmp:
+        corpus = Path(tmp) / 'corpus.txt'
+        corpus.write_text('\n'.join(members) + '\n', encoding='utf-8')
+
+        print(f'{args.entries} corpus entries, {args.probes} probes\n')
+        print(f'{"target fpr":>10} {"size MiB":>9} {"hashes":>7} {"build s":>8} {"recall":>8} {"observed fpr":>13} '
+              f'{"lookups/s":>11} {"vault ms":>9}')
+        for fpr in args.fpr:
+            output = Path(tmp) / f'filter-{fpr:g}.bloom'
+            os.environ['BREACH_FILTER_PATH'] = str(output)
+            passwords = build_breach_filter.load_passwords()
+
+            started = time.perf_counter()
+            count = sum(1 for _ in build_breach_filter.iter_digests(corpus, True, 1))
+            bits, num_bits, num_hashes, inserted = build_breach_filter.build(
+                build_breach_filter.iter_digests(corpus, True, 1), count, fpr, passwords
+            )
+            build_breach_filter.write_filter(output, bits, num_bits, num_hashes, inserted, passwords)
+            build_s = time.perf_counter() - started
+
+            breach_filter = passwords.get_breach_filter()
+            sample = members[:min(len(members), 50000)]
+            recall = sum(passwords.is_breached(p, breach_filter) for p in sample) / len(sample)
+
+            started = time.perf_counter()
+            false_positives = sum(passwords.is_breached(p, breach_filter) for p in probes)
+            lookups_per_s = len(probes) / (time.perf_counter() - started)
+
+            vault = rng.sample(probes, min(args.vault_size, len(probes)))
+            started = time.perf_counter()
+            for p in vault:
+                passwords.is_breached(p, breach_filter)
+            vault_ms = (time.perf_counter() - started) * 1000
+
+            print(f'{fpr:>10g} {output.stat().st_size / 2 ** 20:>9.2f} {num_hashes:>7} {build_s:>8.2f} {recall:>8.2%} '
+                  f'{false_positives / len(probes):>13.5f} {lookups_per_s:>11.0f} {vault_ms:>9.2f}')
+            breach_filter[0].close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
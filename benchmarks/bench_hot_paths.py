@@ -0,0 +1,107 @@
+"""Micro-benchmarks for the CPU-bound pieces of every request.
+
+Covers create_jwt/verify_token (api), encrypt_password/decrypt_password
+(passwords) and generate_qr_code (documents) with fixed inputs of several
+sizes. Results are compared against a stored baseline; cases slower than the
+baseline by more than --threshold are flagged and make the script exit 1.
+
+    python benchmarks/bench_hot_paths.py                  # compare with baseline
+    python benchmarks/bench_hot_paths.py --save           # record a new baseline
+    python benchmarks/bench_hot_paths.py --filter qr      # only matching cases
+
+Baselines are machine-specific: record one on the machine you compare on.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import date, datetime
+from pathlib import Path
+
+from _util import load_function
+
+BASELINE = Path(__file__).resolve().parent / 'baselines' / 'hot_paths.json'
+
+os.environ.setdefault('JWT_SECRET', 'bench-secret-key-bench-secret-key-0123')
+os.environ.setdefault('METRICS_SAMPLE_RATE', '0')
+
+
+def build_cases() -> dict:
+    """name -> zero-argument callable with fixed inputs."""
+    api = load_function('api')
+    passwords = load_function('passwords')
+    documents = load_function('documents')
+
+    cases = {}
+
+    premium = (datetime(2030, 1, 1), 'pro_analytics', date(1990, 2, 28))
+    for user_id in (7, 123456789):
+        token = api.create_jwt(user_id, premium)
+        cases[f'create_jwt[user_id={user_id}]'] = lambda u=user_id: api.create_jwt(u, premium)
+        cases[f'verify_token[user_id={user_id}]'] = lambda t=f'Bearer {token}': api.verify_token(t)
+    cases['verify_token[bad signature]'] = lambda t=f'Bearer {token[:-4]}AAAA': api.verify_token(t)
+
+    for size in (8, 64, 1024):
+        plaintext = ('p@ssW0rd-' * size)[:size]
+        encrypted = passwords.encrypt_password(plaintext)
+        cases[f'encrypt_password[{size}]'] = lambda p=plaintext: passwords.encrypt_password(p)
+        cases[f'decrypt_password[{size}]'] = lambda e=encrypted: passwords.decrypt_password(e)
+
+    for size in (32, 256, 1024):
+        payload = json.dumps({'type': 'passport', 'name': 'Иванов Иван', 'pad': 'x' * size})[:size]
+        cases[f'generate_qr_code[{size}]'] = lambda d=payload: documents.generate_qr_code(d)
+
+    return cases
+
+
+def measure(fn, min_time: float = 0.2, repeat: int = 5) -> float:
+    """Best per-call time in microseconds over `repeat` runs of at least `min_time` seconds."""
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--save', action='store_true', help='store results as the new baseline')
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown vs baseline (0.2 = 20%%)')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this string')
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    results = {}
+    regressions = []
+
+    print(f'{"case":34} {"us/call":>12} {"baseline":>12} {"change":>9}')
+    for name, fn in build_cases().items():
+        if args.filter not in name:
+            continue
+        us = measure(fn)
+        results[name] = round(us, 3)
+        base = baseline.get(name)
+        if base:
+            change = us / base - 1
+            flag = '  REGRESSION' if change > args.threshold else ''
+            if flag:
+                regressions.append(name)
+            print(f'{name:34} {us:>12.2f} {base:>12.2f} {change:>+8.1%}{flag}')
+        else:
+            print(f'{name:34} {us:>12.2f} {"-":>12} {"-":>9}')
+
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({**baseline, **results}, indent=2, ensure_ascii=False) + '\n')
+        print(f'\nbaseline written to {args.baseline}')
+        return 0
+
+    if regressions:
+        print(f'\n{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""Cold-start import cost of each backend function, measured with `python -X importtime`.
+
+    python benchmarks/bench_import_time.py [--runs 5] [--top 8] [--max-ms api=60 documents=80]
+
+Each run imports the function's index.py in a fresh interpreter; the median
+cumulative time is reported along with the heaviest top-level imports.
+With --max-ms the script exits non-zero when a function exceeds its budget.
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+from _util import FUNCTIONS
+
+LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def import_profile(path: Path) -> list:
+    """(self_us, cumulative_us, depth, module) for every module imported by `import index`."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import index'],
+        cwd=path, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = LINE_RE.match(line)
+        if m:
+            rows.append((int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2, m.group(4)))
+    return rows
+
+
+def direct_imports(rows: list) -> list:
+    """Rows imported directly by index.py (importtime lists children before their parent)."""
+    end = next(i for i, row in enumerate(rows) if row[3] == 'index')
+    depth = rows[end][2]
+    children = []
+    for row in reversed(rows[:end]):
+        if row[2] <= depth:
+            break
+        if row[2] == depth + 1:
+            children.append(row)
+    return children
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8)
+    parser.add_argument('--max-ms', nargs='*', default=[], metavar='FUNCTION=MS')
+    parser.add_argument('functions', nargs='*', default=list(FUNCTIONS))
+    args = parser.parse_args()
+
+    budgets = {k: float(v) for k, v in (item.split('=', 1) for item in args.max_ms)}
+    failed = False
+
+    for name in args.functions:
+        try:
+            profiles = [import_profile(FUNCTIONS[name]) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f'{name}: import failed: {e}')
+            failed = True
+            continue
+
+        totals = [next(cum for _, cum, _, mod in rows if mod == 'index') / 1000 for rows in profiles]
+        median_ms = statistics.median(totals)
+        budget = budgets.get(name)
+        status = '' if budget is None else (' OK' if median_ms <= budget else f' OVER BUDGET ({budget:.0f} ms)')
+        failed |= budget is not None and median_ms > budget
+
+        print(f'{name}: import index {median_ms:.1f} ms (median of {args.runs}){status}')
+        top_level = sorted(direct_imports(profiles[-1]), key=lambda row: -row[1])
+        for _, cum, _, mod in top_level[:args.top]:
+            print(f'    {cum / 1000:8.1f} ms  {mod}')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
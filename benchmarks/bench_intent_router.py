@@ -0,0 +1,61 @@
+"""Query classification cost of the assistant's intent router vs a per-keyword substring scan.
+
+    python benchmarks/bench_intent_router.py [--keywords 100 1000 5000] [--number 2000]
+"""
+import argparse
+import random
+import sys
+import timeit
+
+from _util import load_function
+
+QUERIES = [
+    'погода в москве',
+    'сколько будет 15 плюс 25',
+    'кто написал войну и мир',
+    'какая завтра погода в санкт-петербурге',
+    'расскажи анекдот про программистов',
+]
+
+ALPHABET = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+
+
+def synthetic_keywords(count: int, rng: random.Random) -> dict:
+    return {''.join(rng.choice(ALPHABET) for _ in range(rng.randint(4, 12))): ('intent', f'intent{i % 50}') for i in range(count)}
+
+
+def substring_scan(keywords: dict, query: str) -> set:
+    return {value for keyword, value in keywords.items() if keyword in query}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keywords', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    assistant = load_function('ai-assistant')
+    rng = random.Random(42)
+
+    print(f'{"keywords":>9} {"build ms":>9} {"scan us/q":>10} {"router us/q":>12}')
+    for count in args.keywords:
+        keywords = synthetic_keywords(count, rng)
+        keywords.update({kw: ('intent', intent) for intent, kws in assistant.INTENT_KEYWORDS.items() for kw in kws})
+        keywords.update({alias: ('city', city) for alias, city in assistant.CITY_ALIASES.items()})
+
+        build = timeit.timeit(lambda: assistant.build_keyword_automaton(keywords), number=1) * 1e3
+        automaton = assistant.build_keyword_automaton(keywords)
+
+        for q in QUERIES:
+            assert {v for _, v in assistant.match_keywords(automaton, q)} == substring_scan(keywords, q), q
+
+        n = max(1, args.number * 100 // count)
+        scan = timeit.timeit(lambda: [substring_scan(keywords, q) for q in QUERIES], number=n)
+        router = timeit.timeit(lambda: [list(assistant.match_keywords(automaton, q)) for q in QUERIES], number=n)
+        per_query = lambda total: total / (n * len(QUERIES)) * 1e6
+        print(f'{count:>9} {build:>9.2f} {per_query(scan):>10.2f} {per_query(router):>12.2f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Bytes on the wire and serialization cost of the large list responses.
+
+Builds representative bodies for get_passwords, get_documents (with real QR
+images from generate_qr_code) and get_statistics at several sizes, then
+reports for each:
+
+  * raw JSON size and the gzip / brotli sizes produced by compress_response;
+  * serialization time with stdlib json.dumps and with the function's dumps()
+    (orjson when installed);
+  * compression time per encoding.
+
+    python benchmarks/bench_response_size.py [--passwords 10 100 1000] [--documents 1 10 50]
+
+brotli and orjson are optional; missing ones are shown as "-".
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from _util import load_function
+
+os.environ.setdefault('JWT_SECRET', 'bench-secret-key-bench-secret-key-0123')
+os.environ.setdefault('METRICS_SAMPLE_RATE', '0')
+os.environ['COMPRESSION_MIN_BYTES'] = '0'
+
+
+def passwords_body(count: int, rng: random.Random, passwords) -> dict:
+    now = datetime(2024, 1, 1)
+    return {'passwords': [{
+        'id': i,
+        'site_url': f'https://site{i}.example.com/login',
+        'site_name': f'Сайт {i}',
+        'username': f'user{rng.randint(1, 9999)}@mail.ru',
+        'password': passwords.decrypt_password(passwords.encrypt_password(f'pw-{rng.getrandbits(48):x}')),
+        'created_at': (now + timedelta(minutes=i)).isoformat(),
+    } for i in range(count)]}
+
+
+def documents_body(count: int, documents) -> dict:
+    docs = []
+    for i in range(count):
+        qr_data = json.dumps({'type': 'passport', 'name': f'Иванов Иван {i}', 'passport': f'4510 {100000 + i}',
+                              'issued': datetime(2024, 1, 1).isoformat()})
+        docs.append({
+            'id': i, 'type': 'passport', 'first_name': 'Иван', 'last_name': 'Иванов', 'middle_name': 'Иванович',
+            'birth_date': '1990-01-01', 'passport_number': f'4510 {100000 + i}',
+            'qr_code': documents.generate_qr_code(qr_data), 'created_at': datetime(2024, 1, 1).isoformat(),
+        })
+    return {'documents': docs}
+
+
+def statistics_body() -> dict:
+    by_type = {'visit': 1200, 'search': 340, 'password_saved': 41, 'document_created': 3, 'assistant_query': 87}
+    return {'total_actions': sum(by_type.values()), 'week_actions': 96, 'by_type': by_type}
+
+
+def best_us(fn, number: int = 0) -> float:
+    timer = timeit.Timer(fn)
+    if not number:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e6
+
+
+def measure(name: str, body: dict, module) -> None:
+    raw = json.dumps(body)
+    stdlib_us = best_us(lambda: json.dumps(body))
+    fast_us = best_us(lambda: module.dumps(body)) if module.load_orjson() is not None else None
+
+    sizes, times = {}, {}
+    for encoding in ('gzip', 'br'):
+        if encoding == 'br' and module.load_brotli() is None:
+            continue
+        event = {'headers': {'Accept-Encoding': encoding}}
+        result = {'statusCode': 200, 'headers': {}, 'body': raw}
+        compressed = module.compress_response(event, result)
+        sizes[encoding] = len(base64.b64decode(compressed['body']))
+        times[encoding] = best_us(lambda e=event: module.compress_response(e, result))
+
+    def cell(value, width: int, fmt: str = '') -> str:
+        return f'{value:>{width}{fmt}}' if value is not None else f'{"-":>{width}}'
+
+    print(f'{name:24} {len(raw.encode()):>10} {cell(sizes.get("gzip"), 9)} {cell(sizes.get("br"), 9)} '
+          f'{stdlib_us:>11.1f} {cell(fast_us, 11, ".1f")} {cell(times.get("gzip"), 10, ".1f")} {cell(times.get("br"), 10, ".1f")}')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--passwords', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--documents', type=int, nargs='+', default=[1, 10, 50])
+    args = parser.parse_args()
+
+    api = load_function('api')
+    passwords = load_function('passwords')
+    documents = load_function('documents')
+    rng = random.Random(3)
+
+    print(f'{"response":24} {"raw B":>10} {"gzip B":>9} {"br B":>9} {"json us":>11} {"dumps us":>11} '
+          f'{"gzip us":>10} {"br us":>10}')
+    for count in args.passwords:
+        measure(f'get_passwords[{count}]', passwords_body(count, rng, passwords), passwords)
+    for count in args.documents:
+        measure(f'get_documents[{count}]', documents_body(count, documents), documents)
+    measure('get_statistics', statistics_body(), api)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
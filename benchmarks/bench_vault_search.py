@@ -0,0 +1,156 @@
+"""Latency of the passwords function's fuzzy vault search at a realistic vault size.
+
+Seeds one user with --entries vault rows (10k by default) and times
+search_passwords (pg_trgm, server side) for a set of queries: substrings,
+typos, usernames and misses. As a reference it also times the current
+client-side approach: get_passwords for the whole vault followed by a
+substring filter in Python.
+
+    # disposable Postgres cluster (needs initdb/pg_ctl on PATH)
+    python benchmarks/bench_vault_search.py --entries 10000
+
+    # existing database; migrations are applied to --schema
+    python benchmarks/bench_vault_search.py --database-url postgresql://... --schema bench
+
+Also prints the plan of one search so index use can be checked.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from _util import load_function  # noqa: E402
+from load_test import percentile, prepare_database, start_postgres  # noqa: E402
+
+WORDS = [
+    'google', 'yandex', 'github', 'gitlab', 'vk', 'telegram', 'mail', 'ozon', 'wildberries', 'avito',
+    'sber', 'tinkoff', 'alfa', 'gosuslugi', 'steam', 'netflix', 'spotify', 'amazon', 'apple', 'microsoft',
+    'dropbox', 'notion', 'slack', 'zoom', 'figma', 'jira', 'habr', 'kinopoisk', 'litres', 'hh',
+    'cloud', 'shop', 'bank', 'games', 'music', 'photo', 'travel', 'market', 'news', 'forum',
+]
+TLDS = ['com', 'ru', 'net', 'org', 'io', 'co.uk', 'spb.ru', 'xn--p1ai']
+
+QUERIES = {
+    'substring': 'github',
+    'prefix': 'wildb',
+    'typo': 'gosuslgi',
+    'username': 'ivan.petrov',
+    'multiword': 'tinkoff bank',
+    'miss': 'qwxzjv',
+}
+
+
+def seed_vault(database_url: str, schema: str, user_id: int, entries: int, passwords) -> None:
+    """Replace the user's vault with `entries` generated rows."""
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    rng = random.Random(42)
+    rows = []
+    for i in range(entries):
+        name = f'{rng.choice(WORDS)}{rng.choice(["", "-", " "])}{rng.choice(WORDS)}'.strip()
+        host = f'{rng.choice(["", "www.", "id.", "account."])}{name.replace(" ", "")}{i}.{rng.choice(TLDS)}'
+        username = f'{rng.choice(["ivan", "maria", "alex", "olga"])}.{rng.choice(["petrov", "smirnova", "ivanov"])}{rng.randint(1, 99)}'
+        site_url = f'https://{host}/login'
+        rows.append((
+            user_id, site_url, passwords.registrable_domain(passwords.site_host(site_url)), name.title(), username,
+            passwords.encrypt_password(f'pw-{i:06d}'), i + 1
+        ))
+
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    cur.execute(f'SET search_path TO {schema}')
+    cur.execute('DELETE FROM passwords WHERE user_id = %s', (user_id,))
+    execute_values(
+        cur,
+        'INSERT INTO passwords (user_id, site_url, site_domain, site_name, username, encrypted_password, version) VALUES %s',
+        rows, page_size=1000
+    )
+    cur.execute('UPDATE users SET vault_version = %s WHERE id = %s', (entries, user_id))
+    cur.execute('ANALYZE passwords')
+    conn.commit()
+    conn.close()
+
+
+def time_calls(fn, repeat: int) -> list:
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return sorted(samples)
+
+
+def explain(database_url: str, user_id: int, passwords, query: str) -> str:
+    import psycopg2
+
+    pattern = f'%{query}%'
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    match_sql = passwords.SEARCH_MATCH_SQL.format(trgm=passwords.trgm_schema(cur))
+    cur.execute(
+        f"EXPLAIN (ANALYZE, COSTS OFF) SELECT id FROM {passwords.SCHEMA}passwords WHERE user_id = %s AND deleted_at IS NULL "
+        f"AND {match_sql}",
+        (user_id, pattern, query)
+    )
+    plan = '\n'.join(row[0] for row in cur.fetchall())
+    conn.close()
+    return plan
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--database-url', help='use an existing database instead of starting a throwaway cluster')
+    parser.add_argument('--schema', default='bench')
+    args = parser.parse_args()
+
+    os.environ.setdefault('JWT_SECRET', 'bench-secret-key-bench-secret-key-0123')
+    os.environ.setdefault('METRICS_SAMPLE_RATE', '0')
+
+    stop = None
+    database_url = args.database_url
+    if not database_url:
+        database_url, stop = start_postgres()
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['MAIN_DB_SCHEMA'] = args.schema
+
+    try:
+        passwords = load_function('passwords')
+        user_id = prepare_database(database_url, args.schema)
+        seed_vault(database_url, args.schema, user_id, args.entries, passwords)
+
+        print(f'{args.entries} entries, {args.repeat} calls per case\n')
+        print(f'{"case":28} {"hits":>6} {"p50 ms":>8} {"p95 ms":>8}')
+        for name, query in QUERIES.items():
+            total = json.loads(passwords.search_passwords(user_id, query)['body'])['total']
+            samples = time_calls(lambda q=query: passwords.search_passwords(user_id, q), args.repeat)
+            print(f'{"search: " + name:28} {total:>6} {percentile(samples, 50):>8.2f} {percentile(samples, 95):>8.2f}')
+
+        samples = time_calls(lambda: passwords.search_passwords(user_id, 'github', 20, 200), args.repeat)
+        print(f'{"search: page 11":28} {"":>6} {percentile(samples, 50):>8.2f} {percentile(samples, 95):>8.2f}')
+
+        def client_side(query: str = 'github') -> list:
+            vault = json.loads(passwords.get_passwords(user_id)['body'])['passwords']
+            return [p for p in vault if query in f"{p['site_name']} {p['site_url']} {p['username']}".lower()]
+
+        samples = time_calls(client_side, max(5, args.repeat // 10))
+        print(f'{"full download + filter":28} {len(client_side()):>6} {percentile(samples, 50):>8.2f} {percentile(samples, 95):>8.2f}')
+
+        print(f'\nplan for {QUERIES["substring"]!r}:')
+        print(explain(database_url, user_id, passwords, QUERIES['substring']))
+    finally:
+        if stop:
+            stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
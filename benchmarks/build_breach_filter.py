@@ -0,0 +1,108 @@
+"""Build the passwords function's breached-password Bloom filter from a local corpus.
+
+    # Have I Been Pwned SHA-1 dump ("HEX:count" per line), ignoring rare entries
+    python benchmarks/build_breach_filter.py pwned-passwords-sha1.txt --min-count 10
+
+    # plaintext word list, one password per line
+    python benchmarks/build_breach_filter.py rockyou.txt --plain --fpr 0.0001
+
+The output (backend/passwords/breached_passwords.bloom by default; the function
+reads BREACH_FILTER_PATH) is the header described by BREACH_FILTER_HEADER in
+backend/passwords/index.py followed by the bit array. Bit positions come from
+the same bloom_positions() the function uses, so the two cannot drift apart.
+The filter is sized for --fpr from the entry count of a first pass over the
+corpus, and the bit array must fit in memory while building.
+"""
+import argparse
+import hashlib
+import math
+import os
+import sys
+import time
+from pathlib import Path
+
+from _util import FUNCTIONS, load_function
+
+PASSWORDS_DIR = FUNCTIONS['passwords']
+
+
+def load_passwords():
+    os.environ.setdefault('JWT_SECRET', 'build-breach-filter')
+    return load_function('passwords', 'breach_filter_passwords')
+
+
+def iter_digests(path: Path, plain: bool, min_count: int):
+    """SHA-1 digests of the corpus entries, skipping malformed lines."""
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.rstrip(b'\r\n')
+            if not line:
+                continue
+            if plain:
+                yield hashlib.sha1(line).digest()
+                continue
+            hex_digest, _, count = line.partition(b':')
+            if min_count > 1 and (not count.isdigit() or int(count) < min_count):
+                continue
+            try:
+                digest = bytes.fromhex(hex_digest.decode('ascii'))
+            except ValueError:
+                continue
+            if len(digest) == 20:
+                yield digest
+
+
+def filter_size(count: int, fpr: float) -> tuple:
+    """Optimal (bits, hashes) for `count` entries at false-positive rate `fpr`."""
+    num_bits = max(8, math.ceil(-count * math.log(fpr) / math.log(2) ** 2))
+    num_hashes = max(1, round(num_bits / max(count, 1) * math.log(2)))
+    return num_bits, num_hashes
+
+
+def build(digests, count: int, fpr: float, passwords) -> tuple:
+    """Bit array with every digest inserted; returns (bytes, bits, hashes, inserted)."""
+    num_bits, num_hashes = filter_size(count, fpr)
+    bits = bytearray((num_bits + 7) // 8)
+    inserted = 0
+    for digest in digests:
+        for pos in passwords.bloom_positions(digest, num_bits, num_hashes):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        inserted += 1
+    return bits, num_bits, num_hashes, inserted
+
+
+def write_filter(output: Path, bits: bytearray, num_bits: int, num_hashes: int, count: int, passwords) -> None:
+    tmp = output.with_suffix(output.suffix + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(passwords.BREACH_FILTER_HEADER.pack(passwords.BREACH_FILTER_MAGIC, num_bits, num_hashes, count))
+        f.write(bits)
+    os.replace(tmp, output)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('corpus', type=Path)
+    parser.add_argument('-o', '--output', type=Path, default=PASSWORDS_DIR / 'breached_passwords.bloom')
+    parser.add_argument('--fpr', type=float, default=0.001, help='target false-positive rate')
+    parser.add_argument('--plain', action='store_true', help='corpus lines are plaintext passwords, not SHA-1 hex')
+    parser.add_argument('--min-count', type=int, default=1, help='skip HIBP entries seen fewer times than this')
+    args = parser.parse_args()
+
+    passwords = load_passwords()
+    started = time.perf_counter()
+
+    count = sum(1 for _ in iter_digests(args.corpus, args.plain, args.min_count))
+    if not count:
+        print(f'no entries found in {args.corpus}', file=sys.stderr)
+        return 1
+
+    bits, num_bits, num_hashes, inserted = build(iter_digests(args.corpus, args.plain, args.min_count), count, args.fpr, passwords)
+    write_filter(args.output, bits, num_bits, num_hashes, inserted, passwords)
+
+    print(f'{inserted} entries, {num_bits} bits ({len(bits) / 2 ** 20:.1f} MiB), {num_hashes} hashes, '
+          f'target fpr {args.fpr:g}, built in {time.perf_counter() - started:.1f} s -> {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,360 @@
+"""Local development server hosting every backend function in one asyncio process.
+
+    python benchmarks/dev_server.py --port 8000
+    python benchmarks/dev_server.py --warm-pool --max-containers 4 --keep-alive 300
+
+Each function is mounted under its name (e.g. http://localhost:8000/api?endpoint=profile,
+/passwords, /documents, /ai-assistant, /vk-auth). Incoming HTTP requests are
+translated into the same `event` dict the cloud gateway passes to
+`handler(event, context)`, and the synchronous handlers run in a bounded
+thread pool (--workers) so the event loop keeps accepting connections.
+
+By default every function is imported once and shared by all requests. With
+--warm-pool each function instead gets a pool of "containers": separately
+imported copies of its index.py with their own module state (caches,
+cold-start flag). A container serves one request at a time, new ones are
+cold-started on demand up to --max-containers, and containers idle longer
+than --keep-alive seconds are retired, mimicking how the platform keeps warm
+instances. Third-party modules in sys.modules are still shared between
+containers, so per-container cold starts are cheaper than real ones.
+
+With --async-handlers, functions that ship an index_async.py are served by its
+coroutine handler, awaited directly on the event loop; the rest keep using
+the thread pool.
+
+Handlers see context.streaming = True on HTTP/1.1 connections. A handler may
+then return an iterable body (the assistant's streaming search does), which is
+relayed with chunked transfer encoding as the items are produced; the cloud
+runtime always sends a complete body instead.
+
+GET /_stats returns per-function request, cold-start and pool counters.
+Environment variables (DATABASE_URL, MAIN_DB_SCHEMA, JWT_SECRET, ...) are
+passed through to the handlers unchanged.
+"""
+import argparse
+import asyncio
+import base64
+import inspect
+import itertools
+import json
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, urlsplit
+
+from _util import FUNCTIONS, import_module
+
+MAX_BODY = 10 * 1024 * 1024
+
+_module_ids = itertools.count()
+_index_swap_lock = threading.Lock()
+
+
+def import_handler(name: str, use_async: bool = False):
+    """Import a fresh copy of a function's index.py (or index_async.py) and return its handler."""
+    prefix = f'devserver_{name.replace("-", "_")}_{next(_module_ids)}'
+    module = import_module(FUNCTIONS[name] / 'index.py', prefix)
+    async_path = FUNCTIONS[name] / 'index_async.py'
+    if use_async and async_path.exists():
+        # index_async.py does `import index`; point it at this copy while it loads
+        with _index_swap_lock:
+            previous = sys.modules.get('index')
+            sys.modules['index'] = module
+            try:
+                module = import_module(async_path, f'{prefix}_async')
+            finally:
+                if previous is None:
+                    sys.modules.pop('index', None)
+                else:
+                    sys.modules['index'] = previous
+    return module.handler
+
+
+async def call_handler(executor: ThreadPoolExecutor, handler, event: dict, context) -> dict:
+    if inspect.iscoroutinefunction(handler):
+        return await handler(event, context)
+    return await asyncio.get_running_loop().run_in_executor(executor, handler, event, context)
+
+
+# =============================================================================
+# FUNCTION HOSTS
+# =============================================================================
+
+class SharedHost:
+    """One imported module per function shared by all concurrent requests."""
+
+    def __init__(self, name: str, executor: ThreadPoolExecutor, use_async: bool = False):
+        self.name = name
+        self.executor = executor
+        self.use_async = use_async
+        self.handler = None
+        self.stats = {'requests': 0, 'cold_starts': 0}
+        self._import_lock = asyncio.Lock()
+
+    async def invoke(self, event: dict, context) -> dict:
+        loop = asyncio.get_running_loop()
+        async with self._import_lock:
+            if self.handler is None:
+                self.handler = await loop.run_in_executor(self.executor, import_handler, self.name, self.use_async)
+                self.stats['cold_starts'] += 1
+        self.stats['requests'] += 1
+        return await call_handler(self.executor, self.handler, event, context)
+
+    def snapshot(self) -> dict:
+        return dict(self.stats)
+
+
+class WarmPoolHost:
+    """Pool of single-request containers with cold starts and keep-alive expiry."""
+
+    def __init__(self, name: str, executor: ThreadPoolExecutor, max_containers: int, keep_alive: float,
+                 use_async: bool = False):
+        self.name = name
+        self.executor = executor
+        self.use_async = use_async
+        self.max_containers = max_containers
+        self.keep_alive = keep_alive
+        self.idle = []  # [(last_used, handler)], most recently used last
+        self.total = 0
+        self.available = asyncio.Condition()
+        self.stats = {'requests': 0, 'cold_starts': 0, 'retired': 0}
+
+    async def _acquire(self):
+        async with self.available:
+            while True:
+                self._retire_expired()
+                if self.idle:
+                    return self.idle.pop()[1]
+                if self.total < self.max_containers:
+                    self.total += 1
+                    break
+                await self.available.wait()
+
+        loop = asyncio.get_running_loop()
+        try:
+            handler = await loop.run_in_executor(self.executor, import_handler, self.name, self.use_async)
+        except Exception:
+            async with self.available:
+                self.total -= 1
+                self.available.notify()
+            raise
+        self.stats['cold_starts'] += 1
+        return handler
+
+    async def _release(self, handler):
+        async with self.available:
+            self.idle.append((time.monotonic(), handler))
+            self.available.notify()
+
+    def _retire_expired(self):
+        deadline = time.monotonic() - self.keep_alive
+        expired = [entry for entry in self.idle if entry[0] < deadline]
+        if expired:
+            self.idle = [entry for entry in self.idle if entry[0] >= deadline]
+            self.total -= len(expired)
+            self.stats['retired'] += len(expired)
+
+    async def invoke(self, event: dict, context) -> dict:
+        handler = await self._acquire()
+        self.stats['requests'] += 1
+        try:
+            return await call_handler(self.executor, handler, event, context)
+        finally:
+            await self._release(handler)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, 'containers': self.total, 'idle': len(self.idle)}
+
+
+# =============================================================================
+# HTTP
+# =============================================================================
+
+def build_event(method: str, target: str, headers: dict, body: bytes, peer: str) -> dict:
+    """Translate an HTTP request into the gateway's event dict."""
+    url = urlsplit(target)
+    try:
+        text, is_base64 = body.decode('utf-8'), False
+    except UnicodeDecodeError:
+        text, is_base64 = base64.b64encode(body).decode(), True
+    return {
+        'httpMethod': method,
+        'headers': headers,
+        'queryStringParameters': dict(parse_qsl(url.query, keep_blank_values=True)),
+        'body': text,
+        'isBase64Encoded': is_base64,
+        'requestContext': {
+            'requestId': str(uuid.uuid4()),
+            'identity': {'sourceIp': peer},
+            'httpMethod': method,
+        },
+    }
+
+
+def encode_response(result: dict, keep_alive: bool) -> bytes:
+    status = int(result.get('statusCode', 200))
+    body = result.get('body') or ''
+    if isinstance(body, str):
+        body = base64.b64decode(body) if result.get('isBase64Encoded') else body.encode('utf-8')
+    headers = {str(k): str(v) for k, v in (result.get('headers') or {}).items()}
+    headers.setdefault('Content-Type', 'application/json')
+    headers['Content-Length'] = str(len(body))
+    headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ''
+    head = f'HTTP/1.1 {status} {reason}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) + '\r\n'
+    return head.encode('latin-1') + body
+
+
+def is_streaming(result: dict) -> bool:
+    return not isinstance(result.get('body') or '', (str, bytes))
+
+
+async def write_chunked(writer: asyncio.StreamWriter, result: dict, keep_alive: bool) -> None:
+    """Relay an iterable body with chunked transfer encoding, pulling items in a worker thread."""
+    status = int(result.get('statusCode', 200))
+    headers = {str(k): str(v) for k, v in (result.get('headers') or {}).items()}
+    headers['Transfer-Encoding'] = 'chunked'
+    headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    head = f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) + '\r\n'
+    writer.write(head.encode('latin-1'))
+
+    loop = asyncio.get_running_loop()
+    items = iter(result['body'])
+    try:
+        while (item := await loop.run_in_executor(None, next, items, None)) is not None:
+            data = item.encode('utf-8') if isinstance(item, str) else item
+            if data:
+                writer.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+    finally:
+        close = getattr(items, 'close', None)
+        if close:
+            await loop.run_in_executor(None, close)
+
+
+def json_result(status: int, payload: dict) -> dict:
+    return {'statusCode': status, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(payload)}
+
+
+class DevServer:
+    def __init__(self, hosts: dict):
+        self.hosts = hosts
+
+    async def dispatch(self, method: str, target: str, headers: dict, body: bytes, peer: str, streaming: bool = False) -> dict:
+        path = urlsplit(target).path
+        name = path.strip('/').split('/', 1)[0]
+
+        if name == '_stats':
+            return json_result(200, {fn: host.snapshot() for fn, host in self.hosts.items()})
+
+        host = self.hosts.get(name)
+        if host is None:
+            return json_result(404, {'error': f'Unknown function: {name}', 'functions': list(self.hosts)})
+
+        event = build_event(method, target, headers, body, peer)
+        context = SimpleNamespace(
+            request_id=event['requestContext']['requestId'],
+            function_name=name,
+            function_version='local',
+            memory_limit_in_mb=128,
+            streaming=streaming,
+        )
+        try:
+            return await host.invoke(event, context)
+        except Exception as e:
+            print(f'{name}: unhandled {e!r}', file=sys.stderr)
+            return json_result(502, {'error': 'Function error', 'detail': repr(e)})
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = (writer.get_extra_info('peername') or ('', 0))[0]
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    writer.write(encode_response(json_result(400, {'error': 'Bad request line'}), False))
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip()] = value.strip()
+
+                lowered = {k.lower(): v for k, v in headers.items()}
+                length = int(lowered.get('content-length') or 0)
+                if length > MAX_BODY:
+                    writer.write(encode_response(json_result(413, {'error': 'Body too large'}), False))
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                keep_alive = (
+                    lowered.get('connection', '').lower() != 'close'
+                    and (version == 'HTTP/1.1' or lowered.get('connection', '').lower() == 'keep-alive')
+                )
+                result = await self.dispatch(method.upper(), target, headers, body, peer, version == 'HTTP/1.1')
+                if is_streaming(result):
+                    await write_chunked(writer, result, keep_alive)
+                else:
+                    writer.write(encode_response(result, keep_alive))
+                    await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args) -> None:
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='handler')
+    names = args.functions or list(FUNCTIONS)
+    if args.warm_pool:
+        hosts = {n: WarmPoolHost(n, executor, args.max_containers, args.keep_alive, args.async_handlers) for n in names}
+    else:
+        hosts = {n: SharedHost(n, executor, args.async_handlers) for n in names}
+
+    server = await asyncio.start_server(DevServer(hosts).handle_connection, args.host, args.port, backlog=1024)
+    mode = f'warm pool (max {args.max_containers} containers, keep-alive {args.keep_alive:g}s)' if args.warm_pool else 'shared'
+    if args.async_handlers:
+        mode += ', async handlers'
+    print(f'Serving {", ".join(names)} on http://{args.host}:{args.port} [{mode}, {args.workers} workers]')
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=16, help='thread pool size for running sync handlers')
+    parser.add_argument('--functions', nargs='*', choices=list(FUNCTIONS))
+    parser.add_argument('--warm-pool', action='store_true', help='emulate per-container module state and cold starts')
+    parser.add_argument('--max-containers', type=int, default=4, help='containers per function in warm-pool mode')
+    parser.add_argument('--async-handlers', action='store_true', help='serve index_async.py handlers where present')
+    parser.add_argument('--keep-alive', type=float, default=600, help='idle seconds before a container is retired')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
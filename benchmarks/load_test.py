@@ -0,0 +1,424 @@
+"""In-process load test for the backend functions.
+
+Every function's `handler(event, context)` is imported and called directly, so
+the numbers cover handler code, the database and outbound calls but not the
+cloud gateway. Scenarios come from each function's tests.json plus synthetic
+traffic mixes that use a seeded user.
+
+    # disposable Postgres cluster (needs initdb/pg_ctl on PATH)
+    python benchmarks/load_test.py --mix mixed --concurrency 8 --requests 2000
+
+    # existing database; migrations are applied to MAIN_DB_SCHEMA
+    python benchmarks/load_test.py --database-url postgresql://... --mix reads
+
+    # compare the sync handlers with the asyncio variants (index_async.py)
+    python benchmarks/load_test.py --mix reads --variant sync async --concurrency 32
+
+    # reads routed to a streaming standby of the throwaway cluster (DATABASE_READ_URL)
+    python benchmarks/load_test.py --mix mixed --replica
+
+Reports throughput and p50/p95/p99 latency per endpoint. Responses whose
+status differs from the scenario's expected status are counted as errors.
+The async variant drives coroutine handlers from one event loop (functions
+without an index_async.py run their sync handler via asyncio.to_thread);
+with several variants a throughput/p95 comparison is printed at the end.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, urlsplit
+
+from _util import FUNCTIONS, ROOT, import_module
+
+MIGRATIONS = ROOT / 'db_migrations'
+
+
+# (weight, function, method, query, body, authenticated, expected status[, label])
+# label names the report bucket when the endpoint does not tell requests apart (ai-assistant routes by the query text)
+MIXES = {
+    'reads': [
+        (3, 'api', 'GET', {'endpoint': 'profile'}, None, True, 200),
+        (3, 'api', 'GET', {'endpoint': 'premium'}, None, True, 200),
+        (1, 'api', 'GET', {'endpoint': 'statistics'}, None, True, 200),
+        (3, 'passwords', 'GET', {}, None, True, 200),
+        (2, 'passwords', 'GET', {'action': 'changes', 'since': '0'}, None, True, 200),
+        (3, 'passwords', 'GET', {'action': 'autofill', 'url': 'https://login.example.com/signin'}, None, True, 200),
+        (2, 'passwords', 'GET', {'action': 'search', 'q': 'exampl'}, None, True, 200),
+        (1, 'passwords', 'GET', {'action': 'report'}, None, True, 200),
+        (1, 'documents', 'GET', {}, None, True, 200),
+        (1, 'ai-assistant', 'POST', {}, {'query': 'сколько будет 15 плюс 25'}, True, 200, 'math'),
+        (1, 'ai-assistant', 'POST', {}, {'query': 'погода в москве'}, True, 200, 'weather'),
+    ],
+    'writes': [
+        (3, 'passwords', 'POST', {}, {'site_url': 'https://example.com', 'site_name': 'Example', 'username': 'user', 'password': 'hunter2-long-password'}, True, 200),
+        (1, 'documents', 'POST', {}, {'type': 'passport', 'first_name': 'Иван', 'last_name': 'Иванов', 'birth_date': '1990-01-01'}, True, 200),
+        (1, 'api', 'PUT', {'endpoint': 'profile'}, {'name': 'Load Test'}, True, 200),
+        (1, 'api', 'POST', {'endpoint': 'premium'}, {'plan': 'trial'}, True, 200),
+    ],
+}
+MIXES['mixed'] = MIXES['reads'] * 4 + MIXES['writes']
+
+
+# =============================================================================
+# DATABASE
+# =============================================================================
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_postgres() -> tuple:
+    """Start a throwaway cluster in a temp dir; returns (database_url, stop callback)."""
+    for tool in ('initdb', 'pg_ctl'):
+        if not shutil.which(tool):
+            raise SystemExit(f'{tool} not found on PATH; pass --database-url to use an existing database')
+
+    data_dir = tempfile.mkdtemp(prefix='loadtest-pg-')
+    port = free_port()
+    subprocess.run(['initdb', '-D', data_dir, '-U', 'postgres', '--auth=trust'], check=True, capture_output=True)
+    subprocess.run(
+        ['pg_ctl', '-D', data_dir, '-l', os.path.join(data_dir, 'server.log'), '-w', 'start',
+         '-o', f'-p {port} -k {data_dir} -c listen_addresses=127.0.0.1 -c max_connections=200'],
+        check=True, capture_output=True
+    )
+
+    def stop():
+        subprocess.run(['pg_ctl', '-D', data_dir, '-m', 'fast', 'stop'], capture_output=True)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return f'postgresql://postgres@127.0.0.1:{port}/postgres', stop
+
+
+def start_replica(primary_url: str) -> tuple:
+    """Clone a streaming standby of `primary_url` with pg_basebackup; returns (database_url, stop callback)."""
+    from urllib.parse import urlsplit
+
+    for tool in ('pg_basebackup', 'pg_ctl'):
+        if not shutil.which(tool):
+            raise SystemExit(f'{tool} not found on PATH; pass --read-url to use an existing replica')
+
+    primary = urlsplit(primary_url)
+    data_dir = tempfile.mkdtemp(prefix='loadtest-pg-replica-')
+    port = free_port()
+    subprocess.run(
+        ['pg_basebackup', '-D', data_dir, '-h', primary.hostname, '-p', str(primary.port or 5432),
+         '-U', primary.username or 'postgres', '-R', '-X', 'stream'],
+        check=True, capture_output=True
+    )
+    subprocess.run(
+        ['pg_ctl', '-D', data_dir, '-l', os.path.join(data_dir, 'server.log'), '-w', 'start',
+         '-o', f'-p {port} -k {data_dir} -c listen_addresses=127.0.0.1 -c max_connections=200 -c hot_standby=on'],
+        check=True, capture_output=True
+    )
+
+    def stop():
+        subprocess.run(['pg_ctl', '-D', data_dir, '-m', 'fast', 'stop'], capture_output=True)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return f'postgresql://postgres@127.0.0.1:{port}/postgres', stop
+
+
+def prepare_database(database_url: str, schema: str) -> int:
+    """Apply db_migrations to `schema` and seed a premium user; returns its id."""
+    import psycopg2
+
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f'CREATE SCHEMA IF NOT EXISTS {schema}')
+    cur.execute(f'SET search_path TO {schema}')
+    for migration in sorted(MIGRATIONS.glob('V*.sql')):
+        cur.execute(migration.read_text())
+
+    cur.execute(
+        """INSERT INTO users (email, name, email_verified, premium_until, premium_type)
+           VALUES ('loadtest@example.com', 'Load Test', TRUE, NOW() + INTERVAL '30 days', 'pro_analytics')
+           ON CONFLICT ((LOWER(email))) DO UPDATE SET name = EXCLUDED.name
+           RETURNING id"""
+    )
+    user_id = cur.fetchone()[0]
+    cur.execute(
+        "INSERT INTO statistics (user_id, action_type) SELECT %s, 'visit' FROM generate_series(1, 50)",
+        (user_id,)
+    )
+    conn.close()
+    return user_id
+
+
+# =============================================================================
+# SCENARIOS
+# =============================================================================
+
+def load_handlers(names: list, variant: str = 'sync') -> dict:
+    """Import each function's index.py (or index_async.py) under a unique module name."""
+    handlers = {}
+    for name in names:
+        prefix = f'loadtest_{variant}_{name.replace("-", "_")}'
+        module = import_module(FUNCTIONS[name] / 'index.py', prefix)
+        async_path = FUNCTIONS[name] / 'index_async.py'
+        if variant == 'async' and async_path.exists():
+            # index_async.py does `import index`; point it at this copy while it loads
+            previous = sys.modules.get('index')
+            sys.modules['index'] = module
+            try:
+                module = import_module(async_path, f'{prefix}_async')
+            finally:
+                if previous is None:
+                    sys.modules.pop('index', None)
+                else:
+                    sys.modules['index'] = previous
+        handlers[name] = module.handler
+    return handlers
+
+
+def tests_json_scenarios(names: list) -> list:
+    """Scenarios replayed from the functions' tests.json files."""
+    scenarios = []
+    for name in names:
+        tests_file = FUNCTIONS[name] / 'tests.json'
+        if not tests_file.exists():
+            continue
+        for test in json.loads(tests_file.read_text())['tests']:
+            url = urlsplit(test.get('path', '/'))
+            scenarios.append({
+                'name': f"{name}: {test['name']}",
+                'function': name,
+                'method': test.get('method', 'GET'),
+                'query': dict(parse_qsl(url.query)),
+                'body': test.get('body'),
+                'authenticated': False,
+                'expected_status': test.get('expectedStatus'),
+            })
+    return scenarios
+
+
+def mix_scenarios(mix: str, names: list) -> list:
+    """Weighted synthetic scenarios from MIXES, limited to the loaded functions."""
+    scenarios = []
+    for weight, function, method, query, body, authenticated, expected, *label in MIXES[mix]:
+        if function not in names:
+            continue
+        endpoint = query.get('endpoint') or query.get('action') or ''
+        scenario = {
+            'name': f'{function}: {label[0]}' if label else f'{function}: {method} {endpoint}'.rstrip(),
+            'function': function,
+            'method': method,
+            'query': query,
+            'body': json.dumps(body, ensure_ascii=False) if body is not None else None,
+            'authenticated': authenticated,
+            'expected_status': expected,
+        }
+        scenarios.extend([scenario] * weight)
+    return scenarios
+
+
+def needs_database(scenario: dict) -> bool:
+    """Authenticated calls read the seeded user; ai-assistant falls back to the free tier without one."""
+    return scenario['authenticated'] and scenario['function'] != 'ai-assistant'
+
+
+def build_event(scenario: dict, token: str) -> dict:
+    headers = {'origin': 'http://localhost:5173'}
+    if scenario['authenticated'] and token:
+        headers['X-Authorization'] = f'Bearer {token}'
+    event = {
+        'httpMethod': scenario['method'],
+        'headers': headers,
+        'queryStringParameters': dict(scenario['query']),
+        'isBase64Encoded': False,
+    }
+    if scenario['body'] is not None:
+        event['body'] = scenario['body']
+    return event
+
+
+# =============================================================================
+# RUNNER
+# =============================================================================
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def run_load(handlers: dict, scenarios: list, total: int, concurrency: int, token: str, seed: int = 1) -> dict:
+    """Fire `total` requests drawn from `scenarios` across `concurrency` threads."""
+    rng = random.Random(seed)
+    plan = [rng.choice(scenarios) for _ in range(total)]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def call(scenario: dict):
+        event = build_event(scenario, token)
+        context = SimpleNamespace(function_name=scenario['function'], request_id=f'load-{time.monotonic_ns()}')
+        start = time.perf_counter()
+        try:
+            result = handlers[scenario['function']](event, context)
+            ok = scenario['expected_status'] is None or result.get('statusCode') == scenario['expected_status']
+        except Exception:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies[scenario['name']].append(elapsed)
+            if not ok:
+                errors[scenario['name']] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, plan))
+    wall = time.perf_counter() - started
+
+    return {'wall_s': wall, 'latencies': dict(latencies), 'errors': dict(errors)}
+
+
+async def run_load_async(handlers: dict, scenarios: list, total: int, concurrency: int, token: str, seed: int = 1) -> dict:
+    """Same plan as run_load, with at most `concurrency` requests in flight on one event loop."""
+    rng = random.Random(seed)
+    plan = [rng.choice(scenarios) for _ in range(total)]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(scenario: dict):
+        event = build_event(scenario, token)
+        context = SimpleNamespace(function_name=scenario['function'], request_id=f'load-{time.monotonic_ns()}')
+        handler = handlers[scenario['function']]
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if inspect.iscoroutinefunction(handler):
+                    result = await handler(event, context)
+                else:
+                    result = await asyncio.to_thread(handler, event, context)
+                ok = scenario['expected_status'] is None or result.get('statusCode') == scenario['expected_status']
+            except Exception:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+        latencies[scenario['name']].append(elapsed)
+        if not ok:
+            errors[scenario['name']] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(scenario) for scenario in plan))
+    wall = time.perf_counter() - started
+
+    return {'wall_s': wall, 'latencies': dict(latencies), 'errors': dict(errors)}
+
+
+def summarize(results: dict) -> tuple:
+    """(requests per second, overall p95 ms, error count) for one run."""
+    values = sorted(v for vs in results['latencies'].values() for v in vs)
+    return len(values) / results['wall_s'], percentile(values, 95), sum(results['errors'].values())
+
+
+def report(results: dict, title: str = '') -> None:
+    wall = results['wall_s']
+    total = sum(len(v) for v in results['latencies'].values())
+    if title:
+        print(title)
+    print(f'{"endpoint":44} {"count":>6} {"err":>5} {"rps":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for name, values in sorted(results['latencies'].items()):
+        values = sorted(values)
+        print(f'{name[:44]:44} {len(values):>6} {results["errors"].get(name, 0):>5} {len(values) / wall:>8.1f} '
+              f'{percentile(values, 50):>8.2f} {percentile(values, 95):>8.2f} {percentile(values, 99):>8.2f}')
+    print(f'{"total":44} {total:>6} {sum(results["errors"].values()):>5} {total / wall:>8.1f}   wall {wall:.2f} s')
+
+
+def issue_token(database_url: str, schema: str, user_id: int) -> str:
+    """Access token for the seeded user with its premium claims, signed the same way the api function does."""
+    import psycopg2
+
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    cur.execute(f'SELECT premium_until, premium_type, birthday FROM {schema}.users WHERE id = %s', (user_id,))
+    premium = cur.fetchone()
+    conn.close()
+    return import_module(FUNCTIONS['api'] / 'index.py', 'loadtest_api_tokens').create_jwt(user_id, premium)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--functions', nargs='+', default=['api', 'passwords', 'documents', 'ai-assistant'], choices=list(FUNCTIONS))
+    parser.add_argument('--mix', choices=['tests', *MIXES], default='tests')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--database-url', help='use an existing database instead of starting a throwaway cluster')
+    parser.add_argument('--schema', default='loadtest')
+    parser.add_argument('--no-database', action='store_true', help='skip the database and every scenario that needs one')
+    parser.add_argument('--variant', nargs='+', choices=['sync', 'async'], default=['sync'],
+                        help='handler implementations to run; async uses index_async.py where present')
+    parser.add_argument('--replica', action='store_true', help='start a streaming standby and route reads to it')
+    parser.add_argument('--read-url', help='existing read replica for DATABASE_READ_URL')
+    args = parser.parse_args()
+
+    os.environ.setdefault('JWT_SECRET', 'loadtest-secret-key-loadtest-secret-key')
+    os.environ.setdefault('METRICS_SAMPLE_RATE', '0')
+    os.environ.setdefault('WEATHER_PROVIDER', 'static')
+
+    stops = []
+    token = ''
+    if not args.no_database:
+        database_url = args.database_url
+        if not database_url:
+            database_url, stop = start_postgres()
+            stops.append(stop)
+        os.environ['DATABASE_URL'] = database_url
+        os.environ['MAIN_DB_SCHEMA'] = args.schema
+        token = issue_token(database_url, args.schema, prepare_database(database_url, args.schema))
+
+        read_url = args.read_url
+        if args.replica and not read_url:
+            read_url, stop = start_replica(database_url)
+            stops.append(stop)
+        if read_url:
+            os.environ['DATABASE_READ_URL'] = read_url
+
+    try:
+        scenarios = tests_json_scenarios(args.functions) if args.mix == 'tests' else mix_scenarios(args.mix, args.functions)
+        if args.no_database:
+            scenarios = [scenario for scenario in scenarios if not needs_database(scenario)]
+        if not scenarios:
+            raise SystemExit('no scenarios for the selected functions')
+
+        summary = []
+        for variant in args.variant:
+            handlers = load_handlers(args.functions, variant)
+            for concurrency in args.concurrency:
+                if variant == 'async':
+                    results = asyncio.run(run_load_async(handlers, scenarios, args.requests, concurrency, token))
+                else:
+                    results = run_load(handlers, scenarios, args.requests, concurrency, token)
+                report(results, f'\n== variant={variant} mix={args.mix} concurrency={concurrency} requests={args.requests}')
+                summary.append((variant, concurrency, *summarize(results)))
+
+        if len(args.variant) > 1:
+            print(f'\n{"variant":8} {"conc":>5} {"rps":>9} {"p95 ms":>8} {"err":>5}')
+            for variant, concurrency, rps, p95, errors in summary:
+                print(f'{variant:8} {concurrency:>5} {rps:>9.1f} {p95:>8.2f} {errors:>5}')
+    finally:
+        for stop in reversed(stops):
+            stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
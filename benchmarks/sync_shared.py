@@ -0,0 +1,66 @@
+"""Keep the helper blocks that the backend functions share in sync with backend/api.
+
+    python benchmarks/sync_shared.py           # copy every block from backend/api into the other functions
+    python benchmarks/sync_shared.py --check   # exit 1 and list the copies that drifted
+
+Each function is deployed from its own directory, so helpers such as
+instrumented(), the replica routing, compress_response() or idempotent() cannot
+be imported from a common module. backend/api is the single source instead:
+the lines between `# >>> shared: <name> ...` and `# <<< shared: <name>` in
+backend/api/index.py (or index_async.py for the connection pool and the async
+wrappers) are copied verbatim into every other backend file that carries the
+same markers. Edit the block in backend/api and re-run this script; a function
+that does not need a block simply has no markers for it.
+"""
+import argparse
+import re
+import sys
+
+from _util import FUNCTIONS, ROOT
+
+SOURCES = [FUNCTIONS['api'] / 'index.py', FUNCTIONS['api'] / 'index_async.py']
+
+BLOCK_RE = re.compile(r'^(# >>> shared: (?P<name>[\w-]+)[^\n]*\n)(?P<body>.*?)^(# <<< shared: (?P=name)\n)', re.M | re.S)
+
+
+def source_blocks() -> dict:
+    """name -> block body as written in backend/api."""
+    blocks = {}
+    for path in SOURCES:
+        for match in BLOCK_RE.finditer(path.read_text()):
+            if match['name'] in blocks:
+                raise SystemExit(f'shared block {match["name"]!r} is defined twice in backend/api')
+            blocks[match['name']] = match['body']
+    return blocks
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--check', action='store_true', help='only report drifted copies, do not rewrite them')
+    args = parser.parse_args()
+
+    blocks = source_blocks()
+    drifted = []
+    for path in sorted((ROOT / 'backend').rglob('*.py')):
+        if path in SOURCES:
+            continue
+        text = path.read_text()
+
+        def replace(match):
+            if match['name'] not in blocks:
+                raise SystemExit(f'{path.relative_to(ROOT)}: no shared block {match["name"]!r} in backend/api')
+            if match['body'] != blocks[match['name']]:
+                drifted.append(f'{path.relative_to(ROOT)}: {match["name"]}')
+            return match.group(1) + blocks[match['name']] + match.group(4)
+
+        synced = BLOCK_RE.sub(replace, text)
+        if not args.check and synced != text:
+            path.write_text(synced)
+
+    for line in drifted:
+        print(f'{"drifted" if args.check else "updated"}: {line}')
+    return 1 if args.check and drifted else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+UPDATE users SET email = LOWER(TRIM(email)) WHERE email IS NOT NULL AND email <> LOWER(TRIM(email));
+UPDATE users SET email = NULL WHERE email = '';
+
+-- Existing data may already hold duplicate identities: earlier VK logins created a second
+-- account for an email that was registered by password, and VK emails were not lowercased.
+-- Duplicates are merged into the oldest account before the unique indexes are built.
+CREATE OR REPLACE FUNCTION pg_temp.merge_user(duplicate_id INTEGER, keeper_id INTEGER) RETURNS VOID AS $$
+BEGIN
+    UPDATE refresh_tokens SET user_id = keeper_id WHERE user_id = duplicate_id;
+    UPDATE passwords SET user_id = keeper_id WHERE user_id = duplicate_id;
+    UPDATE documents SET user_id = keeper_id WHERE user_id = duplicate_id;
+    UPDATE statistics SET user_id = keeper_id WHERE user_id = duplicate_id;
+
+    UPDATE users k SET
+        vk_id = COALESCE(k.vk_id, d.vk_id),
+        email = COALESCE(k.email, d.email),
+        name = COALESCE(k.name, d.name),
+        avatar_url = COALESCE(k.avatar_url, d.avatar_url),
+        birthday = COALESCE(k.birthday, d.birthday),
+        email_verified = COALESCE(k.email_verified, FALSE) OR COALESCE(d.email_verified, FALSE),
+        premium_type = CASE WHEN d.premium_until > COALESCE(k.premium_until, '-infinity') THEN d.premium_type ELSE k.premium_type END,
+        premium_until = GREATEST(k.premium_until, d.premium_until),
+        last_login_at = GREATEST(k.last_login_at, d.last_login_at)
+    FROM users d
+    WHERE k.id = keeper_id AND d.id = duplicate_id;
+
+    DELETE FROM users WHERE id = duplicate_id;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    dup RECORD;
+    keeper RECORD;
+BEGIN
+    -- Several accounts with the same vk_id: one account
+    FOR dup IN
+        SELECT id, MIN(id) OVER (PARTITION BY vk_id) AS keeper_id
+        FROM users WHERE vk_id IS NOT NULL ORDER BY id
+    LOOP
+        IF dup.id <> dup.keeper_id THEN
+            PERFORM pg_temp.merge_user(dup.id, dup.keeper_id);
+        END IF;
+    END LOOP;
+
+    -- Several accounts with the same email: merged unless both are linked to different
+    -- VK accounts, in which case the newer one keeps its VK login and drops the email
+    FOR dup IN
+        SELECT id, MIN(id) OVER (PARTITION BY email) AS keeper_id
+        FROM users WHERE email IS NOT NULL ORDER BY id
+    LOOP
+        CONTINUE WHEN dup.id = dup.keeper_id;
+        SELECT vk_id INTO keeper FROM users WHERE id = dup.keeper_id;
+        IF keeper.vk_id IS NULL OR (SELECT vk_id IS NULL OR vk_id = keeper.vk_id FROM users WHERE id = dup.id) THEN
+            PERFORM pg_temp.merge_user(dup.id, dup.keeper_id);
+        ELSE
+            UPDATE users SET email = NULL WHERE id = dup.id;
+        END IF;
+    END LOOP;
+END $$;
+
+DROP INDEX IF EXISTS idx_users_vk_id;
+DROP INDEX IF EXISTS idx_users_email;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_vk_id_unique ON users(vk_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_unique ON users(LOWER(email));
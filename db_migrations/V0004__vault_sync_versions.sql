@@ -0,0 +1,8 @@
+ALTER TABLE users ADD COLUMN IF NOT EXISTS vault_version BIGINT NOT NULL DEFAULT 0;
+
+ALTER TABLE passwords ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE passwords ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+
+UPDATE passwords SET deleted_at = COALESCE(updated_at, CURRENT_TIMESTAMP) WHERE encrypted_password = '' AND deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_passwords_user_version ON passwords(user_id, version);
@@ -0,0 +1,3 @@
+ALTER TABLE passwords ADD COLUMN IF NOT EXISTS site_domain VARCHAR(255);
+
+CREATE INDEX IF NOT EXISTS idx_passwords_user_domain ON passwords(user_id, site_domain) WHERE deleted_at IS NULL;
@@ -0,0 +1,5 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_passwords_search_trgm ON passwords
+  USING GIN ((COALESCE(site_name, '') || ' ' || site_url || ' ' || COALESCE(username, '')) gin_trgm_ops)
+  WHERE deleted_at IS NULL;
@@ -0,0 +1,4 @@
+ALTER TABLE passwords ADD COLUMN IF NOT EXISTS password_fingerprint VARCHAR(64);
+ALTER TABLE passwords ADD COLUMN IF NOT EXISTS strength SMALLINT;
+
+CREATE INDEX IF NOT EXISTS idx_passwords_user_fingerprint ON passwords(user_id, password_fingerprint) WHERE deleted_at IS NULL;
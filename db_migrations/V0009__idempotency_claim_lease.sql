@@ -0,0 +1 @@
+ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
@@ -0,0 +1,13 @@
+"""Helpers shared by the jobs in this directory (run them from any cwd: python scripts/<job>.py)."""
+import importlib.util
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_function(name: str, module_name: str):
+    """A function's backend/<name>/index.py as a module, with the same settings as the deployed function."""
+    spec = importlib.util.spec_from_file_location(module_name, ROOT / 'backend' / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,65 @@
+"""Fill in password fingerprints and strength scores for rows saved before V0007.
+
+    DATABASE_URL=postgresql://... JWT_SECRET=... python scripts/backfill_fingerprints.py
+
+    # recompute every row, e.g. after PASSWORD_FINGERPRINT_KEY was set or rotated
+    python scripts/backfill_fingerprints.py --rekey
+
+The passwords function computes both values at write time and its security
+report skips rows that have none, so this is a one-off job run against the
+primary with the same JWT_SECRET, PASSWORD_FINGERPRINT_KEY and MAIN_DB_SCHEMA
+as the deployed function. It walks the table in id order and commits every
+--batch rows, so it can be interrupted and run again.
+"""
+import argparse
+import os
+import sys
+import time
+
+from _util import load_function
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--rekey', action='store_true', help='recompute rows that already have a fingerprint')
+    args = parser.parse_args()
+
+    if not args.database_url:
+        raise SystemExit('pass --database-url or set DATABASE_URL')
+    if not os.environ.get('JWT_SECRET'):
+        raise SystemExit('JWT_SECRET must match the deployed function to decrypt the vault')
+
+    import psycopg2
+
+    passwords = load_function('passwords', 'backfill_passwords')
+    conn = psycopg2.connect(args.database_url)
+    cur = conn.cursor()
+    started = time.perf_counter()
+    last_id, updated = 0, 0
+    while True:
+        cur.execute(
+            f"SELECT id, user_id, encrypted_password FROM {passwords.SCHEMA}passwords "
+            "WHERE id > %s AND deleted_at IS NULL AND (%s OR password_fingerprint IS NULL) ORDER BY id LIMIT %s",
+            (last_id, args.rekey, args.batch)
+        )
+        rows = cur.fetchall()
+        if not rows:
+            break
+        updates = []
+        for password_id, user_id, encrypted in rows:
+            password = passwords.decrypt_password(encrypted)
+            updates.append((passwords.password_fingerprint(user_id, password), passwords.password_strength(password), password_id))
+        cur.executemany(f"UPDATE {passwords.SCHEMA}passwords SET password_fingerprint = %s, strength = %s WHERE id = %s", updates)
+        conn.commit()
+        last_id = rows[-1][0]
+        updated += len(rows)
+
+    conn.close()
+    print(f'{updated} rows updated in {time.perf_counter() - started:.1f} s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
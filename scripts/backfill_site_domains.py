@@ -0,0 +1,56 @@
+"""Fill in passwords.site_domain for rows saved before V0005.
+
+    DATABASE_URL=postgresql://... MAIN_DB_SCHEMA=... python scripts/backfill_site_domains.py
+
+Autofill looks credentials up by site_domain only, so rows that predate the
+column are not offered until this job has run. The registrable domain comes
+from the public suffix list bundled with the passwords function, which is why
+this is a script and not a SQL migration. It walks the table in id order and
+commits every --batch rows, so it can be interrupted and run again.
+"""
+import argparse
+import os
+import sys
+import time
+
+from _util import load_function
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--batch', type=int, default=1000)
+    args = parser.parse_args()
+
+    if not args.database_url:
+        raise SystemExit('pass --database-url or set DATABASE_URL')
+
+    import psycopg2
+
+    passwords = load_function('passwords', 'backfill_passwords')
+    conn = psycopg2.connect(args.database_url)
+    cur = conn.cursor()
+    started = time.perf_counter()
+    last_id, updated = 0, 0
+    while True:
+        cur.execute(
+            f"SELECT id, site_url FROM {passwords.SCHEMA}passwords "
+            "WHERE id > %s AND site_domain IS NULL AND deleted_at IS NULL ORDER BY id LIMIT %s",
+            (last_id, args.batch)
+        )
+        rows = cur.fetchall()
+        if not rows:
+            break
+        updates = [(passwords.registrable_domain(passwords.site_host(site_url)), password_id) for password_id, site_url in rows]
+        cur.executemany(f"UPDATE {passwords.SCHEMA}passwords SET site_domain = %s WHERE id = %s", updates)
+        conn.commit()
+        last_id = rows[-1][0]
+        updated += len(rows)
+
+    conn.close()
+    print(f'{updated} rows updated in {time.perf_counter() - started:.1f} s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
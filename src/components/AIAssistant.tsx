@@ -4,6 +4,7 @@ import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import Icon from "@/components/ui/icon";
 import { toast } from "sonner";
+import { authFetch } from "@/lib/api";
 
 interface AIAssistantProps {
   isPremium: boolean;
@@ -20,22 +21,52 @@ export const AIAssistant = ({ isPremium, onClose }: AIAssistantProps) => {
     if (!query.trim()) return;
 
     setIsLoading(true);
+    setResponse("");
     try {
-      const res = await fetch('https://functions.poehali.dev/9c3d2126-c1d0-42ba-8b4d-6d58875b60cb', {
+      const res = await authFetch('https://functions.poehali.dev/9c3d2126-c1d0-42ba-8b4d-6d58875b60cb', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ query, is_premium: isPremium })
+        body: JSON.stringify({ query, stream: true })
       });
-      
-      const data = await res.json();
-      setResponse(data.response);
-      
-      if ('speechSynthesis' in window) {
-        const utterance = new SpeechSynthesisUtterance(data.response);
-        utterance.lang = 'ru-RU';
-        utterance.rate = 1;
-        utterance.pitch = 1;
-        window.speechSynthesis.speak(utterance);
+
+      if (!res.body || !res.headers.get('Content-Type')?.includes('text/event-stream')) {
+        const data = await res.json();
+        setResponse(data.response);
+        speak(data.response);
+        return;
+      }
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let text = "";
+      let spoken = 0;
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split("\n\n");
+        buffer = events.pop() || "";
+        for (const event of events) {
+          if (!event.startsWith("data: ")) continue;
+          const data = JSON.parse(event.slice(6));
+          if (data.delta) {
+            text += data.delta;
+            setResponse(text);
+          }
+        }
+
+        const sentenceEnd = Math.max(text.lastIndexOf(". "), text.lastIndexOf("! "), text.lastIndexOf("? "));
+        if (sentenceEnd + 1 > spoken) {
+          speak(text.slice(spoken, sentenceEnd + 1));
+          spoken = sentenceEnd + 1;
+        }
+      }
+
+      if (spoken < text.length) {
+        speak(text.slice(spoken));
       }
     } catch (error) {
       toast.error("Ошибка связи с помощником");
@@ -44,6 +75,16 @@ export const AIAssistant = ({ isPremium, onClose }: AIAssistantProps) => {
     }
   };
 
+  const speak = (text: string) => {
+    if (!text.trim() || !('speechSynthesis' in window)) return;
+
+    const utterance = new SpeechSynthesisUtterance(text);
+    utterance.lang = 'ru-RU';
+    utterance.rate = 1;
+    utterance.pitch = 1;
+    window.speechSynthesis.speak(utterance);
+  };
+
   const startVoiceInput = () => {
     if (!('webkitSpeechRecognition' in window) && !('SpeechRecognition' in window)) {
       toast.error("Голосовой ввод не поддерживается");
@@ -0,0 +1,53 @@
+const API_URL = "https://functions.poehali.dev/a3a0af1c-7961-4fbc-af29-a0ada5ae4da7";
+
+let refreshing: Promise<boolean> | null = null;
+
+// Responses to writes carry X-Last-Write; sending it back with later reads lets the backend
+// skip a read replica that has not replayed our write yet (any function, any instance)
+export const rememberWrite = (res: Response) => {
+  const lastWrite = res.headers.get("X-Last-Write");
+  if (lastWrite) localStorage.setItem("lastWrite", lastWrite);
+};
+
+// The access token lives for an hour; the 30-day refresh token from login buys a new one
+const refreshAccessToken = async (): Promise<boolean> => {
+  const refreshToken = localStorage.getItem("refreshToken");
+  if (!refreshToken) return false;
+
+  try {
+    const res = await fetch(`${API_URL}?endpoint=refresh`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ refresh_token: refreshToken }),
+    });
+    if (!res.ok) return false;
+    const data = await res.json();
+    localStorage.setItem("accessToken", data.access_token);
+    return true;
+  } catch {
+    return false;
+  }
+};
+
+// fetch with the stored access token and write marker; on 401 refreshes the token once
+// (shared by concurrent calls) and retries
+export const authFetch = async (url: string, init: RequestInit = {}): Promise<Response> => {
+  const send = async () => {
+    const headers = new Headers(init.headers);
+    const token = localStorage.getItem("accessToken");
+    const lastWrite = localStorage.getItem("lastWrite");
+    if (token) headers.set("X-Authorization", `Bearer ${token}`);
+    if (lastWrite) headers.set("X-Last-Write", lastWrite);
+    const res = await fetch(url, { ...init, headers });
+    rememberWrite(res);
+    return res;
+  };
+
+  const res = await send();
+  if (res.status !== 401) return res;
+
+  refreshing ??= refreshAccessToken().finally(() => {
+    refreshing = null;
+  });
+  return (await refreshing) ? send() : res;
+};
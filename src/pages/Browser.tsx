@@ -7,6 +7,7 @@ import Icon from "@/components/ui/icon";
 import { toast } from "sonner";
 import { AIAssistant } from "@/components/AIAssistant";
 import { VoiceInput } from "@/components/VoiceInput";
+import { authFetch } from "@/lib/api";
 
 const Browser = () => {
   const navigate = useNavigate();
@@ -18,11 +19,8 @@ const Browser = () => {
   const iframeRef = useRef<HTMLIFrameElement>(null);
 
   useEffect(() => {
-    const token = localStorage.getItem('accessToken');
-    if (token) {
-      fetch('https://functions.poehali.dev/a3a0af1c-7961-4fbc-af29-a0ada5ae4da7?endpoint=premium', {
-        headers: { 'X-Authorization': `Bearer ${token}` }
-      })
+    if (localStorage.getItem('accessToken')) {
+      authFetch('https://functions.poehali.dev/a3a0af1c-7961-4fbc-af29-a0ada5ae4da7?endpoint=premium')
         .then(r => r.json())
         .then(data => setIsPremium(data.is_premium || data.is_birthday))
         .catch(() => {});
@@ -7,6 +7,7 @@ import Icon from "@/components/ui/icon";
 import { toast } from "sonner";
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from "@/components/ui/dialog";
 import { Label } from "@/components/ui/label";
+import { authFetch } from "@/lib/api";
 
 const PasswordManager = () => {
   const navigate = useNavigate();
@@ -27,9 +28,7 @@ const PasswordManager = () => {
     }
 
     try {
-      const res = await fetch('https://functions.poehali.dev/f3a3b6e2-b4ed-4905-911f-d0fcb782154d', {
-        headers: { 'X-Authorization': `Bearer ${token}` }
-      });
+      const res = await authFetch('https://functions.poehali.dev/f3a3b6e2-b4ed-4905-911f-d0fcb782154d');
       const data = await res.json();
       setPasswords(data.passwords || []);
     } catch (error) {
@@ -38,16 +37,15 @@ const PasswordManager = () => {
   };
 
   const savePassword = async () => {
-    const token = localStorage.getItem('accessToken');
     if (!newPassword.site_url || !newPassword.password) {
       toast.error("Заполните URL и пароль");
       return;
     }
 
     try {
-      await fetch('https://functions.poehali.dev/f3a3b6e2-b4ed-4905-911f-d0fcb782154d', {
+      await authFetch('https://functions.poehali.dev/f3a3b6e2-b4ed-4905-911f-d0fcb782154d', {
         method: 'POST',
-        headers: { 'X-Authorization': `Bearer ${token}`, 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(newPassword)
       });
       